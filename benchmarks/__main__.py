@@ -0,0 +1,94 @@
+"""Benchmarks of the bot against local fakes of Telegram and Google, results are printed as JSON.
+
+    python -m benchmarks                                  # all scenarios with their default sizes
+    python -m benchmarks many_users --users 20 --mode spool
+    python -m benchmarks big_file --file-size 512MiB --output big_file.json
+"""
+import re
+import sys
+import json
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from . import fake_google, runner
+
+_PRESETS = {
+    'many_users': {'users': 100, 'files': 10, 'file_size': 1024 ** 2, 'rate': 200.0},
+    'big_file': {'users': 1, 'files': 1, 'file_size': 2 * 1024 ** 3, 'rate': 0.0},
+    'session_setup': {'users': 1000, 'files': 0, 'file_size': 0, 'rate': 0.0},
+    'db_layer': {'users': 200, 'files': 10, 'file_size': 0, 'rate': 0.0},
+}
+
+_SIZE_UNITS = {'': 1, 'b': 1, 'kib': 1024, 'mib': 1024 ** 2, 'gib': 1024 ** 3}
+
+
+def parse_size(size: str) -> int:
+    if (match := re.fullmatch(r"(\d+)\s*([a-z]*)", size.strip().lower())) is None or match[2] not in _SIZE_UNITS:
+        raise argparse.ArgumentTypeError(f"Bad size '{size}', use bytes or KiB, MiB, GiB suffixes.")
+    return int(match[1]) * _SIZE_UNITS[match[2]]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenarios", nargs="*", choices=[[], *_PRESETS], default=list(_PRESETS),
+                        metavar="scenario", help=f"Scenarios to run: {', '.join(_PRESETS)}.")
+    parser.add_argument("--users", type=int, help="Number of users.")
+    parser.add_argument("--files", type=int, help="Number of files (or DB transfers) per user.")
+    parser.add_argument("--file-size", type=parse_size, help="Size of every file, e.g. 1MiB.")
+    parser.add_argument("--rate", type=float, help="Arrivals per second, 0 sends everything at once.")
+    parser.add_argument("--mode", choices=("stream", "spool", "memory"), default="stream",
+                        help="TRANSFER_MODE of the bot.")
+    parser.add_argument("--global-limit", type=int, help="TRANSFER_GLOBAL_LIMIT of the bot.")
+    parser.add_argument("--per-user-limit", type=int, help="TRANSFER_PER_USER_LIMIT of the bot.")
+    parser.add_argument("--chunk-delay", type=float, default=0.0,
+                        help="Seconds Telegram takes to send every 1 MiB part.")
+    parser.add_argument("--drive-latency", type=float, default=0.0,
+                        help="Seconds added to every request to the fake Google server.")
+    parser.add_argument("--output", help="File to write results to instead of stdout.")
+    return parser.parse_args()
+
+
+def scenario_options(args, scenario: str) -> dict:
+    options = dict(_PRESETS[scenario])
+    for name in options:
+        if (value := getattr(args, name)) is not None:
+            options[name] = value
+
+    options.update(mode=args.mode, chunk_delay=args.chunk_delay, drive_latency=args.drive_latency,
+                   global_limit=args.global_limit, per_user_limit=args.per_user_limit)
+    return options
+
+
+def main():
+    args = parse_args()
+    # Processes are spawned, so none of them inherits the state of another one.
+    context = multiprocessing.get_context("spawn")
+
+    receiver, sender = context.Pipe(duplex=False)
+    server = context.Process(target=fake_google.serve, args=(sender, args.drive_latency), daemon=True)
+    server.start()
+    base_url = f"http://127.0.0.1:{receiver.recv()}"
+
+    results = []
+    try:
+        for scenario in args.scenarios:
+            print(f"Running '{scenario}'...", file=sys.stderr)
+            # Every scenario gets a new process, so peak memory and metrics are its own.
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                results.append(executor.submit(runner.run, scenario, scenario_options(args, scenario),
+                                               base_url).result())
+    finally:
+        server.terminate()
+
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
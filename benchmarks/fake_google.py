@@ -0,0 +1,198 @@
+import time
+import uuid
+import asyncio
+import hashlib
+from collections import Counter
+
+from aiohttp import web
+
+_FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+
+def drive_discovery_document(base_url: str) -> dict:
+    """The part of Drive v3 discovery document used by the bot, pointing to the fake server."""
+    def method(method_id, http_method, path, parameters=(), path_parameters=(), media_upload=False):
+        spec = {
+            'id': method_id,
+            'httpMethod': http_method,
+            'path': path,
+            'parameters': {
+                **{name: {'type': 'string', 'location': 'path', 'required': True} for name in path_parameters},
+                **{name: {'type': 'string', 'location': 'query'} for name in parameters},
+            },
+            'parameterOrder': list(path_parameters),
+            'supportsMediaUpload': media_upload,
+        }
+        if media_upload:
+            spec['mediaUpload'] = {
+                'accept': ['*/*'],
+                'maxSize': '5120GB',
+                'protocols': {
+                    'simple': {'multipart': True, 'path': '/upload/drive/v3/files'},
+                    'resumable': {'multipart': True, 'path': '/resumable/upload/drive/v3/files'},
+                },
+            }
+        return spec
+
+    return {
+        'kind': 'discovery#restDescription',
+        'id': 'drive:v3',
+        'name': 'drive',
+        'version': 'v3',
+        'rootUrl': f"{base_url}/",
+        'servicePath': 'drive/v3/',
+        'batchPath': 'batch/drive/v3',
+        'parameters': {'fields': {'type': 'string', 'location': 'query'}},
+        'schemas': {},
+        'resources': {
+            'files': {'methods': {
+                'create': method('drive.files.create', 'POST', 'files', ('uploadType',), media_upload=True),
+                'get': method('drive.files.get', 'GET', 'files/{fileId}', path_parameters=('fileId',)),
+                'list': method('drive.files.list', 'GET', 'files', ('q', 'pageSize', 'pageToken', 'orderBy')),
+            }},
+            'about': {'methods': {
+                'get': method('drive.about.get', 'GET', 'about'),
+            }},
+            'permissions': {'methods': {
+                'create': method('drive.permissions.create', 'POST', 'files/{fileId}/permissions',
+                                 path_parameters=('fileId',)),
+            }},
+        },
+    }
+
+
+class FakeGoogle:
+    """Local stand-in for the OAuth token endpoint and the Drive calls made by the bot.
+
+    Uploaded bytes are only hashed and counted, so files of any size fit. Every request
+    is counted by its route and delayed by `latency` to emulate the round trip to Google.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self._latency = latency
+        self._calls = Counter()
+        self._sessions = {}
+        self._files = {}
+        self._started_at = time.monotonic()
+
+    def application(self) -> web.Application:
+        app = web.Application(middlewares=[self._count_calls], client_max_size=1024 ** 3)
+        app.add_routes([
+            web.post('/token', self._token),
+            web.post('/upload/drive/v3/files', self._create_file_upload),
+            web.put('/upload/session/{session_id}', self._upload_chunk),
+            web.get('/drive/v3/files', self._list_files),
+            web.post('/drive/v3/files', self._create_file),
+            web.get('/drive/v3/files/{file_id}', self._get_file),
+            web.get('/drive/v3/about', self._about),
+            web.post('/drive/v3/files/{file_id}/permissions', self._create_permission),
+            web.get('/_stats', self._stats),
+            web.post('/_reset', self._reset),
+        ])
+        return app
+
+    @web.middleware
+    async def _count_calls(self, request: web.Request, handler):
+        if not request.path.startswith('/_'):
+            self._calls[f"{request.method} {request.match_info.route.resource.canonical}"] += 1
+            if self._latency:
+                await asyncio.sleep(self._latency)
+        return await handler(request)
+
+    async def _stats(self, _request: web.Request):
+        return web.json_response({'calls': dict(self._calls), 'files': len(self._files)})
+
+    async def _reset(self, _request: web.Request):
+        self._calls.clear()
+        self._sessions.clear()
+        self._files.clear()
+        return web.json_response({})
+
+    async def _token(self, _request: web.Request):
+        return web.json_response({
+            'access_token': uuid.uuid4().hex,
+            'expires_in': 3600,
+            'token_type': 'Bearer',
+            'scope': 'https://www.googleapis.com/auth/drive.file',
+        })
+
+    def _new_file(self, metadata: dict, md5: str = None) -> dict:
+        file_id = uuid.uuid4().hex
+        self._files[file_id] = {
+            'id': file_id,
+            'name': metadata.get('name'),
+            'mimeType': metadata.get('mimeType'),
+            'md5Checksum': md5,
+            'trashed': False,
+            'webViewLink': f"https://drive.example/file/{file_id}/view",
+            'webContentLink': f"https://drive.example/uc?id={file_id}",
+        }
+        return self._files[file_id]
+
+    async def _create_file_upload(self, request: web.Request):
+        if request.query.get('uploadType') == 'resumable':
+            session_id = uuid.uuid4().hex
+            self._sessions[session_id] = {
+                'metadata': await request.json(),
+                'total': int(request.headers['X-Upload-Content-Length']),
+                'received': 0,
+                'md5': hashlib.md5(),
+            }
+            return web.Response(headers={'Location': f"{request.scheme}://{request.host}/upload/session/{session_id}"})
+
+        # Multipart upload of a whole file, the body isn't inspected.
+        async for _data in request.content.iter_any():
+            pass
+        return web.json_response(self._new_file({'name': 'uploaded'}))
+
+    async def _upload_chunk(self, request: web.Request):
+        if (session := self._sessions.get(request.match_info['session_id'])) is None:
+            return web.Response(status=404)
+
+        content_range = request.headers['Content-Range']
+        if not content_range.startswith('bytes */'):
+            start = int(content_range[len('bytes '):].split('-', 1)[0])
+            if start != session['received']:
+                return web.Response(status=400, text="Unexpected chunk offset.")
+
+            async for data in request.content.iter_any():
+                session['md5'].update(data)
+                session['received'] += len(data)
+
+        if session['received'] == session['total']:
+            del self._sessions[request.match_info['session_id']]
+            return web.json_response(self._new_file(session['metadata'], session['md5'].hexdigest()))
+
+        headers = {'Range': f"bytes=0-{session['received'] - 1}"} if session['received'] else {}
+        return web.Response(status=308, headers=headers)
+
+    async def _list_files(self, _request: web.Request):
+        return web.json_response({'files': []})
+
+    async def _create_file(self, request: web.Request):
+        return web.json_response(self._new_file(await request.json()))
+
+    async def _get_file(self, request: web.Request):
+        if (file := self._files.get(request.match_info['file_id'])) is None:
+            return web.json_response({'error': {'code': 404}}, status=404)
+        return web.json_response(file)
+
+    async def _about(self, _request: web.Request):
+        # Drives of the fake are never full.
+        return web.json_response({'storageQuota': {'limit': str(1024 ** 5), 'usage': '0'}})
+
+    async def _create_permission(self, _request: web.Request):
+        return web.json_response({'id': 'anyoneWithLink'})
+
+
+def serve(port_pipe, latency: float = 0.0):
+    """Runs the fake server on a free local port until the process is terminated, sending the port to the pipe."""
+    async def start():
+        runner = web.AppRunner(FakeGoogle(latency).application(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port_pipe.send(runner.addresses[0][1])
+        await asyncio.Event().wait()
+
+    asyncio.run(start())
@@ -0,0 +1,145 @@
+import os
+import asyncio
+import itertools
+from io import BytesIO
+from typing import List, Union
+
+from core.tg_bot import GoogleDriveManager
+from core.tg_bot.download import ParallelDownloader
+
+# `stream_media` of Pyrogram yields parts of this size.
+_CHUNK_SIZE = 1024 * 1024
+# Content of every synthetic file is this block repeated, so files of any size cost nothing to produce.
+_BLOCK = os.urandom(_CHUNK_SIZE)
+
+_FINAL_MARKS = ("✅", "❌", "🚫", "⏸")
+
+_message_ids = itertools.count(1)
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+
+class FakeChat:
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+
+
+class FakeDocument:
+    def __init__(self, file_name: str, file_size: int, mime_type: str = 'application/octet-stream'):
+        self.file_name = file_name
+        self.file_size = file_size
+        self.mime_type = mime_type
+        self.file_id = file_name
+        self.file_unique_id = f"{file_name}:{next(_message_ids)}"
+
+
+class _EmptyMessage:
+    """What Pyrogram returns for a message which doesn't exist."""
+
+    def __init__(self, message_id: int):
+        self.id = message_id
+        self.empty = True
+        self.document = None
+
+
+class FakeMessage:
+    """Message which records the bot's replies and edits instead of sending them."""
+
+    def __init__(self, bot: "FakeTelegramBot", user_id: int, text: str = None, document: FakeDocument = None):
+        self.id = next(_message_ids)
+        self.empty = False
+        self.chat = FakeChat(user_id)
+        self.from_user = FakeUser(user_id)
+        self.text = text
+        self.document = document
+        self.replies: List["FakeMessage"] = []
+        self.final_text = None
+
+        self._bot = bot
+        self._finished = asyncio.get_running_loop().create_future()
+        bot.messages[(self.chat.id, self.id)] = self
+
+    async def reply(self, text: str, reply_markup=None) -> "FakeMessage":
+        self._bot.sent_messages += 1
+        reply = FakeMessage(self._bot, self.from_user.id, text)
+        self.replies.append(reply)
+        reply._set_text(text)
+        return reply
+
+    async def edit_text(self, text: str, reply_markup=None):
+        self._bot.edited_messages += 1
+        self._set_text(text)
+
+    def _set_text(self, text: str):
+        self.text = text
+        if text.startswith(_FINAL_MARKS) and not self._finished.done():
+            self.final_text = text
+            self._finished.set_result(text)
+
+    async def wait_finished(self) -> str:
+        """Waits until the message shows a final state of a transfer or a command."""
+        return await self._finished
+
+
+class FakeDownloader(ParallelDownloader):
+    """Parallel downloader fetching parts of synthetic files, each taking `chunk_delay` like a Telegram request."""
+
+    async def _open(self, document: FakeDocument) -> tuple:
+        return [None] * self._sessions.per_dc, document
+
+    async def _fetch_part(self, _session, document: FakeDocument, part: int) -> bytes:
+        return await self._client.fetch_part(document.file_size, part * _CHUNK_SIZE)
+
+
+class FakeTelegramBot(GoogleDriveManager):
+    """The bot with Telegram API calls replaced by synthetic data, it's never connected to Telegram."""
+
+    def __init__(self, *args, chunk_delay: float = 0.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._chunk_delay = chunk_delay
+        self.sent_messages = 0
+        self.edited_messages = 0
+        self.downloaded_bytes = 0
+        # (chat_id, message_id) -> every message sent to the bot or by it, so stored jobs can fetch them back.
+        self.messages = {}
+        self._downloader = FakeDownloader(self, self._media_sessions)
+
+    async def fetch_part(self, file_size: int, start: int) -> bytes:
+        # Emulates the time Telegram takes to send a part, and lets other transfers run.
+        await asyncio.sleep(self._chunk_delay)
+        chunk = _BLOCK[:min(_CHUNK_SIZE, file_size - start)]
+        self.downloaded_bytes += len(chunk)
+        return chunk
+
+    async def _file_chunks(self, file_size: int, offset: int = 0):
+        for start in range(offset, file_size, _CHUNK_SIZE):
+            yield await self.fetch_part(file_size, start)
+
+    async def stream_media(self, message: FakeMessage, limit: int = 0, offset: int = 0):
+        async for chunk in self._file_chunks(message.document.file_size, offset * _CHUNK_SIZE):
+            yield chunk
+
+    async def download_media(self, document: FakeDocument, file_name: str = None, in_memory: bool = False,
+                             progress=None, progress_args=()) -> Union[BytesIO, str]:
+        file = BytesIO() if in_memory else open(file_name, 'wb')
+        try:
+            async for chunk in self._file_chunks(document.file_size):
+                file.write(chunk)
+                if progress is not None:
+                    await progress(file.tell(), document.file_size, *progress_args)
+        finally:
+            if not in_memory:
+                file.close()
+
+        return file if in_memory else file_name
+
+    async def send_message(self, chat_id: int, text: str, reply_markup=None):
+        self.sent_messages += 1
+
+    async def get_messages(self, chat_id: int, message_ids: Union[int, List[int]]):
+        messages = [self.messages.get((chat_id, message_id)) or _EmptyMessage(message_id)
+                    for message_id in (message_ids if isinstance(message_ids, list) else [message_ids])]
+        return messages if isinstance(message_ids, list) else messages[0]
@@ -0,0 +1,50 @@
+import os
+import json
+import asyncio
+import tempfile
+
+from .fake_google import drive_discovery_document
+
+
+def run(scenario: str, options: dict, base_url: str) -> dict:
+    """Runs one scenario in the current (fresh) process, so its memory peak and metrics are its own."""
+    with tempfile.TemporaryDirectory(prefix="gdrive_bot_bench_") as work_dir:
+        _configure(options, base_url, work_dir)
+
+        # Settings are read on import, so the bot is imported only after the environment is ready.
+        from . import scenarios
+        return asyncio.get_event_loop().run_until_complete(
+            scenarios.run_scenario(scenario, options, base_url, work_dir)
+        )
+
+
+def _configure(options: dict, base_url: str, work_dir: str):
+    credentials_path = os.path.join(work_dir, "credentials.json")
+    with open(credentials_path, "w") as credentials_file:
+        json.dump({"web": {
+            "client_id": "benchmark.apps.googleusercontent.com",
+            "client_secret": "benchmark",
+            "auth_uri": f"{base_url}/auth",
+            "token_uri": f"{base_url}/token",
+        }}, credentials_file)
+
+    discovery_dir = os.path.join(work_dir, "discovery")
+    os.makedirs(discovery_dir)
+    with open(os.path.join(discovery_dir, "drive_v3.json"), "w") as discovery_file:
+        json.dump(drive_discovery_document(base_url), discovery_file)
+
+    os.environ.update({
+        "G_APP_CREDS_PATH": credentials_path,
+        "REDIRECT_URI": f"{base_url}/auth",
+        "DISCOVERY_CACHE_DIR": discovery_dir,
+        "DRIVE_UPLOAD_URL": f"{base_url}/upload/drive/v3/files",
+        "DRIVE_BATCH_URL": f"{base_url}/batch/drive/v3",
+        "DRIVE_FILES_URL": f"{base_url}/drive/v3/files",
+        "SPOOL_DIR": os.path.join(work_dir, "spool"),
+        "TRANSFER_MODE": options["mode"],
+        "REDIS_URL": "",
+    })
+    if options.get("global_limit"):
+        os.environ["TRANSFER_GLOBAL_LIMIT"] = str(options["global_limit"])
+    if options.get("per_user_limit"):
+        os.environ["TRANSFER_PER_USER_LIMIT"] = str(options["per_user_limit"])
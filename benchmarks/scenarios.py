@@ -0,0 +1,239 @@
+import os
+import json
+import time
+import asyncio
+import platform
+import resource
+import subprocess
+from datetime import datetime, timedelta
+from pathlib import Path
+from statistics import mean
+from typing import List
+
+from settings import load_g_app_creds
+from core.db import DBClient
+from core.google import AuthNotifier, TokenManager
+from core.google.client import GoogleClient
+from core.metrics import DB_QUERY_SECONDS
+from core.tg_bot.handlers import get_current_folder, upload_file_to_google_drive
+
+from .fake_telegram import FakeDocument, FakeMessage, FakeTelegramBot
+
+
+class Environment:
+    """The bot wired to real DB, Google client and token manager, with Telegram and Google faked."""
+
+    def __init__(self, db_client, google_client, token_manager, bot, base_url):
+        self.db_client = db_client
+        self.google_client = google_client
+        self.token_manager = token_manager
+        self.bot = bot
+        self.base_url = base_url
+
+    @classmethod
+    async def create(cls, options: dict, base_url: str, work_dir: str) -> "Environment":
+        db_client = await DBClient.connect(os.path.join(work_dir, "bench.db"))
+
+        google_client = GoogleClient(load_g_app_creds())
+        await google_client.open()
+        google_client.oauth2.openid_configs = {**google_client.oauth2.openid_configs,
+                                               'token_endpoint': f"{base_url}/token"}
+
+        token_manager = TokenManager(google_client, db_client)
+        token_manager.start()
+
+        bot = FakeTelegramBot(db_client, google_client, token_manager, AuthNotifier(),
+                              chunk_delay=options['chunk_delay'])
+        return cls(db_client, google_client, token_manager, bot, base_url)
+
+    async def close(self):
+        await self.token_manager.stop()
+        await self.db_client.disconnect()
+        await self.google_client.close()
+
+    async def add_users(self, count: int, expires_in: float = 3600) -> List[int]:
+        expires_at = (datetime.utcnow() + timedelta(seconds=expires_in)).isoformat()
+        user_ids = list(range(1, count + 1))
+        for user_id in user_ids:
+            await self.db_client.init_auth(user_id, f"secret_{user_id}")
+            await self.db_client.save_user_creds(json.dumps({
+                'access_token': f"token_{user_id}",
+                'refresh_token': f"refresh_{user_id}",
+                'expires_at': expires_at,
+                'token_type': 'Bearer',
+                'scopes': ['https://www.googleapis.com/auth/drive.file'],
+            }), user_id=user_id)
+        return user_ids
+
+    async def google_stats(self, reset: bool = False) -> dict:
+        async with self.google_client.http.request('POST' if reset else 'GET',
+                                                   f"{self.base_url}/{'_reset' if reset else '_stats'}") as response:
+            return await response.json()
+
+
+async def _arrive(rate: float):
+    # Zero rate means that everything arrives at once.
+    await asyncio.sleep(1 / rate if rate else 0)
+
+
+async def transfers(env: Environment, options: dict) -> dict:
+    """`users` users send `files` documents of `file_size` bytes each, `rate` documents per second in total."""
+    user_ids = await env.add_users(options['users'])
+
+    async def send(user_id: int, index: int):
+        message = FakeMessage(env.bot, user_id, document=FakeDocument(f"file_{user_id}_{index}",
+                                                                       options['file_size']))
+        started_at = time.perf_counter()
+        await upload_file_to_google_drive(env.bot, message)
+        final_text = await message.replies[-1].wait_finished()
+        return time.perf_counter() - started_at, final_text.startswith("✅")
+
+    started_at = time.perf_counter()
+    tasks = []
+    for index in range(options['files']):
+        for user_id in user_ids:
+            tasks.append(asyncio.create_task(send(user_id, index)))
+            await _arrive(options['rate'])
+
+    results = await asyncio.gather(*tasks)
+    return {
+        'duration': time.perf_counter() - started_at,
+        'operations': len(results),
+        'failures': sum(not succeeded for _latency, succeeded in results),
+        'bytes': len(results) * options['file_size'],
+        'latencies': [latency for latency, _succeeded in results],
+    }
+
+
+async def session_setup(env: Environment, options: dict) -> dict:
+    """`users` users with tokens about to expire run a command, so each needs a session with a refreshed token."""
+    user_ids = await env.add_users(options['users'], expires_in=60)
+
+    async def command(user_id: int):
+        message = FakeMessage(env.bot, user_id, text="/current_folder")
+        started_at = time.perf_counter()
+        await get_current_folder(env.bot, message)
+        return time.perf_counter() - started_at, bool(message.replies) and "Current folder" in message.replies[-1].text
+
+    started_at = time.perf_counter()
+    tasks = []
+    for user_id in user_ids:
+        tasks.append(asyncio.create_task(command(user_id)))
+        await _arrive(options['rate'])
+
+    results = await asyncio.gather(*tasks)
+    return {
+        'duration': time.perf_counter() - started_at,
+        'operations': len(results),
+        'failures': sum(not succeeded for _latency, succeeded in results),
+        'bytes': 0,
+        'latencies': [latency for latency, _succeeded in results],
+    }
+
+
+async def db_layer(env: Environment, options: dict) -> dict:
+    """Every one of `users` users concurrently does what a transfer of `files` files does with the database."""
+    user_ids = await env.add_users(options['users'])
+
+    async def timed(call):
+        started_at = time.perf_counter()
+        await call
+        return time.perf_counter() - started_at
+
+    async def user_activity(user_id: int) -> List[float]:
+        latencies = [await timed(env.db_client.set_saving_folder_id(user_id, f"folder_{user_id}"))]
+        for index in range(options['files']):
+            upload_key = f"{user_id}:{index}"
+            latencies.append(await timed(env.db_client.get_user_creds(user_id)))
+            latencies.append(await timed(env.db_client.get_saving_folder_id(user_id)))
+            latencies.append(await timed(env.db_client.save_upload_session(upload_key, user_id, "uri", 10)))
+            for offset in range(1, 5):
+                latencies.append(await timed(env.db_client.update_upload_offset(upload_key, offset)))
+            latencies.append(await timed(env.db_client.delete_upload_session(upload_key)))
+        return latencies
+
+    started_at = time.perf_counter()
+    results = await asyncio.gather(*(user_activity(user_id) for user_id in user_ids))
+    latencies = [latency for user_latencies in results for latency in user_latencies]
+    return {
+        'duration': time.perf_counter() - started_at,
+        'operations': len(latencies),
+        'failures': 0,
+        'bytes': 0,
+        'latencies': latencies,
+    }
+
+
+SCENARIOS = {
+    'many_users': transfers,
+    'big_file': transfers,
+    'session_setup': session_setup,
+    'db_layer': db_layer,
+}
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))] if ordered else 0.0
+
+
+def _db_calls() -> dict:
+    return {key[0]: sample for key, sample in DB_QUERY_SECONDS.samples().items()}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=Path(__file__).parent, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_scenario(name: str, options: dict, base_url: str, work_dir: str) -> dict:
+    env = await Environment.create(options, base_url, work_dir)
+    try:
+        await env.google_stats(reset=True)
+        db_calls_before = _db_calls()
+
+        result = await SCENARIOS[name](env, options)
+
+        google_stats = await env.google_stats()
+        db_calls = {}
+        for method, sample in _db_calls().items():
+            before = db_calls_before.get(method, {'count': 0, 'sum': 0.0})
+            if count := sample['count'] - before['count']:
+                total = sample['sum'] - before['sum']
+                db_calls[method] = {'count': count, 'mean_ms': round(total / count * 1000, 3)}
+    finally:
+        await env.close()
+
+    duration, latencies = result['duration'], result['latencies']
+    return {
+        'scenario': name,
+        'options': options,
+        'started_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'duration_s': round(duration, 3),
+        'operations': result['operations'],
+        'failures': result['failures'],
+        'operations_per_s': round(result['operations'] / duration, 2) if duration else None,
+        'bytes': result['bytes'],
+        'throughput_mib_s': round(result['bytes'] / duration / 1024 ** 2, 2) if duration else None,
+        'latency_s': {
+            'p50': round(_percentile(latencies, 0.5), 4),
+            'p90': round(_percentile(latencies, 0.9), 4),
+            'p99': round(_percentile(latencies, 0.99), 4),
+            'max': round(max(latencies, default=0.0), 4),
+            'mean': round(mean(latencies), 4) if latencies else 0.0,
+        },
+        # Linux reports it in KiB.
+        'peak_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'google_calls': google_stats['calls'],
+        'db_calls': db_calls,
+        'telegram': {
+            'sent_messages': env.bot.sent_messages,
+            'edited_messages': env.bot.edited_messages,
+            'downloaded_bytes': env.bot.downloaded_bytes,
+        },
+    }
@@ -0,0 +1,51 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LRUCache:
+    def __init__(self, max_size: int, ttl: float):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._items = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        if (item := self._items.get(key)) is not None:
+            expires_at, value = item
+            if expires_at > time.monotonic():
+                self._items.move_to_end(key)
+                self.hits += 1
+                return value
+
+            del self._items[key]
+
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any):
+        self._items[key] = (time.monotonic() + self._ttl, value)
+        self._items.move_to_end(key)
+
+        while len(self._items) > self._max_size:
+            self._items.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        if (item := self._items.pop(key, None)) is not None:
+            return item[1]
+        return default
+
+    def items(self) -> list:
+        now = time.monotonic()
+        return [(key, value) for key, (expires_at, value) in self._items.items() if expires_at > now]
+
+    def clear(self):
+        self._items.clear()
+
+    def stats(self) -> dict:
+        return {'size': len(self._items), 'hits': self.hits, 'misses': self.misses}
@@ -1,75 +1,573 @@
+import re
 import json
-import sqlite3
+import time
+import uuid
+import asyncio
+import logging
 
-from typing import Union
+from typing import Callable, Iterable, List, Tuple, Union
 from aiosqlite import connect, Connection
 
+from settings import (
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL,
+    DB_READ_POOL_SIZE,
+    DB_WRITE_BATCH_WINDOW,
+    DB_WRITE_BATCH_SIZE,
+)
 
-class DBClient:
-    def __init__(self, connection: Connection):
+from core.cache import LRUCache
+from core.metrics import DB_QUERY_SECONDS, timed_method
+
+_logger = logging.getLogger(__name__)
+
+_NOT_FOUND = object()
+_SETTINGS_CHANGED_CHANNEL = "user_settings_changed"
+
+_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA busy_timeout=5000;",
+    "PRAGMA temp_store=MEMORY;",
+    "PRAGMA cache_size=-16000;",
+)
+
+# Schema versions are applied in order and recorded in `PRAGMA user_version`.
+_MIGRATIONS = (
+    (
+        "CREATE TABLE IF NOT EXISTS user_settings ("
+        "user_id int primary key,"
+        "secret text NOT NULL,"
+        "creds text,"
+        "saving_dir text);",
+
+        "CREATE TABLE IF NOT EXISTS upload_sessions ("
+        "upload_key text primary key,"
+        "user_id int,"
+        "session_uri text NOT NULL,"
+        "total_size int NOT NULL,"
+        "confirmed_offset int NOT NULL DEFAULT 0);",
+    ),
+    (
+        "CREATE INDEX IF NOT EXISTS user_settings_secret ON user_settings (secret);",
+    ),
+    (
+        "CREATE TABLE IF NOT EXISTS uploaded_files ("
+        "user_id int NOT NULL,"
+        "file_unique_id text NOT NULL,"
+        "md5 text,"
+        "drive_file_id text NOT NULL,"
+        "name text,"
+        "web_view_link text,"
+        "web_content_link text,"
+        "uploaded_at real NOT NULL,"
+        "PRIMARY KEY (user_id, file_unique_id));",
+    ),
+    (
+        "CREATE TABLE IF NOT EXISTS transfer_jobs ("
+        "id integer primary key autoincrement,"
+        "user_id int NOT NULL,"
+        "chat_id int NOT NULL,"
+        "message_id int NOT NULL,"
+        "status_message_id int NOT NULL,"
+        "file_id text NOT NULL,"
+        "file_unique_id text NOT NULL,"
+        "file_name text,"
+        "folder_id text,"
+        "state text NOT NULL,"
+        "owner text,"
+        "heartbeat_at real NOT NULL DEFAULT 0,"
+        "created_at real NOT NULL,"
+        "finished_at real,"
+        "UNIQUE (chat_id, message_id));",
+
+        "CREATE INDEX IF NOT EXISTS transfer_jobs_state ON transfer_jobs (state, heartbeat_at);",
+        "CREATE INDEX IF NOT EXISTS transfer_jobs_user ON transfer_jobs (user_id, state);",
+    ),
+    (
+        "ALTER TABLE uploaded_files ADD COLUMN mime_type text;",
+        "ALTER TABLE uploaded_files ADD COLUMN size int;",
+        "ALTER TABLE uploaded_files ADD COLUMN folder_id text;",
+        "ALTER TABLE uploaded_files ADD COLUMN folder_path text;",
+        "CREATE INDEX IF NOT EXISTS uploaded_files_recent ON uploaded_files (user_id, uploaded_at);",
+
+        # Full text index of names and folders, rows are tagged by the user, so a search doesn't see other users.
+        "CREATE VIRTUAL TABLE IF NOT EXISTS uploaded_files_index USING fts5("
+        "user_tag, name, folder_path, tokenize='unicode61 remove_diacritics 2', prefix='2 3');",
+
+        "CREATE TRIGGER IF NOT EXISTS uploaded_files_indexed AFTER INSERT ON uploaded_files BEGIN "
+        "INSERT INTO uploaded_files_index (rowid, user_tag, name, folder_path) "
+        "VALUES (new.rowid, 'u' || new.user_id, new.name, new.folder_path); END;",
+
+        "CREATE TRIGGER IF NOT EXISTS uploaded_files_reindexed AFTER UPDATE ON uploaded_files BEGIN "
+        "DELETE FROM uploaded_files_index WHERE rowid=old.rowid; "
+        "INSERT INTO uploaded_files_index (rowid, user_tag, name, folder_path) "
+        "VALUES (new.rowid, 'u' || new.user_id, new.name, new.folder_path); END;",
+
+        "CREATE TRIGGER IF NOT EXISTS uploaded_files_unindexed AFTER DELETE ON uploaded_files BEGIN "
+        "DELETE FROM uploaded_files_index WHERE rowid=old.rowid; END;",
+
+        "INSERT INTO uploaded_files_index (rowid, user_tag, name, folder_path) "
+        "SELECT rowid, 'u' || user_id, name, folder_path FROM uploaded_files;",
+    ),
+    (
+        # Telegram copies of Drive files, a changed file has another checksum, so its old copy isn't found.
+        "CREATE TABLE IF NOT EXISTS telegram_files ("
+        "drive_file_id text NOT NULL,"
+        "md5 text NOT NULL,"
+        "telegram_file_id text NOT NULL,"
+        "saved_at real NOT NULL,"
+        "PRIMARY KEY (drive_file_id, md5));",
+    ),
+)
+
+# Transfer job is `queued` or `running` until it's finished as `done`, `failed` or `cancelled`. Owner is the process
+# which keeps the job, NULL for a job waiting in the shared queue for a worker process.
+_JOB_FIELDS = ("id", "user_id", "chat_id", "message_id", "status_message_id", "file_id", "file_unique_id",
+               "file_name", "folder_id", "state", "owner")
+_JOB_COLUMNS = ", ".join(_JOB_FIELDS)
+_UNFINISHED_JOB_STATES = "('queued', 'running')"
+
+# Qualified, as the index has some of the same columns.
+_UPLOADED_FILE_COLUMNS = ", ".join(f"uploaded_files.{field}" for field in (
+    "drive_file_id", "md5", "name", "web_view_link", "web_content_link", "mime_type", "size", "folder_path",
+    "uploaded_at"
+))
+
+
+def _search_words(query: str) -> List[str]:
+    """Words of a user's query as FTS5 prefix queries, quoted so operators and punctuation are taken literally."""
+    return [f'"{word}"*' for word in re.findall(r"\w+", query)]
+
+
+class _WriteBatcher:
+    """Executes writes in the order they come, committing all writes of a short window at once."""
+
+    def __init__(self, connection: Connection, window: float = DB_WRITE_BATCH_WINDOW,
+                 max_size: int = DB_WRITE_BATCH_SIZE):
         self._connection = connection
+        self._window = window
+        self._max_size = max_size
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
 
-    async def disconnect(self):
+    async def execute(self, sql: str, parameters: Iterable = (), fetch_all: bool = False) -> Union[int, list]:
+        """Returns number of changed rows, or rows returned by a `RETURNING` statement if `fetch_all` is set."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((sql, parameters, fetch_all, future))
+        return await future
+
+    async def close(self):
+        await self._queue.join()
+        self._task.cancel()
         try:
-            await self._connection.close()
-        except ValueError:
+            await self._task
+        except asyncio.CancelledError:
             pass
 
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            await asyncio.sleep(self._window)
+            while len(batch) < self._max_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            results = []
+            for sql, parameters, fetch_all, _future in batch:
+                try:
+                    cursor = await self._connection.execute(sql, parameters)
+                    results.append(await cursor.fetchall() if fetch_all else cursor.rowcount)
+                except Exception as e:
+                    # A failed statement is rolled back alone, the rest of the batch is committed.
+                    results.append(e)
+
+            try:
+                await self._connection.commit()
+            except Exception as e:
+                _logger.error(f"[!] Can't commit {len(batch)} writes: {e!r}")
+                results = [e] * len(batch)
+
+            for (_sql, _parameters, _fetch_all, future), result in zip(batch, results):
+                if not future.done():
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+                self._queue.task_done()
+
+
+class DBClient:
+    def __init__(self, connection: Connection, read_connections: List[Connection] = ()):
+        self._connection = connection
+        self._writer = _WriteBatcher(connection)
+
+        self._read_connections = list(read_connections) or [connection]
+        self._read_pool = asyncio.Queue()
+        for read_connection in self._read_connections:
+            self._read_pool.put_nowait(read_connection)
+
+        # user_id -> (creds, saving_dir), or None for unknown users.
+        self._user_settings = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+        # user_id -> generation of the settings, bumped by every invalidation.
+        self._generations = {}
+        self._invalidation_callbacks = []
+        self._shared_backend = None
+        # Marks changes published by this process, which are invalidated here before they are published.
+        self._instance_id = uuid.uuid4().hex[:8]
+
+    @property
+    def cache_stats(self) -> dict:
+        return self._user_settings.stats()
+
+    def add_invalidation_callback(self, callback: Callable[[int], None]):
+        self._invalidation_callbacks.append(callback)
+
+    def invalidate(self, user_id: int):
+        self._generations[user_id] = self._generations.get(user_id, 0) + 1
+        self._user_settings.pop(user_id)
+        for callback in self._invalidation_callbacks:
+            callback(user_id)
+
+    async def share_invalidations(self, backend):
+        """Invalidates cached settings in every process using the backend once they are changed in one of them."""
+        self._shared_backend = backend
+        await backend.subscribe(_SETTINGS_CHANGED_CHANNEL, self._on_settings_changed)
+
+    def _on_settings_changed(self, message: str):
+        # The own message would drop settings cached after the change, like refreshed creds.
+        instance_id, _, user_id = message.rpartition(':')
+        if instance_id != self._instance_id:
+            self.invalidate(int(user_id))
+
+    async def _settings_changed(self, user_id: int):
+        self.invalidate(user_id)
+        if self._shared_backend is not None:
+            await self._shared_backend.publish(_SETTINGS_CHANGED_CHANNEL, f"{self._instance_id}:{user_id}")
+
+    async def disconnect(self):
+        await self._writer.close()
+
+        for connection in {*self._read_connections, self._connection}:
+            try:
+                await connection.close()
+            except ValueError:
+                pass
+
     @classmethod
-    async def connect(cls, file_path: str):
-        connection = await connect(file_path)
-        db = cls(connection)
-        await db.__create_working_table()
-        return db
-
-    async def __create_working_table(self):
-        await self._connection.execute(
-            "CREATE TABLE IF NOT EXISTS user_settings ("
-            "user_id int primary key,"
-            "secret text NOT NULL,"
-            "creds text,"
-            "saving_dir text);"
-        )
-        await self._connection.commit()
+    async def connect(cls, file_path: str, read_pool_size: int = DB_READ_POOL_SIZE):
+        connection = await cls.__open_connection(file_path)
+        try:
+            await connection.execute("PRAGMA journal_mode=WAL;")
+            await cls.__migrate(connection)
+        except BaseException:
+            # Its thread would keep the process alive after the failed startup.
+            await connection.close()
+            raise
 
-    async def init_auth(self, user_id: int, secret: str):
+        # In-memory databases can't be shared between connections.
+        if file_path == ":memory:":
+            read_pool_size = 0
+
+        read_connections = [await cls.__open_connection(file_path) for _ in range(read_pool_size)]
+        return cls(connection, read_connections)
+
+    @staticmethod
+    async def __open_connection(file_path: str) -> Connection:
+        # Statements below are constant strings, so they are reused from sqlite's prepared statements cache.
+        connection = await connect(file_path, cached_statements=256)
+        for pragma in _PRAGMAS:
+            await connection.execute(pragma)
+        return connection
+
+    @staticmethod
+    async def __migrate(connection: Connection):
+        cursor = await connection.execute("PRAGMA user_version;")
+        version = (await cursor.fetchone())[0]
+
+        for new_version, statements in enumerate(_MIGRATIONS[version:], version + 1):
+            _logger.info(f"[*] Migrating database to version {new_version}")
+            # Schema changes aren't put into a transaction implicitly, a version is applied as a whole or not at all.
+            await connection.execute("BEGIN;")
+            try:
+                for statement in statements:
+                    await connection.execute(statement)
+                await connection.execute(f"PRAGMA user_version={new_version};")
+            except BaseException:
+                await connection.rollback()
+                raise
+            await connection.commit()
+
+    async def _write(self, sql: str, parameters: Iterable = (), fetch_all: bool = False) -> Union[int, list]:
+        return await self._writer.execute(sql, parameters, fetch_all)
+
+    async def _fetch(self, sql: str, parameters: Iterable = (), fetch_all: bool = False):
+        connection = await self._read_pool.get()
         try:
-            await self._connection.execute("INSERT INTO user_settings VALUES (?,?, NULL, NULL);", (user_id, secret))
-        except sqlite3.IntegrityError as e:
-            if "UNIQUE" in str(e):
-                await self._connection.execute("UPDATE user_settings SET secret=? WHERE user_id=?", (secret, user_id))
+            cursor = await connection.execute(sql, parameters)
+            return await cursor.fetchall() if fetch_all else await cursor.fetchone()
+        finally:
+            self._read_pool.put_nowait(connection)
 
-        await self._connection.commit()
+    @timed_method(DB_QUERY_SECONDS)
+    async def init_auth(self, user_id: int, secret: str):
+        await self._write(
+            "INSERT INTO user_settings VALUES (?,?, NULL, NULL) "
+            "ON CONFLICT (user_id) DO UPDATE SET secret=excluded.secret;",
+            (user_id, secret)
+        )
+        await self._settings_changed(user_id)
 
+    @timed_method(DB_QUERY_SECONDS)
     async def delete_auth(self, user_id: int):
-        await self._connection.execute("DELETE FROM user_settings WHERE user_id=?", (user_id,))
-        await self._connection.commit()
+        await self._write("DELETE FROM user_settings WHERE user_id=?", (user_id,))
+        await self._settings_changed(user_id)
 
-    async def save_user_creds(self, data: str, secret: str = None, user_id: int = None):
+    @timed_method(DB_QUERY_SECONDS)
+    async def save_user_creds(self, data: str, secret: str = None, user_id: int = None) -> List[int]:
+        """Returns ids of the users whose creds are saved."""
         if secret:
-            await self._connection.execute("UPDATE user_settings SET creds=? WHERE secret=?;", (data, secret))
+            rows = await self._fetch("SELECT user_id FROM user_settings WHERE secret=?;", (secret,), fetch_all=True)
+            user_ids = [row[0] for row in rows]
+            await self._write("UPDATE user_settings SET creds=? WHERE secret=?;", (data, secret))
         elif user_id is not None:
-            await self._connection.execute("UPDATE user_settings SET creds=? WHERE user_id=?;", (data, user_id))
+            await self._write("UPDATE user_settings SET creds=? WHERE user_id=?;", (data, user_id))
+            user_ids = [user_id]
         else:
             raise ValueError("`secret` or `user_id` must be given to save credentials.")
 
-        await self._connection.commit()
+        for changed_user_id in user_ids:
+            cached_settings = self._user_settings.get(changed_user_id)
+            await self._settings_changed(changed_user_id)
+            # Refreshed creds of a known user are cached right away, so nobody has to read them back.
+            if cached_settings is not None and user_id is not None:
+                self._user_settings.set(changed_user_id, (json.loads(data), cached_settings[1]))
+
+        return user_ids
 
+    @timed_method(DB_QUERY_SECONDS)
     async def set_saving_folder_id(self, user_id: int, folder_id: Union[str, None]):
-        await self._connection.execute("UPDATE user_settings SET saving_dir=? WHERE user_id=?", (folder_id, user_id))
-        await self._connection.commit()
+        await self._write("UPDATE user_settings SET saving_dir=? WHERE user_id=?", (folder_id, user_id))
+        await self._settings_changed(user_id)
+
+    async def _get_user_settings(self, user_id: int) -> Union[Tuple[Union[dict, None], Union[str, None]], None]:
+        if (user_settings := self._user_settings.get(user_id, _NOT_FOUND)) is _NOT_FOUND:
+            generation = self._generations.get(user_id, 0)
+            if (result := await self._fetch("SELECT creds, saving_dir FROM user_settings WHERE user_id=?;",
+                                            (user_id,))) is not None:
+                creds, saving_dir = result
+                user_settings = (json.loads(creds) if creds is not None else None, saving_dir)
+            else:
+                user_settings = None
 
+            # Settings changed while they were read could be read before the change, they aren't cached then.
+            if self._generations.get(user_id, 0) == generation:
+                self._user_settings.set(user_id, user_settings)
+
+        return user_settings
+
+    @timed_method(DB_QUERY_SECONDS)
     async def get_saving_folder_id(self, user_id: int) -> str:
-        cursor = await self._connection.execute("SELECT saving_dir FROM user_settings WHERE user_id=?", (user_id,))
-        if (result := await cursor.fetchone()) is not None:
-            return result[0]
+        if (user_settings := await self._get_user_settings(user_id)) is not None:
+            return user_settings[1]
 
+    @timed_method(DB_QUERY_SECONDS)
     async def is_secret_exists(self, secret: str) -> bool:
-        cursor = await self._connection.execute("SELECT 1 FROM user_settings WHERE secret=?;", (secret,))
-        return await cursor.fetchone() is not None
+        return await self._fetch("SELECT 1 FROM user_settings WHERE secret=?;", (secret,)) is not None
 
+    @timed_method(DB_QUERY_SECONDS)
     async def get_user_creds(self, user_id: int) -> dict:
-        cursor = await self._connection.execute("SELECT creds FROM user_settings WHERE user_id=?;", (user_id,))
+        if (user_settings := await self._get_user_settings(user_id)) is not None:
+            return user_settings[0]
+
+    @timed_method(DB_QUERY_SECONDS)
+    async def save_upload_session(self, upload_key: str, user_id: int, session_uri: str, total_size: int):
+        await self._write("INSERT OR REPLACE INTO upload_sessions VALUES (?,?,?,?,0);",
+                          (upload_key, user_id, session_uri, total_size))
+
+    @timed_method(DB_QUERY_SECONDS)
+    async def update_upload_offset(self, upload_key: str, offset: int):
+        await self._write("UPDATE upload_sessions SET confirmed_offset=? WHERE upload_key=?;", (offset, upload_key))
+
+    @timed_method(DB_QUERY_SECONDS)
+    async def get_upload_session(self, upload_key: str) -> Union[Tuple[str, int, int], None]:
+        return await self._fetch(
+            "SELECT session_uri, total_size, confirmed_offset FROM upload_sessions WHERE upload_key=?;",
+            (upload_key,)
+        )
+
+    @timed_method(DB_QUERY_SECONDS)
+    async def delete_upload_session(self, upload_key: str):
+        await self._write("DELETE FROM upload_sessions WHERE upload_key=?;", (upload_key,))
+
+    @timed_method(DB_QUERY_SECONDS)
+    async def save_uploaded_file(self, user_id: int, file_unique_id: str, drive_file: dict, mime_type: str = None,
+                                 size: int = None, folder_id: str = None, folder_path: str = None):
+        # Upsert instead of `INSERT OR REPLACE`, as rows deleted by REPLACE don't run the triggers of the index.
+        await self._write(
+            "INSERT INTO uploaded_files (user_id, file_unique_id, md5, drive_file_id, name, web_view_link, "
+            "web_content_link, uploaded_at, mime_type, size, folder_id, folder_path) VALUES (?,?,?,?,?,?,?,?,?,?,?,?) "
+            "ON CONFLICT (user_id, file_unique_id) DO UPDATE SET md5=excluded.md5, "
+            "drive_file_id=excluded.drive_file_id, name=excluded.name, web_view_link=excluded.web_view_link, "
+            "web_content_link=excluded.web_content_link, uploaded_at=excluded.uploaded_at, "
+            "mime_type=excluded.mime_type, size=excluded.size, folder_id=excluded.folder_id, "
+            "folder_path=excluded.folder_path;",
+            (user_id, file_unique_id, drive_file.get('md5Checksum'), drive_file['id'], drive_file.get('name'),
+             drive_file.get('webViewLink'), drive_file.get('webContentLink'), time.time(), mime_type, size,
+             folder_id, folder_path)
+        )
+
+    @staticmethod
+    def _uploaded_file_from_row(row: tuple) -> dict:
+        drive_file_id, md5, name, web_view_link, web_content_link, mime_type, size, folder_path, uploaded_at = row
+        return {'id': drive_file_id, 'md5Checksum': md5, 'name': name, 'webViewLink': web_view_link,
+                'webContentLink': web_content_link, 'mimeType': mime_type, 'size': size, 'folderPath': folder_path,
+                'uploadedAt': uploaded_at}
+
+    @timed_method(DB_QUERY_SECONDS)
+    async def get_uploaded_file(self, user_id: int, file_unique_id: str) -> Union[dict, None]:
+        if (result := await self._fetch(
+                f"SELECT {_UPLOADED_FILE_COLUMNS} FROM uploaded_files WHERE user_id=? AND file_unique_id=?;",
+                (user_id, file_unique_id)
+        )) is not None:
+            return self._uploaded_file_from_row(result)
+
+    @timed_method(DB_QUERY_SECONDS)
+    async def search_uploaded_files(self, user_id: int, query: str, limit: int, offset: int = 0) -> List[dict]:
+        """Uploaded files with names or folders containing words starting like all words of `query`."""
+        if not (words := _search_words(query)):
+            return []
+
+        match = f"user_tag:u{user_id} AND {{name folder_path}}: ({' '.join(words)})"
+        rows = await self._fetch(
+            f"SELECT {_UPLOADED_FILE_COLUMNS} FROM uploaded_files_index "
+            "JOIN uploaded_files ON uploaded_files.rowid=uploaded_files_index.rowid "
+            "WHERE uploaded_files_index MATCH ? ORDER BY rank, uploaded_at DESC LIMIT ? OFFSET ?;",
+            (match, limit, offset), fetch_all=True
+        )
+        return [self._uploaded_file_from_row(row) for row in rows]
+
+    @timed_method(DB_QUERY_SECONDS)
+    async def get_recent_uploaded_files(self, user_id: int, limit: int, offset: int = 0) -> List[dict]:
+        rows = await self._fetch(
+            f"SELECT {_UPLOADED_FILE_COLUMNS} FROM uploaded_files WHERE user_id=? "
+            "ORDER BY uploaded_at DESC LIMIT ? OFFSET ?;",
+            (user_id, limit, offset), fetch_all=True
+        )
+        return [self._uploaded_file_from_row(row) for row in rows]
 
-        if (result := await cursor.fetchone()) is not None and result[0] is not None:
-            return json.loads(result[0])
+    @timed_method(DB_QUERY_SECONDS)
+    async def delete_uploaded_file(self, user_id: int, file_unique_id: str):
+        await self._write("DELETE FROM uploaded_files WHERE user_id=? AND file_unique_id=?;",
+                          (user_id, file_unique_id))
+
+    @timed_method(DB_QUERY_SECONDS)
+    async def get_telegram_file_id(self, drive_file_id: str, md5: str) -> Union[str, None]:
+        if (result := await self._fetch(
+                "SELECT telegram_file_id FROM telegram_files WHERE drive_file_id=? AND md5=?;", (drive_file_id, md5)
+        )) is not None:
+            return result[0]
+
+    @timed_method(DB_QUERY_SECONDS)
+    async def save_telegram_file_id(self, drive_file_id: str, md5: str, telegram_file_id: str):
+        await self._write("INSERT OR REPLACE INTO telegram_files VALUES (?,?,?,?);",
+                          (drive_file_id, md5, telegram_file_id, time.time()))
+
+    @timed_method(DB_QUERY_SECONDS)
+    async def delete_telegram_file_id(self, drive_file_id: str, md5: str):
+        await self._write("DELETE FROM telegram_files WHERE drive_file_id=? AND md5=?;", (drive_file_id, md5))
+
+    @staticmethod
+    def _job_from_row(row: tuple) -> dict:
+        return dict(zip(_JOB_FIELDS, row))
+
+    @timed_method(DB_QUERY_SECONDS)
+    async def create_transfer_job(self, user_id: int, chat_id: int, message_id: int, status_message_id: int,
+                                  file_id: str, file_unique_id: str, file_name: str, folder_id: Union[str, None],
+                                  owner: Union[str, None]) -> Union[dict, None]:
+        """Returns the new job, or None if a job for the message already exists."""
+        now = time.time()
+        rows = await self._write(
+            "INSERT OR IGNORE INTO transfer_jobs "
+            "(user_id, chat_id, message_id, status_message_id, file_id, file_unique_id, file_name, folder_id, state, "
+            f"owner, heartbeat_at, created_at) VALUES (?,?,?,?,?,?,?,?,'queued',?,?,?) RETURNING {_JOB_COLUMNS};",
+            (user_id, chat_id, message_id, status_message_id, file_id, file_unique_id, file_name, folder_id, owner,
+             now, now),
+            fetch_all=True
+        )
+        return self._job_from_row(rows[0]) if rows else None
+
+    @timed_method(DB_QUERY_SECONDS)
+    async def has_transfer_job(self, chat_id: int, message_id: int) -> bool:
+        return await self._fetch("SELECT 1 FROM transfer_jobs WHERE chat_id=? AND message_id=?;",
+                                 (chat_id, message_id)) is not None
+
+    @timed_method(DB_QUERY_SECONDS)
+    async def get_transfer_job(self, job_id: int) -> Union[dict, None]:
+        if (row := await self._fetch(f"SELECT {_JOB_COLUMNS} FROM transfer_jobs WHERE id=?;", (job_id,))) is not None:
+            return self._job_from_row(row)
+
+    @timed_method(DB_QUERY_SECONDS)
+    async def get_unfinished_transfer_jobs(self, user_id: int, limit: int = 50) -> List[dict]:
+        rows = await self._fetch(
+            f"SELECT {_JOB_COLUMNS} FROM transfer_jobs WHERE user_id=? AND state IN {_UNFINISHED_JOB_STATES} "
+            "ORDER BY id LIMIT ?;", (user_id, limit), fetch_all=True
+        )
+        return [self._job_from_row(row) for row in rows]
+
+    @timed_method(DB_QUERY_SECONDS)
+    async def claim_transfer_job(self, job_id: int, owner: str) -> bool:
+        """Takes a job from the shared queue, False if it's cancelled or taken already."""
+        return await self._write(
+            "UPDATE transfer_jobs SET owner=?, heartbeat_at=? WHERE id=? AND state='queued' AND owner IS NULL;",
+            (owner, time.time(), job_id)
+        ) > 0
+
+    @timed_method(DB_QUERY_SECONDS)
+    async def claim_orphaned_transfer_jobs(self, owner: str, lease_timeout: float, limit: int) -> List[dict]:
+        """Takes up to `limit` unfinished jobs of processes which haven't renewed them for `lease_timeout` seconds.
+
+        Jobs nobody has claimed from the shared queue for as long are taken too, their queue entries could be lost.
+        """
+        now = time.time()
+        # An unclaimed job has no owner and keeps the time it's created at as its heartbeat.
+        rows = await self._write(
+            "UPDATE transfer_jobs SET state='queued', owner=?, heartbeat_at=? WHERE id IN ("
+            f"SELECT id FROM transfer_jobs WHERE state IN {_UNFINISHED_JOB_STATES} "
+            f"AND heartbeat_at<? ORDER BY id LIMIT ?) RETURNING {_JOB_COLUMNS};",
+            (owner, now, now - lease_timeout, limit),
+            fetch_all=True
+        )
+        return [self._job_from_row(row) for row in rows]
+
+    @timed_method(DB_QUERY_SECONDS)
+    async def renew_transfer_jobs(self, owner: str):
+        await self._write(
+            f"UPDATE transfer_jobs SET heartbeat_at=? WHERE owner=? AND state IN {_UNFINISHED_JOB_STATES};",
+            (time.time(), owner)
+        )
+
+    @timed_method(DB_QUERY_SECONDS)
+    async def release_transfer_jobs(self, owner: str):
+        """Lets other processes resume unfinished jobs of `owner` right away, instead of waiting for its lease."""
+        await self._write(
+            "UPDATE transfer_jobs SET state='queued', heartbeat_at=0 "
+            f"WHERE owner=? AND state IN {_UNFINISHED_JOB_STATES};", (owner,)
+        )
+
+    @timed_method(DB_QUERY_SECONDS)
+    async def set_transfer_job_running(self, job_id: int):
+        await self._write("UPDATE transfer_jobs SET state='running' WHERE id=? AND state='queued';", (job_id,))
+
+    @timed_method(DB_QUERY_SECONDS)
+    async def finish_transfer_job(self, job_id: int, state: str) -> bool:
+        """Finishes a job once, False means it has been finished already."""
+        return await self._write(
+            f"UPDATE transfer_jobs SET state=?, finished_at=? WHERE id=? AND state IN {_UNFINISHED_JOB_STATES};",
+            (state, time.time(), job_id)
+        ) > 0
+
+    @timed_method(DB_QUERY_SECONDS)
+    async def delete_finished_transfer_jobs(self, finished_before: float):
+        await self._write(
+            f"DELETE FROM transfer_jobs WHERE state NOT IN {_UNFINISHED_JOB_STATES} AND finished_at<?;",
+            (finished_before,)
+        )
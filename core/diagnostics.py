@@ -0,0 +1,117 @@
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import Counter
+from typing import Union
+
+from settings import LOOP_LAG_INTERVAL, LOOP_LAG_THRESHOLD
+from core.metrics import LOOP_LAG_SECONDS, LOOP_STALLS
+
+_logger = logging.getLogger(__name__)
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up and reports what blocks it.
+
+    A task asks to be woken up every `interval` seconds and records the delay. A watchdog thread notices
+    when the task hasn't woken up for `threshold` seconds, while the loop is still blocked, and logs the
+    stack of the loop thread, so the code holding the loop is visible.
+    """
+
+    def __init__(self, threshold: float = LOOP_LAG_THRESHOLD, interval: float = LOOP_LAG_INTERVAL):
+        self._threshold = threshold
+        self._interval = interval
+        self._loop_thread_id = None
+        self._last_tick = 0.0
+        self._stall_reported = False
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        if self._task is not None:
+            return
+
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._measure())
+        self._watchdog = threading.Thread(target=self._watch, name="loop_lag_watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        if self._task is None:
+            return
+
+        self._stopped.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        await asyncio.to_thread(self._watchdog.join)
+        self._task = self._watchdog = None
+
+    async def _measure(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            now = time.monotonic()
+            lag = max(now - self._last_tick - self._interval, 0.0)
+            self._last_tick = now
+
+            LOOP_LAG_SECONDS.observe(lag)
+            if lag >= self._threshold:
+                LOOP_STALLS.inc()
+                _logger.warning(f"[!] Event loop was blocked for {lag:.3f}s")
+            self._stall_reported = False
+
+    def _watch(self):
+        while not self._stopped.wait(self._threshold / 2):
+            if self._stall_reported or time.monotonic() - self._last_tick - self._interval < self._threshold:
+                continue
+
+            # Reported once per stall, the duration is logged by the loop when it wakes up.
+            self._stall_reported = True
+            if (frame := sys._current_frames().get(self._loop_thread_id)) is not None:
+                stack = "".join(traceback.format_stack(frame))
+                _logger.warning(f"[!] Event loop is blocked for over {self._threshold:.3f}s at:\n{stack}")
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def sample_stacks(duration: float, interval: float, thread_id: Union[int, None] = None) -> str:
+    """Samples stacks of all threads but the calling one (or only `thread_id`) for `duration` seconds.
+
+    Returns them in the collapsed format, a line of `frame;frame;frame count` per stack, which is read
+    by flamegraph.pl, speedscope and similar tools.
+    """
+    own_thread_id = threading.get_ident()
+    thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+    stacks = Counter()
+
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        for frame_thread_id, frame in sys._current_frames().items():
+            if frame_thread_id == own_thread_id or thread_id is not None and frame_thread_id != thread_id:
+                continue
+            thread_name = thread_names.get(frame_thread_id, str(frame_thread_id))
+            stacks[f"{thread_name};{_collapse(frame)}"] += 1
+        time.sleep(interval)
+
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+async def profile(duration: float, interval: float, loop_only: bool = False) -> str:
+    """Samples the running process from a thread, so the event loop keeps running while it's profiled."""
+    thread_id = threading.get_ident() if loop_only else None
+    return await asyncio.to_thread(sample_stacks, duration, interval, thread_id)
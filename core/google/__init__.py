@@ -1 +1,5 @@
-from .session import GoogleSession
+from .session import GoogleSession, GoogleSessionCache
+from .tokens import TokenManager
+from .auth_notifier import AuthNotifier
+from .folders import FolderIndex
+from .quota import QuotaCache
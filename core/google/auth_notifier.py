@@ -0,0 +1,53 @@
+import asyncio
+
+_AUTH_COMPLETED_CHANNEL = "auth_completed"
+
+
+class AuthNotifier:
+    """Wakes up users waiting for authorization once the web app has saved their creds.
+
+    Waiters are keyed by the user, so every authorization url sent to the user wakes up all of them.
+    Without a backend notifications stay inside the process, with one they are
+    delivered to every process subscribed to it.
+    """
+
+    def __init__(self, backend=None):
+        self._backend = backend
+        self._waiters = {}
+        self._waiting = {}
+
+    async def start(self):
+        if self._backend is not None:
+            await self._backend.subscribe(_AUTH_COMPLETED_CHANNEL, lambda user_id: self._resolve(int(user_id)))
+
+    def expect(self, user_id: int):
+        if (waiter := self._waiters.get(user_id)) is None or waiter.done():
+            self._waiters[user_id] = asyncio.get_running_loop().create_future()
+
+    async def wait(self, user_id: int, timeout: float) -> bool:
+        # An authorization completed since the url has been sent is already resolved, it's not expected anew.
+        if (waiter := self._waiters.get(user_id)) is None:
+            waiter = self._waiters[user_id] = asyncio.get_running_loop().create_future()
+        self._waiting[user_id] = self._waiting.get(user_id, 0) + 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            # The future is shared by all waiters of the user, the last one to leave forgets it.
+            if (waiting := self._waiting.get(user_id, 1) - 1) > 0:
+                self._waiting[user_id] = waiting
+            else:
+                self._waiting.pop(user_id, None)
+                if self._waiters.get(user_id) is waiter:
+                    del self._waiters[user_id]
+
+    async def notify(self, user_id: int):
+        if self._backend is not None:
+            await self._backend.publish(_AUTH_COMPLETED_CHANNEL, str(user_id))
+        else:
+            self._resolve(user_id)
+
+    def _resolve(self, user_id: int):
+        if (waiter := self._waiters.get(user_id)) is not None and not waiter.done():
+            waiter.set_result(True)
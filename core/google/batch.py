@@ -0,0 +1,128 @@
+import json
+import uuid
+from typing import Awaitable, Callable, List, Tuple, Union
+from urllib.parse import quote, urlencode
+
+from aiohttp import ClientSession, MultipartReader
+
+from settings import DRIVE_BATCH_URL
+from core.metrics import DRIVE_HTTP_ERRORS
+from core.retry import RetryableError, parse_retry_after, retry_reason
+
+from .tokens import TokenRejectedError
+
+# Drive rejects batches with more calls than this.
+MAX_BATCH_SIZE = 100
+
+
+class BatchError(Exception):
+    pass
+
+
+class _TransientBatchError(BatchError, RetryableError):
+    pass
+
+
+class _RejectedTokenError(BatchError, TokenRejectedError):
+    pass
+
+
+class DriveBatch:
+    """Sends up to 100 Drive metadata calls as one `multipart/mixed` batch request.
+
+    Media uploads can't be batched, so only metadata calls, like permission grants, go here.
+    """
+
+    def __init__(self, http: ClientSession, access_token: Callable[[bool], Awaitable[str]]):
+        self._http = http
+        self._access_token = access_token
+        self._calls = []
+
+    def __len__(self):
+        return len(self._calls)
+
+    def add(self, method: str, path: str, body: dict = None, params: dict = None) -> int:
+        if len(self._calls) >= MAX_BATCH_SIZE:
+            raise BatchError(f"Batch can't contain more than {MAX_BATCH_SIZE} calls.")
+
+        path = f"/drive/v3/{quote(path)}"
+        if params:
+            path += '?' + urlencode(params)
+
+        self._calls.append((method, path, body))
+        return len(self._calls) - 1
+
+    async def execute(self) -> List[Tuple[int, Union[dict, None]]]:
+        """Returns (status, json body) of every call in the order they were added."""
+        if not self._calls:
+            return []
+
+        boundary = f"batch_{uuid.uuid4().hex}"
+        headers = {
+            'Authorization': f"Bearer {await self._access_token(False)}",
+            'Content-Type': f"multipart/mixed; boundary={boundary}",
+        }
+
+        async with self._http.post(DRIVE_BATCH_URL, data=self._build_body(boundary), headers=headers) as response:
+            if response.status != 200:
+                DRIVE_HTTP_ERRORS.inc(code=response.status)
+                text = await response.text()
+                if response.status == 401:
+                    raise _RejectedTokenError("Batch request returned 401")
+                if (reason := retry_reason(response.status, text)) is not None:
+                    raise _TransientBatchError(f"Batch request returned {response.status}", reason,
+                                               parse_retry_after(response.headers))
+                raise BatchError(f"Batch request failed ({response.status}): {text}")
+
+            results = [(0, None)] * len(self._calls)
+            reader = MultipartReader.from_response(response)
+            while (part := await reader.next()) is not None:
+                index = self._call_index(part.headers.get('Content-ID', ''))
+                if index is not None and index < len(results):
+                    results[index] = self._parse_part(await part.read())
+
+        self._calls = []
+        for status, _body in results:
+            if status >= 400:
+                DRIVE_HTTP_ERRORS.inc(code=status)
+        return results
+
+    def _build_body(self, boundary: str) -> bytes:
+        parts = []
+        for index, (method, path, body) in enumerate(self._calls):
+            request = f"{method} {path} HTTP/1.1\r\n"
+            if body is not None:
+                request += f"Content-Type: application/json; charset=UTF-8\r\n\r\n{json.dumps(body)}"
+            else:
+                request += "\r\n"
+
+            parts.append(
+                f"--{boundary}\r\n"
+                f"Content-Type: application/http\r\n"
+                f"Content-ID: <item{index}>\r\n\r\n"
+                f"{request}\r\n"
+            )
+
+        parts.append(f"--{boundary}--\r\n")
+        return ''.join(parts).encode()
+
+    @staticmethod
+    def _call_index(content_id: str) -> Union[int, None]:
+        # Responses are marked as `<response-item{index}>`.
+        try:
+            return int(content_id.strip('<>').rsplit('item', 1)[1])
+        except (IndexError, ValueError):
+            return None
+
+    @staticmethod
+    def _parse_part(data: bytes) -> Tuple[int, Union[dict, None]]:
+        head, _, body = data.decode().partition('\r\n\r\n')
+        try:
+            status = int(head.split(' ', 2)[1])
+        except (IndexError, ValueError):
+            return 0, None
+
+        try:
+            return status, json.loads(body) if body.strip() else None
+        except ValueError:
+            return status, None
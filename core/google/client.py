@@ -0,0 +1,111 @@
+import time
+import json
+import asyncio
+import logging
+from pathlib import Path
+from typing import Union
+
+from aiohttp import TCPConnector
+from aiogoogle import Aiogoogle
+from aiogoogle.resource import GoogleAPI
+from aiogoogle.sessions.aiohttp_session import AiohttpSession
+
+from settings import (
+    GOOGLE_CONNECTION_LIMIT,
+    GOOGLE_KEEPALIVE_TIMEOUT,
+    DISCOVERY_CACHE_DIR,
+    DISCOVERY_CACHE_TTL,
+)
+
+_logger = logging.getLogger(__name__)
+
+
+class GoogleClient(Aiogoogle):
+    """Aiogoogle client with one pooled http session and discovery documents cached for the process lifetime.
+
+    Requests must be sent without `async with`, because leaving the context closes the shared session.
+    """
+
+    def __init__(self, client_creds: dict, connection_limit: int = GOOGLE_CONNECTION_LIMIT,
+                 keepalive_timeout: float = GOOGLE_KEEPALIVE_TIMEOUT, cache_dir: Union[str, None] = DISCOVERY_CACHE_DIR):
+        self._http = None
+        self._connection_limit = connection_limit
+        self._keepalive_timeout = keepalive_timeout
+        self._cache_dir = Path(cache_dir) if cache_dir else None
+
+        self._apis = {}
+        self._discovery_lock = asyncio.Lock()
+
+        super().__init__(client_creds=client_creds, session_factory=self._shared_session)
+
+    @property
+    def http(self) -> AiohttpSession:
+        return self._shared_session()
+
+    def _shared_session(self) -> AiohttpSession:
+        if self._http is None:
+            raise RuntimeError("Google client is not opened.")
+        return self._http
+
+    async def open(self):
+        connector = TCPConnector(limit=self._connection_limit, keepalive_timeout=self._keepalive_timeout)
+        self._http = AiohttpSession(connector=connector)
+        self.oauth2.active_session = self._http
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+            self.oauth2.active_session = None
+
+    async def discover(self, api_name, api_version=None, validate=False, **kwargs) -> GoogleAPI:
+        key = (api_name, api_version, validate)
+        if (api := self._apis.get(key)) is not None:
+            return api
+
+        async with self._discovery_lock:
+            if (api := self._apis.get(key)) is None:
+                if (document := await self._load_cached_document(api_name, api_version)) is not None:
+                    api = GoogleAPI(document, validate)
+                else:
+                    api = await super().discover(api_name, api_version, validate, **kwargs)
+                    await self._store_cached_document(api_name, api_version, api.discovery_document)
+
+                self._apis[key] = api
+
+        return api
+
+    def _cache_path(self, api_name, api_version) -> Union[Path, None]:
+        if self._cache_dir is not None and api_version is not None:
+            return self._cache_dir / f"{api_name}_{api_version}.json"
+
+    async def _load_cached_document(self, api_name, api_version) -> Union[dict, None]:
+        if (path := self._cache_path(api_name, api_version)) is None:
+            return None
+
+        def load():
+            if not path.exists() or time.time() - path.stat().st_mtime > DISCOVERY_CACHE_TTL:
+                return None
+            with open(path, "rb") as cache_file:
+                return json.load(cache_file)
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(None, load)
+        except (OSError, ValueError):
+            _logger.warning(f"[!] Broken discovery cache file '{path}' is ignored")
+
+    async def _store_cached_document(self, api_name, api_version, document: dict):
+        if (path := self._cache_path(api_name, api_version)) is None:
+            return
+
+        def store():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(".tmp")
+            with open(tmp_path, "w") as cache_file:
+                json.dump(document, cache_file)
+            tmp_path.replace(path)
+
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, store)
+        except OSError:
+            _logger.warning(f"[!] Can't write discovery cache file '{path}'")
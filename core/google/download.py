@@ -0,0 +1,73 @@
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable
+
+from aiohttp import ClientError, ClientSession
+
+from settings import DRIVE_FILES_URL
+from core.metrics import DRIVE_HTTP_ERRORS
+from core.retry import DRIVE_RETRY, RetryableError, classify, parse_retry_after, retry_reason
+
+_logger = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+class DownloadError(Exception):
+    pass
+
+
+class _TransientDownloadError(DownloadError, RetryableError):
+    pass
+
+
+async def download_chunks(http: ClientSession, access_token: Callable[[bool], Awaitable[str]], file_id: str,
+                          user_id: int = None, chunk_size: int = _CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Yields content of a Drive file, a download broken by a transient error is resumed from the received byte.
+
+    `access_token` returns the token to authorize with, True asks for a new one after Drive has rejected it.
+    """
+    received = 0
+    attempt = 0
+    token_rejected = False
+
+    while True:
+        headers = {'Authorization': f"Bearer {await access_token(token_rejected)}"}
+        if received:
+            headers['Range'] = f"bytes={received}-"
+
+        try:
+            async with http.get(f"{DRIVE_FILES_URL}/{file_id}", params={'alt': 'media'}, headers=headers) as response:
+                if response.status not in (200, 206):
+                    DRIVE_HTTP_ERRORS.inc(code=response.status)
+                    body = await response.text()
+                    if response.status == 401 and not token_rejected:
+                        # The token has expired during a long download, it's resumed once with a new one.
+                        token_rejected = True
+                        continue
+                    if (reason := retry_reason(response.status, body)) is not None:
+                        raise _TransientDownloadError(f"Download returned {response.status}", reason,
+                                                      parse_retry_after(response.headers))
+                    raise DownloadError(f"Download failed ({response.status}): {body}")
+
+                # The whole file is sent again when the range is ignored, the received part is skipped then.
+                skip = received if response.status == 200 else 0
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    if skip:
+                        chunk, skip = chunk[skip:], max(skip - len(chunk), 0)
+                        if not chunk:
+                            continue
+
+                    received += len(chunk)
+                    attempt = 0
+                    token_rejected = False
+                    # Failures recorded by the backoff below mustn't add up over downloads which go on fine.
+                    DRIVE_RETRY.record_success(user_id)
+                    yield chunk
+                return
+        except (_TransientDownloadError, ClientError, asyncio.TimeoutError) as e:
+            if not await DRIVE_RETRY.backoff(attempt, *classify(e), key=user_id):
+                raise DownloadError(f"Download failed after retries: {e!r}") from e
+
+            _logger.info(f"[*] Resuming download of '{file_id}' from {received} bytes")
+            attempt += 1
@@ -1,86 +1,304 @@
-from typing import Union
+import asyncio
+import hashlib
+import logging
+import functools
+import itertools
+import traceback
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, List, Union
 
 from aiogoogle.auth.creds import UserCreds
 from aiogoogle.excs import HTTPError
 
+from core.metrics import DRIVE_HTTP_ERRORS
+from core.retry import DRIVE_RETRY, retry_reason
+
+from .upload import ResumableUpload, UploadError
+from .download import DownloadError, download_chunks
+from .tokens import TokenRejectedError
+from .batch import DriveBatch, MAX_BATCH_SIZE
+
+_logger = logging.getLogger(__name__)
+
+
+# Drive refuses a rate limited call before applying it, while a call broken by a server or a network error
+# may have been applied already, so only the former is safe to repeat for a call creating a file.
+_SAFE_RETRY_REASONS = ('rate_limit',)
+
 
 class GoogleDrive:
     _FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+    _UPLOADED_FILE_FIELDS = 'id,name,webContentLink,webViewLink,md5Checksum'
 
-    def __init__(self, google_client, user_creds):
+    def __init__(self, google_client, user_creds, db_client=None, user_id: int = None, token_manager=None):
         self._google_client = google_client
         self._user_creds = UserCreds(**user_creds)
+        self._db_client = db_client
+        # Transient errors of one user's calls are retried under a shared circuit breaker.
+        self._user_id = user_id
+        self._token_manager = token_manager
+
+    async def _drive_api(self):
+        return await self._google_client.discover('drive', 'v3')
+
+    async def _access_token(self, rejected: bool = False) -> str:
+        """Token to authorize calls with, taken for every request, as long transfers outlive the first one.
+
+        `rejected` means Drive has answered 401 to the current token, so it's replaced right away.
+        """
+        if self._token_manager is not None and self._user_id is not None:
+            if rejected:
+                user_creds = await self._token_manager.replace_rejected(self._user_id, self._user_creds)
+            else:
+                user_creds = await self._token_manager.get_fresh_creds(self._user_id, self._user_creds)
+
+            if user_creds is not None and user_creds.get('access_token') != self._user_creds.get('access_token'):
+                self._user_creds = UserCreds(**user_creds)
+
+        return self._user_creds['access_token']
+
+    async def _call(self, action, idempotent: bool = True):
+        """Awaits `action()` with retries of transient errors, once more with a new token if the token is rejected.
+
+        A call which isn't `idempotent` is repeated only after errors Drive surely hasn't applied it on.
+        """
+        reasons = None if idempotent else _SAFE_RETRY_REASONS
+        try:
+            return await DRIVE_RETRY.call(action, key=self._user_id, reasons=reasons)
+        except (HTTPError, TokenRejectedError) as e:
+            if isinstance(e, HTTPError) and (e.res is None or e.res.status_code != 401):
+                raise
+
+        await self._access_token(rejected=True)
+        return await DRIVE_RETRY.call(action, key=self._user_id, reasons=reasons)
+
+    async def _send(self, request, idempotent: bool = True):
+        return await self._call(functools.partial(self._send_once, request), idempotent)
+
+    async def _send_once(self, request):
+        await self._access_token()
+        try:
+            return await self._google_client.as_user(request, user_creds=self._user_creds)
+        except HTTPError as e:
+            if e.res is not None:
+                DRIVE_HTTP_ERRORS.inc(code=e.res.status_code)
+            raise
 
     async def upload_file(self, file, parent_folder_id=None) -> str:
-        async with self._google_client as google:
-            drive_v3 = await google.discover('drive', 'v3')
+        drive_v3 = await self._drive_api()
 
-            metadata = {
-                'name': file.name,
-                'mimeType': file.mime_type
-            }
+        metadata = {
+            'name': file.name,
+            'mimeType': file.mime_type
+        }
 
-            if parent_folder_id is not None:
-                metadata['parents'] = [parent_folder_id]
+        if parent_folder_id is not None:
+            metadata['parents'] = [parent_folder_id]
 
-            upload_request = drive_v3.files.create(
-                pipe_from=file,
-                json=metadata,
-                fields='id,name,webContentLink,webViewLink'
-            )
+        upload_request = drive_v3.files.create(
+            pipe_from=file,
+            json=metadata,
+            fields=self._UPLOADED_FILE_FIELDS
+        )
 
-            return await google.as_user(upload_request, user_creds=self._user_creds)
+        return await self._send(upload_request, idempotent=False)
 
-    async def make_file_public(self, file_id) -> bool:
-        async with self._google_client as google:
-            drive_v3 = await google.discover('drive', 'v3')
-            update_request = drive_v3.permissions.create(
-                fileId=file_id,
-                json={'type': 'anyone', 'role': 'reader'}
-            )
+    async def upload_stream(self, name: str, mime_type: str, size: int,
+                            open_chunks: Callable[[int], AsyncIterable[bytes]],
+                            parent_folder_id=None, upload_key: str = None, user_id: int = None,
+                            progress: Callable[[int, int], Awaitable] = None) -> dict:
+        upload = self._resumable_upload(upload_key, user_id, progress)
+        offset = await upload.open(self._file_metadata(name, mime_type, parent_folder_id), size,
+                                   fields=self._UPLOADED_FILE_FIELDS)
+
+        # A resumed upload doesn't pass the beginning of the file through here, so it can't be hashed.
+        md5 = hashlib.md5() if offset == 0 else None
+        result = await upload.upload(_hashed(open_chunks(offset), md5))
+
+        await self._verify_checksum(name, result, md5)
+        return result
+
+    async def upload_view(self, name: str, mime_type: str, view: memoryview, parent_folder_id=None,
+                          upload_key: str = None, user_id: int = None,
+                          progress: Callable[[int, int], Awaitable] = None) -> dict:
+        upload = self._resumable_upload(upload_key, user_id, progress)
+        await upload.open(self._file_metadata(name, mime_type, parent_folder_id), len(view),
+                          fields=self._UPLOADED_FILE_FIELDS)
+
+        # The whole file is at hand, so it's hashed in a thread while being uploaded.
+        md5 = asyncio.get_running_loop().run_in_executor(None, hashlib.md5, view)
+        try:
+            result = await upload.upload_view(view)
+        finally:
+            # The view mustn't be released while it's still being hashed.
+            md5 = await md5
+
+        await self._verify_checksum(name, result, md5)
+        return result
+
+    def _resumable_upload(self, upload_key: Union[str, None], user_id: Union[int, None],
+                          progress: Union[Callable[[int, int], Awaitable], None]) -> ResumableUpload:
+        return ResumableUpload(self._google_client.http, self._access_token, self._db_client, upload_key,
+                               user_id if user_id is not None else self._user_id, progress=progress)
+
+    @staticmethod
+    def _file_metadata(name: str, mime_type: Union[str, None], parent_folder_id: Union[str, None]) -> dict:
+        metadata = {'name': name}
+
+        if mime_type is not None:
+            metadata['mimeType'] = mime_type
+
+        if parent_folder_id is not None:
+            metadata['parents'] = [parent_folder_id]
+
+        return metadata
+
+    async def _verify_checksum(self, name: str, uploaded_file: dict, md5):
+        if md5 is not None and uploaded_file.get('md5Checksum') not in (None, md5.hexdigest()):
+            # The file is created already, a corrupted copy mustn't be left in the drive.
             try:
-                await google.as_user(update_request, user_creds=self._user_creds)
-            except HTTPError:
+                await self.delete_file(uploaded_file['id'])
+            except Exception:
+                _logger.error(traceback.format_exc())
+            raise UploadError(f"Checksum of uploaded file '{name}' doesn't match.")
+
+    async def download(self, file_id: str, md5_checksum: str = None) -> AsyncIterator[bytes]:
+        """Yields content of the file, a mismatch with `md5_checksum` is raised after the last chunk."""
+        md5 = hashlib.md5() if md5_checksum is not None else None
+        async for chunk in _hashed(download_chunks(self._google_client.http, self._access_token, file_id,
+                                                   self._user_id), md5):
+            yield chunk
+
+        if md5 is not None and md5.hexdigest() != md5_checksum:
+            raise DownloadError(f"Checksum of downloaded file '{file_id}' doesn't match.")
+
+    async def get_file(self, file_id: str, fields: str = 'id,name') -> Union[dict, None]:
+        drive = await self._drive_api()
+        try:
+            return await self._send(drive.files.get(fileId=file_id, fields=fields))
+        except HTTPError as e:
+            if e.res is not None and e.res.status_code == 404:
+                return None
+            raise
+
+    async def _execute_batched(self, calls: list) -> list:
+        results = [(0, None)] * len(calls)
+        pending = list(range(len(calls)))
+
+        for attempt in itertools.count():
+            for start in range(0, len(pending), MAX_BATCH_SIZE):
+                indexes = pending[start:start + MAX_BATCH_SIZE]
+                batch = DriveBatch(self._google_client.http, self._access_token)
+                for index in indexes:
+                    batch.add(*calls[index])
+
+                for index, result in zip(indexes, await self._call(batch.execute)):
+                    results[index] = result
+
+            # Calls inside a batch are rate limited one by one, so only the rejected ones are sent again.
+            reasons = {index: reason for index in pending if (reason := retry_reason(*results[index])) is not None}
+            pending = list(reasons)
+            if not pending or not await DRIVE_RETRY.backoff(attempt, reasons[pending[0]], key=self._user_id):
+                return results
+
+    async def make_files_public(self, file_ids: List[str]) -> Dict[str, bool]:
+        results = await self._execute_batched([
+            ('POST', f"files/{file_id}/permissions", {'type': 'anyone', 'role': 'reader'}, {'fields': 'id'})
+            for file_id in file_ids
+        ])
+        return {file_id: 200 <= status < 300 for file_id, (status, _body) in zip(file_ids, results)}
+
+    async def delete_file(self, file_id: str):
+        drive = await self._drive_api()
+        try:
+            await self._send(drive.files.delete(fileId=file_id))
+        except HTTPError as e:
+            # A repeated call finds the file deleted by the first one.
+            if e.res is None or e.res.status_code != 404:
+                raise
+
+    async def make_file_public(self, file_id) -> bool:
+        drive_v3 = await self._drive_api()
+        update_request = drive_v3.permissions.create(
+            fileId=file_id,
+            json={'type': 'anyone', 'role': 'reader'}
+        )
+        try:
+            # Drive keeps a single `anyone` permission of a file, so a repeated call doesn't add another one.
+            await self._send(update_request)
+        except HTTPError as e:
+            if e.res is not None and e.res.status_code == 404:
                 return False
-            else:
-                return True
+            raise
+        else:
+            return True
 
-    async def get_folder_id(self, folder_name: str) -> str:
-        async with self._google_client as google:
-            drive = await google.discover('drive', 'v3')
-            request = drive.files.list(q=f"mimeType='{self._FOLDER_MIME_TYPE}' and name='{folder_name}'")
-            found_folders = await google.as_user(request, user_creds=self._user_creds)
+    async def list_folders(self, parent_folder_id=None) -> dict:
+        drive = await self._drive_api()
+        query = (f"mimeType='{self._FOLDER_MIME_TYPE}' and '{parent_folder_id or 'root'}' in parents "
+                 f"and trashed=false")
 
-        if found_folders := found_folders['files']:
-            return found_folders[0]['id']
+        folders = {}
+        page_token = None
+        while True:
+            page_params = {'pageToken': page_token} if page_token is not None else {}
+            request = drive.files.list(q=query, fields='nextPageToken,files(id,name)', pageSize=1000,
+                                       orderBy='createdTime', **page_params)
+            response = await self._send(request)
+
+            # The oldest folder wins when there are several with the same name.
+            for folder in response.get('files', []):
+                folders.setdefault(folder['name'], folder['id'])
+
+            if (page_token := response.get('nextPageToken')) is None:
+                return folders
 
     async def get_folder_name(self, folder_id: str) -> Union[str, None]:
-        async with self._google_client as google:
-            drive = await google.discover('drive', 'v3')
-            request = drive.files.get(fileId=folder_id)
+        drive = await self._drive_api()
+        request = drive.files.get(fileId=folder_id, fields='name,trashed')
 
-            try:
-                found_folder = await google.as_user(request, user_creds=self._user_creds)
-                return found_folder['name']
-            except:
+        try:
+            found_folder = await self._send(request)
+        except HTTPError as e:
+            if e.res is not None and e.res.status_code == 404:
                 return None
+            raise
+
+        return found_folder['name'] if not found_folder.get('trashed') else None
+
+    async def get_storage_quota(self) -> dict:
+        """Returns `limit` and `usage` of the drive storage in bytes, `limit` is None for unlimited storage."""
+        drive = await self._drive_api()
+        storage_quota = (await self._send(drive.about.get(fields='storageQuota')))['storageQuota']
+        return {
+            'limit': int(storage_quota['limit']) if 'limit' in storage_quota else None,
+            'usage': int(storage_quota.get('usage', 0)),
+        }
 
     async def create_folder(self, folder_name: str, parent_folder=None) -> Union[str, None]:
-        async with self._google_client as google:
-            drive = await google.discover('drive', 'v3')
+        drive = await self._drive_api()
 
-            metadata = {
-                'name': folder_name,
-                'mimeType': self._FOLDER_MIME_TYPE
-            }
-            if parent_folder is not None:
-                metadata['parents'] = [parent_folder]
+        metadata = {
+            'name': folder_name,
+            'mimeType': self._FOLDER_MIME_TYPE
+        }
+        if parent_folder is not None:
+            metadata['parents'] = [parent_folder]
 
-            request = drive.files.create(json=metadata)
+        request = drive.files.create(json=metadata, fields='id')
 
-            try:
-                result = await google.as_user(request, user_creds=self._user_creds)
-            except HTTPError:
+        try:
+            result = await self._send(request, idempotent=False)
+        except HTTPError as e:
+            # The parent folder is deleted.
+            if e.res is not None and e.res.status_code == 404:
                 return None
-            else:
-                return result.get('id')
+            raise
+        else:
+            return result.get('id')
+
+
+async def _hashed(chunks: AsyncIterable[bytes], md5) -> AsyncIterable[bytes]:
+    async for chunk in chunks:
+        if md5 is not None:
+            md5.update(chunk)
+        yield chunk
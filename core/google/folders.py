@@ -0,0 +1,74 @@
+from typing import List, Union
+
+from settings import FOLDER_CACHE_SIZE, FOLDER_CACHE_TTL
+from core.cache import LRUCache
+
+_ROOT = 'root'
+
+
+def split_path(path: str) -> List[str]:
+    return [segment for segment in path.strip().split('/') if segment]
+
+
+class FolderIndex:
+    """Per-user cache of Drive folders resolving paths like `books/scifi/2024` segment by segment."""
+
+    def __init__(self, max_size: int = FOLDER_CACHE_SIZE, ttl: float = FOLDER_CACHE_TTL):
+        # (user_id, parent_id) -> {folder_name: folder_id} for every folder inside the parent.
+        self._children = LRUCache(max_size, ttl)
+        # (user_id, folder_id) -> folder path.
+        self._paths = LRUCache(max_size, ttl)
+
+    async def resolve(self, drive, user_id: int, path: str) -> Union[str, None]:
+        """Returns id of the folder at `path`, None stands for the drive root. Raises `LookupError` if not found."""
+        parent_id = None
+        resolved = []
+
+        for segment in split_path(path):
+            if (children := self._children.get((user_id, parent_id or _ROOT))) is None:
+                children = await drive.list_folders(parent_id)
+                self._children.set((user_id, parent_id or _ROOT), children)
+
+            if (folder_id := children.get(segment)) is None:
+                raise LookupError(f"Folder '{'/'.join(resolved + [segment])}' doesn't exist.")
+
+            resolved.append(segment)
+            parent_id = folder_id
+            self._paths.set((user_id, folder_id), '/'.join(resolved))
+
+        return parent_id
+
+    async def get_path(self, drive, user_id: int, folder_id: str, verify: bool = True) -> Union[str, None]:
+        """Returns None if the folder is deleted or trashed, a cached path is checked unless `verify` is off."""
+        if (path := self._paths.get((user_id, folder_id))) is not None and not verify:
+            return path
+
+        if (name := await drive.get_folder_name(folder_id)) is None:
+            self._forget(user_id, folder_id)
+            return None
+
+        if path is None:
+            # Folder which was set before the index existed, only its own name is known.
+            path = name
+        elif (renamed_path := '/'.join(path.split('/')[:-1] + [name])) != path:
+            # The folder is renamed, so is its entry among the children of its parent.
+            self._forget(user_id, folder_id)
+            path = renamed_path
+
+        self._paths.set((user_id, folder_id), path)
+        return path
+
+    def _forget(self, user_id: int, folder_id: str):
+        self._paths.pop((user_id, folder_id))
+        for key, children in self._children.items():
+            if key[0] == user_id and folder_id in children.values():
+                self._children.pop(key)
+
+    def add(self, user_id: int, parent_id: Union[str, None], folder_name: str, folder_id: str):
+        if (children := self._children.get((user_id, parent_id or _ROOT))) is not None:
+            children.setdefault(folder_name, folder_id)
+
+        if parent_id is None:
+            self._paths.set((user_id, folder_id), folder_name)
+        elif (parent_path := self._paths.get((user_id, parent_id))) is not None:
+            self._paths.set((user_id, folder_id), f"{parent_path}/{folder_name}")
@@ -0,0 +1,35 @@
+import logging
+import traceback
+from typing import Union
+
+from settings import QUOTA_CACHE_TTL, USER_CACHE_SIZE
+from core.cache import LRUCache
+
+_logger = logging.getLogger(__name__)
+
+
+class QuotaCache:
+    """Per-user view of Drive storage quota, fetched once per `ttl` seconds and updated by completed uploads."""
+
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = QUOTA_CACHE_TTL):
+        self._quotas = LRUCache(max_size, ttl)
+
+    async def free_space(self, drive, user_id: int) -> Union[int, None]:
+        """Bytes left on the user's drive, None if the storage is unlimited or its quota can't be read now."""
+        if (quota := self._quotas.get(user_id)) is None:
+            try:
+                quota = await drive.get_storage_quota()
+            except Exception:
+                # Uploads aren't blocked by a failed check (an API or a network error alike),
+                # Drive rejects them itself when it's really full.
+                _logger.error(traceback.format_exc())
+                return None
+            self._quotas.set(user_id, quota)
+
+        if quota['limit'] is None:
+            return None
+        return max(quota['limit'] - quota['usage'], 0)
+
+    def add_usage(self, user_id: int, size: int):
+        if (quota := self._quotas.get(user_id)) is not None:
+            quota['usage'] += size
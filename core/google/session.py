@@ -1,21 +1,20 @@
-import time
-import json
 import logging
-import asyncio
-import traceback
 
 from aiogoogle.auth.utils import create_secret
 
-from settings import G_APP_CREDS
+from settings import USER_CACHE_SIZE, USER_CACHE_TTL, load_g_app_creds
+from core.cache import LRUCache
 from .drive import GoogleDrive
 
 _logger = logging.getLogger(__name__)
 
 
 class GoogleSession:
-    def __init__(self, google_client, db_client, user_id):
+    def __init__(self, google_client, db_client, token_manager, auth_notifier, user_id):
         self._db_client = db_client
         self._google_client = google_client
+        self._token_manager = token_manager
+        self._auth_notifier = auth_notifier
 
         self._user_id = user_id
         self._user_creds = None
@@ -31,49 +30,77 @@ class GoogleSession:
 
     async def _update_user_creds(self, new_creds: dict):
         self._user_creds = new_creds
-        self._drive_client = GoogleDrive(self._google_client, self._user_creds)
+        self._drive_client = GoogleDrive(self._google_client, self._user_creds, self._db_client, self._user_id,
+                                         self._token_manager)
 
     async def _authenticate_user(self):
-        if (user_creds := await self._db_client.get_user_creds(self._user_id)) is not None:
-            if self._google_client.oauth2.is_expired(user_creds):
-                try:
-                    user_creds = await self._google_client.oauth2.refresh(user_creds)
-                    await self._db_client.save_user_creds(json.dumps(user_creds), user_id=self._user_id)
-                except Exception:
-                    _logger.error(traceback.format_exc())
-                    await self._db_client.delete_auth(self._user_id)
-                else:
-                    await self._update_user_creds(user_creds)
-            else:
+        if (stored_creds := await self._db_client.get_user_creds(self._user_id)) is not None:
+            if (user_creds := await self._token_manager.get_fresh_creds(self._user_id, stored_creds)) is not None:
                 await self._update_user_creds(user_creds)
+            elif self._google_client.oauth2.is_expired(stored_creds):
+                await self._db_client.delete_auth(self._user_id)
+            else:
+                await self._update_user_creds(stored_creds)
         else:
             self._user_creds = None
 
     def is_authorized(self) -> bool:
         return self._user_creds is not None
 
-    async def wait_for_authorization(self, timeout: float = 120.0):
-        start_time = time.time()
+    def expires_soon(self) -> bool:
+        return self._token_manager.expires_soon(self._user_creds)
 
-        while True:
-            if (user_creds := await self._db_client.get_user_creds(self._user_id)) is not None:
-                await self._update_user_creds(user_creds)
-                break
+    async def wait_for_authorization(self, timeout: float = 120.0):
+        await self._auth_notifier.wait(self._user_id, timeout)
 
-            if time.time() - start_time >= timeout:
-                await self._db_client.delete_auth(self._user_id)
-                break
+        # Creds may have been saved by another process or through another url sent to the user, and a notification
+        # can be lost, so the database decides whether the user is authorized, not the notification.
+        self._db_client.invalidate(self._user_id)
+        if (user_creds := await self._db_client.get_user_creds(self._user_id)) is not None:
+            await self._update_user_creds(user_creds)
+            return
 
-            await asyncio.sleep(5.0)
+        await self._db_client.delete_auth(self._user_id)
 
     async def get_authorization_url(self) -> str:
         secret = create_secret()
         await self._db_client.init_auth(self._user_id, secret)
+        # Registered before the url is sent, so a quick authorization can't be missed.
+        self._auth_notifier.expect(self._user_id)
 
         return self._google_client.oauth2.authorization_url(
-            client_creds=G_APP_CREDS,
+            client_creds=load_g_app_creds(),
             state=secret,
             access_type="offline",
             include_granted_scopes=True,
             prompt="select_account consent",
         )
+
+
+class GoogleSessionCache:
+    def __init__(self, google_client, db_client, token_manager, auth_notifier, max_size: int = USER_CACHE_SIZE,
+                 ttl: float = USER_CACHE_TTL):
+        self._google_client = google_client
+        self._db_client = db_client
+        self._token_manager = token_manager
+        self._auth_notifier = auth_notifier
+        self._sessions = LRUCache(max_size, ttl)
+
+        db_client.add_invalidation_callback(self._sessions.pop)
+
+    @property
+    def stats(self) -> dict:
+        return self._sessions.stats()
+
+    def add(self, user_id: int, session: GoogleSession):
+        if session.is_authorized():
+            self._sessions.set(user_id, session)
+
+    async def get(self, user_id: int) -> GoogleSession:
+        if (session := self._sessions.get(user_id)) is not None and not session.expires_soon():
+            return session
+
+        session = await GoogleSession(self._google_client, self._db_client, self._token_manager, self._auth_notifier,
+                                      user_id)
+        self.add(user_id, session)
+        return session
@@ -0,0 +1,104 @@
+import json
+import time
+import asyncio
+import logging
+import traceback
+from datetime import datetime, timedelta
+from typing import Union
+
+from settings import TOKEN_REFRESH_MARGIN, TOKEN_REFRESH_INTERVAL, USER_CACHE_SIZE, USER_CACHE_TTL
+from core.cache import LRUCache
+from core.metrics import TOKEN_REFRESH_SECONDS
+
+_logger = logging.getLogger(__name__)
+
+
+class TokenRejectedError(Exception):
+    """Google has answered 401 to the access token, e.g. it has expired during a long transfer."""
+
+
+class TokenManager:
+    def __init__(self, google_client, db_client, refresh_margin: float = TOKEN_REFRESH_MARGIN,
+                 check_interval: float = TOKEN_REFRESH_INTERVAL):
+        self._google_client = google_client
+        self._db_client = db_client
+        self._refresh_margin = timedelta(seconds=refresh_margin)
+        self._check_interval = check_interval
+
+        # Creds of recently active users, these are refreshed in background before they expire.
+        self._tracked_creds = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+        self._in_flight = {}
+        self._refresh_task = None
+
+        db_client.add_invalidation_callback(self._tracked_creds.pop)
+
+    def start(self):
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    def expires_soon(self, creds: dict) -> bool:
+        if not (expires_at := creds.get('expires_at')):
+            return True
+        return datetime.fromisoformat(expires_at) - datetime.utcnow() <= self._refresh_margin
+
+    async def get_fresh_creds(self, user_id: int, creds: dict) -> Union[dict, None]:
+        if (tracked_creds := self._tracked_creds.get(user_id)) is not None and not self.expires_soon(tracked_creds):
+            return tracked_creds
+
+        if not self.expires_soon(creds):
+            self._tracked_creds.set(user_id, creds)
+            return creds
+
+        return await self.refresh(user_id, creds)
+
+    async def replace_rejected(self, user_id: int, creds: dict) -> Union[dict, None]:
+        """Creds to use instead of rejected `creds`, they are refreshed unless another call has done it already."""
+        if ((tracked_creds := self._tracked_creds.get(user_id)) is not None
+                and tracked_creds.get('access_token') != creds.get('access_token')):
+            return tracked_creds
+
+        return await self.refresh(user_id, creds)
+
+    async def refresh(self, user_id: int, creds: dict) -> Union[dict, None]:
+        # Concurrent refreshes of the same user share one request to the token endpoint.
+        if (refresh_task := self._in_flight.get(user_id)) is None:
+            refresh_task = asyncio.create_task(self._refresh(user_id, creds))
+            self._in_flight[user_id] = refresh_task
+            refresh_task.add_done_callback(lambda _: self._in_flight.pop(user_id, None))
+
+        return await asyncio.shield(refresh_task)
+
+    async def _refresh(self, user_id: int, creds: dict) -> Union[dict, None]:
+        started_at = time.perf_counter()
+        try:
+            new_creds = await self._google_client.oauth2.refresh(creds)
+        except Exception:
+            TOKEN_REFRESH_SECONDS.observe(time.perf_counter() - started_at, result='error')
+            _logger.error(traceback.format_exc())
+            return None
+
+        TOKEN_REFRESH_SECONDS.observe(time.perf_counter() - started_at, result='ok')
+
+        await self._db_client.save_user_creds(json.dumps(new_creds), user_id=user_id)
+        self._tracked_creds.set(user_id, new_creds)
+        return new_creds
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self._check_interval)
+
+            expiring = [(user_id, creds) for user_id, creds in self._tracked_creds.items()
+                        if self.expires_soon(creds)]
+            if expiring:
+                _logger.info(f"[*] Refreshing {len(expiring)} expiring google tokens")
+                await asyncio.gather(*(self.refresh(user_id, creds) for user_id, creds in expiring),
+                                     return_exceptions=True)
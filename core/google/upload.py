@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import functools
+from typing import AsyncIterable, Awaitable, Callable, Union
+
+from aiohttp import ClientError, ClientSession
+
+from settings import DRIVE_UPLOAD_URL, UPLOAD_CHUNK_SIZE
+from core.metrics import DRIVE_HTTP_ERRORS, TRANSFERRED_BYTES
+from core.retry import DRIVE_RETRY, RetryableError, parse_retry_after, retry_reason
+
+from .tokens import TokenRejectedError
+
+_logger = logging.getLogger(__name__)
+
+# Drive requires every chunk except the last one to be a multiple of 256 KiB.
+_CHUNK_GRANULARITY = 256 * 1024
+_EXPIRED_STATUSES = (404, 410)
+
+
+class UploadError(Exception):
+    pass
+
+
+class _TransientUploadError(UploadError, RetryableError):
+    pass
+
+
+class _RejectedTokenError(UploadError, TokenRejectedError):
+    pass
+
+
+class ResumableUpload:
+    def __init__(self, http: ClientSession, access_token: Callable[[bool], Awaitable[str]], db_client=None,
+                 upload_key: str = None, user_id: int = None, chunk_size: int = UPLOAD_CHUNK_SIZE,
+                 progress: Callable[[int, int], Awaitable] = None):
+        if chunk_size <= 0 or chunk_size % _CHUNK_GRANULARITY:
+            raise ValueError(f"Chunk size must be a positive multiple of {_CHUNK_GRANULARITY} bytes.")
+
+        self._http = http
+        # Returns the token to authorize requests with, True asks for a new one after Drive has rejected it.
+        self._access_token = access_token
+        self._chunk_size = chunk_size
+        self._progress = progress
+
+        # Session uri and confirmed offset are persisted only when both are given.
+        self._db_client = db_client if upload_key is not None else None
+        self._upload_key = upload_key
+        self._user_id = user_id
+
+        self._session_uri = None
+        self._total_size = None
+        self._offset = 0
+        self._result = None
+
+    @property
+    def session_uri(self) -> Union[str, None]:
+        return self._session_uri
+
+    @property
+    def offset(self) -> int:
+        return self._offset
+
+    async def _auth_headers(self) -> dict:
+        return {'Authorization': f"Bearer {await self._access_token(False)}"}
+
+    async def open(self, metadata: dict, total_size: int, fields: str = None) -> int:
+        self._total_size = total_size
+
+        if self._db_client is not None and (stored := await self._db_client.get_upload_session(self._upload_key)):
+            session_uri, stored_size, _stored_offset = stored
+            if stored_size == total_size:
+                self._session_uri = session_uri
+                try:
+                    await self._with_retries(self._query_status)
+                except UploadError as e:
+                    _logger.info(f"[*] Upload session for '{self._upload_key}' can't be resumed: {e}")
+                else:
+                    _logger.info(f"[*] Resuming upload '{self._upload_key}' from {self._offset} bytes")
+                    return self._offset
+
+            await self._db_client.delete_upload_session(self._upload_key)
+            self._session_uri = None
+
+        await self._with_retries(self._start, metadata, fields)
+
+        if self._db_client is not None:
+            await self._db_client.save_upload_session(self._upload_key, self._user_id, self._session_uri, total_size)
+
+        return self._offset
+
+    async def upload(self, chunks: AsyncIterable[bytes]) -> dict:
+        if self._session_uri is None:
+            raise UploadError("Upload session is not opened.")
+
+        buffer = bytearray()
+
+        async for chunk in chunks:
+            buffer += chunk
+            while len(buffer) >= self._chunk_size:
+                sent_before = self._offset
+                if await self._send_from(buffer, self._chunk_size) is None and self._offset == sent_before:
+                    raise UploadError("Upload session didn't accept the chunk.")
+
+        while self._result is None:
+            sent_before = self._offset
+            if await self._send_from(buffer, len(buffer)) is None and self._offset == sent_before:
+                raise UploadError("Upload session didn't accept the rest of the file.")
+
+        return await self._complete()
+
+    async def upload_view(self, view: memoryview) -> dict:
+        """Uploads a file which is available as a whole, e.g. memory-mapped, sending its slices without copying."""
+        if self._session_uri is None:
+            raise UploadError("Upload session is not opened.")
+
+        while self._result is None:
+            sent_before = self._offset
+            end = min(sent_before + self._chunk_size, len(view))
+            if await self._send(view, 0, end) is None and self._offset == sent_before:
+                raise UploadError("Upload session didn't accept the rest of the file.")
+
+        return await self._complete()
+
+    async def _complete(self) -> dict:
+        if self._db_client is not None:
+            await self._db_client.delete_upload_session(self._upload_key)
+
+        return self._result
+
+    async def _send_from(self, buffer: bytearray, size: int) -> Union[dict, None]:
+        start = self._offset
+        result = await self._send(buffer, start, size)
+        # Drive may persist only a part of the chunk, the rest stays in buffer for the next request.
+        del buffer[:self._offset - start]
+        return result
+
+    async def _send(self, data: Union[bytearray, memoryview], start: int, end: int) -> Union[dict, None]:
+        """Sends `data[:end]`, where `data[0]` is the byte at `start` offset of the file."""
+        sent_before = self._offset
+        result = await self._with_retries(self._send_chunk, data, start, end)
+
+        if self._offset != sent_before:
+            TRANSFERRED_BYTES.inc(self._offset - sent_before, direction='upload')
+            if result is None and self._db_client is not None:
+                await self._db_client.update_upload_offset(self._upload_key, self._offset)
+
+            if self._progress is not None:
+                await self._progress(self._offset, self._total_size)
+
+        return result
+
+    async def _with_retries(self, action, *args):
+        on_retry = self._refresh_offset if action != self._query_status else None
+        try:
+            try:
+                return await DRIVE_RETRY.call(functools.partial(action, *args), key=self._user_id, on_retry=on_retry)
+            except _RejectedTokenError:
+                # Big uploads outlive the token they have started with, the request is repeated once with a new one.
+                await self._access_token(True)
+                return await DRIVE_RETRY.call(functools.partial(action, *args), key=self._user_id, on_retry=on_retry)
+        except (_TransientUploadError, ClientError, asyncio.TimeoutError) as e:
+            raise UploadError(f"Upload failed after retries: {e!r}") from e
+
+    async def _refresh_offset(self):
+        # After a failed request we don't know how much Drive has received, so ask it.
+        if self._session_uri is not None:
+            try:
+                await self._query_status()
+            except (_TransientUploadError, ClientError, asyncio.TimeoutError):
+                pass
+
+    async def _start(self, metadata: dict, fields: Union[str, None]):
+        params = {'uploadType': 'resumable'}
+        if fields is not None:
+            params['fields'] = fields
+
+        headers = {
+            **await self._auth_headers(),
+            'X-Upload-Content-Length': str(self._total_size),
+        }
+        if mime_type := metadata.get('mimeType'):
+            headers['X-Upload-Content-Type'] = mime_type
+
+        async with self._http.post(DRIVE_UPLOAD_URL, params=params, json=metadata, headers=headers) as response:
+            if response.status != 200:
+                DRIVE_HTTP_ERRORS.inc(code=response.status)
+                await self._raise_for_transient(response, "Upload session start")
+
+            if response.status != 200 or 'Location' not in response.headers:
+                raise UploadError(f"Can't start upload session ({response.status}): {await response.text()}")
+
+            self._session_uri = response.headers['Location']
+            self._offset = 0
+
+    async def _query_status(self):
+        headers = {**await self._auth_headers(), 'Content-Range': f"bytes */{self._total_size}"}
+        async with self._http.put(self._session_uri, headers=headers) as response:
+            await self._handle_response(response)
+
+    async def _send_chunk(self, buffer: Union[bytearray, memoryview], start: int, end: int) -> Union[dict, None]:
+        # Offset could move forward since `start` if a retried request was partially persisted.
+        # Slice of a bytearray is already a copy and slice of a memoryview doesn't need one.
+        data = buffer[self._offset - start:end]
+        if data:
+            content_range = f"bytes {self._offset}-{self._offset + len(data) - 1}/{self._total_size}"
+        else:
+            content_range = f"bytes */{self._total_size}"
+
+        headers = {**await self._auth_headers(), 'Content-Range': content_range}
+
+        async with self._http.put(self._session_uri, data=data, headers=headers) as response:
+            return await self._handle_response(response)
+
+    async def _handle_response(self, response) -> Union[dict, None]:
+        if response.status == 308:
+            self._offset = self._confirmed_offset(response)
+            return None
+
+        if response.status in (200, 201):
+            self._offset = self._total_size
+            self._result = await response.json()
+            return self._result
+
+        DRIVE_HTTP_ERRORS.inc(code=response.status)
+        await self._raise_for_transient(response, "Chunk upload")
+
+        if response.status in _EXPIRED_STATUSES:
+            raise UploadError(f"Upload session has expired ({response.status})")
+
+        raise UploadError(f"Chunk upload failed ({response.status}): {await response.text()}")
+
+    @staticmethod
+    async def _raise_for_transient(response, action: str):
+        if response.status == 401:
+            raise _RejectedTokenError(f"{action} returned 401")
+
+        if (reason := retry_reason(response.status, await response.text())) is not None:
+            raise _TransientUploadError(f"{action} returned {response.status}", reason,
+                                        parse_retry_after(response.headers))
+
+    @staticmethod
+    def _confirmed_offset(response) -> int:
+        # `Range: bytes=0-N` means that N + 1 bytes are persisted. No header means nothing is.
+        if (confirmed_range := response.headers.get('Range')) is None:
+            return 0
+
+        return int(confirmed_range.rsplit('-', 1)[1]) + 1
@@ -0,0 +1,199 @@
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Dict, Iterable, List, Tuple
+
+# Transfers last from seconds to tens of minutes, short calls (DB, tokens) take milliseconds.
+TRANSFER_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        # Metrics without labels are exposed from the start, not after the first change.
+        if not self.label_names and self.type != 'histogram':
+            self._values[()] = 0
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> Dict[Tuple[str, ...], object]:
+        return dict(self._values)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for key, value in sorted(self._values.items()):
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key: Tuple[str, ...], value) -> List[str]:
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        if (state := self._values.get(key)) is None:
+            # Per-bucket counts (the last one is +Inf), sum of observations.
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def samples(self) -> Dict[Tuple[str, ...], Dict[str, float]]:
+        return {key: {'count': sum(counts), 'sum': total} for key, (counts, total) in self._values.items()}
+
+    def time(self, **labels) -> "_Timer":
+        return _Timer(self, labels)
+
+    def _render_value(self, key: Tuple[str, ...], value) -> List[str]:
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, '+Inf'), counts):
+            cumulative += count
+            le = f'le="{bound if bound == "+Inf" else _format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+
+        labels = _format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Timer:
+    """Context manager observing time spent inside it unless it's left with an error, also usable with `async with`."""
+
+    def __init__(self, histogram: Histogram, labels: dict):
+        self._histogram = histogram
+        self._labels = labels
+        self._started_at = None
+
+    def __enter__(self):
+        self._started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *_exc_info):
+        if exc_type is None:
+            self._histogram.observe(time.perf_counter() - self._started_at, **self._labels)
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc_info):
+        self.__exit__(*exc_info)
+
+
+def timed_method(histogram: Histogram):
+    """Observes duration of every call of the decorated coroutine method, labeled with its name."""
+    def decorator(method):
+        @wraps(method)
+        async def wrapper(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started_at, method=method.__name__)
+        return wrapper
+    return decorator
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(line for metric in self._metrics for line in metric.render()) + '\n'
+
+
+REGISTRY = Registry()
+
+TELEGRAM_DOWNLOAD_SECONDS = REGISTRY.register(Histogram(
+    'gdrive_bot_telegram_download_seconds', "Time of downloading a file from Telegram.",
+    labels=('mode',), buckets=TRANSFER_BUCKETS))
+DRIVE_UPLOAD_SECONDS = REGISTRY.register(Histogram(
+    'gdrive_bot_drive_upload_seconds', "Time of uploading a file to Google Drive.",
+    labels=('mode',), buckets=TRANSFER_BUCKETS))
+TOKEN_REFRESH_SECONDS = REGISTRY.register(Histogram(
+    'gdrive_bot_token_refresh_seconds', "Time of refreshing a Google access token.", labels=('result',)))
+DB_QUERY_SECONDS = REGISTRY.register(Histogram(
+    'gdrive_bot_db_query_seconds', "Latency of database client methods.", labels=('method',)))
+TRANSFERRED_BYTES = REGISTRY.register(Counter(
+    'gdrive_bot_transferred_bytes_total', "Bytes downloaded from Telegram and uploaded to Google Drive.",
+    labels=('direction',)))
+TRANSFERS_IN_FLIGHT = REGISTRY.register(Gauge(
+    'gdrive_bot_transfers_in_flight', "Transfers running right now."))
+TRANSFERS_QUEUED = REGISTRY.register(Gauge(
+    'gdrive_bot_transfers_queued', "Transfers waiting in the queue."))
+FLOOD_WAITS = REGISTRY.register(Counter(
+    'gdrive_bot_flood_waits_total', "FloodWait errors returned by Telegram.", labels=('operation',)))
+DRIVE_HTTP_ERRORS = REGISTRY.register(Counter(
+    'gdrive_bot_drive_http_errors_total', "Error responses returned by Google Drive.", labels=('code',)))
+QUOTA_REJECTED_FILES = REGISTRY.register(Counter(
+    'gdrive_bot_quota_rejected_files_total', "Documents rejected as they don't fit into the user's Drive.",
+    labels=('stage',)))
+QUOTA_REJECTED_BYTES = REGISTRY.register(Counter(
+    'gdrive_bot_quota_rejected_bytes_total', "Bytes of documents rejected as they don't fit into the user's Drive.",
+    labels=('stage',)))
+RETRIES = REGISTRY.register(Counter(
+    'gdrive_bot_retries_total', "Calls repeated after transient errors.", labels=('policy', 'reason')))
+CIRCUIT_BREAKER_OPENS = REGISTRY.register(Counter(
+    'gdrive_bot_circuit_breaker_opens_total', "Times calls of a user were paused after repeated transient errors.",
+    labels=('policy',)))
+STARTUP_SECONDS = REGISTRY.register(Gauge(
+    'gdrive_bot_startup_seconds', "Time taken by startup steps of the process, including imports they need.",
+    labels=('step',)))
+LOOP_LAG_SECONDS = REGISTRY.register(Histogram(
+    'gdrive_bot_loop_lag_seconds', "Delay of the event loop waking up a task, high values mean it was blocked."))
+LOOP_STALLS = REGISTRY.register(Counter(
+    'gdrive_bot_loop_stalls_total', "Times the event loop was blocked for longer than the threshold."))
@@ -0,0 +1,201 @@
+import time
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Callable, Union
+
+from aiosqlite import connect
+
+from settings import REDIS_URL
+
+_logger = logging.getLogger(__name__)
+
+MessageCallback = Callable[[str], None]
+
+
+class RedisBackend:
+    """Shared state backend for running the bot and transfer workers as separate processes on several nodes.
+
+    Requires the optional `redis` package.
+    """
+
+    def __init__(self, url: str):
+        from redis import asyncio as aioredis
+
+        self._client = aioredis.from_url(url, decode_responses=True)
+        self._pubsub = self._client.pubsub()
+        self._callbacks = defaultdict(list)
+        self._listener = None
+
+    async def publish(self, channel: str, message: str):
+        await self._client.publish(channel, message)
+
+    async def push(self, queue: str, message: str):
+        await self._client.lpush(queue, message)
+
+    async def pop(self, queue: str, timeout: float) -> Union[str, None]:
+        if (result := await self._client.brpop(queue, timeout=timeout)) is not None:
+            return result[1]
+
+    async def subscribe(self, channel: str, callback: MessageCallback):
+        self._callbacks[channel].append(callback)
+        await self._pubsub.subscribe(channel)
+
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    if message['type'] == 'message':
+                        for callback in self._callbacks[message['channel']]:
+                            callback(message['data'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                _logger.error(f"[!] Redis subscription failed: {e!r}")
+                await asyncio.sleep(1.0)
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+
+        await self._pubsub.close()
+        await self._client.close()
+
+
+class FakeRedisBackend:
+    """In-memory backend with the same interface as `RedisBackend`, for a single process and tests."""
+
+    def __init__(self):
+        self._callbacks = defaultdict(list)
+        self._queues = defaultdict(asyncio.Queue)
+
+    async def publish(self, channel: str, message: str):
+        for callback in self._callbacks[channel]:
+            callback(message)
+
+    async def push(self, queue: str, message: str):
+        self._queues[queue].put_nowait(message)
+
+    async def pop(self, queue: str, timeout: float) -> Union[str, None]:
+        try:
+            return await asyncio.wait_for(self._queues[queue].get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def subscribe(self, channel: str, callback: MessageCallback):
+        self._callbacks[channel].append(callback)
+
+    async def close(self):
+        self._callbacks.clear()
+        self._queues.clear()
+
+
+class SQLiteBackend:
+    """Backend with the same interface as `RedisBackend` for processes sharing one node, kept in a SQLite file.
+
+    Messages and queued items are polled, so they are delivered within `poll_interval`.
+    """
+
+    _MESSAGES_TTL = 60.0
+
+    def __init__(self, file_path: str, poll_interval: float = 0.2):
+        self._file_path = file_path
+        self._poll_interval = poll_interval
+        self._connection = None
+        self._lock = asyncio.Lock()
+        self._callbacks = defaultdict(list)
+        self._last_message_id = 0
+        self._listener = None
+
+    async def _execute(self, sql: str, parameters: tuple = (), fetch: bool = False):
+        async with self._lock:
+            if self._connection is None:
+                self._connection = await connect(self._file_path)
+                for statement in (
+                    "PRAGMA journal_mode=WAL;",
+                    "PRAGMA busy_timeout=5000;",
+                    "CREATE TABLE IF NOT EXISTS shared_messages ("
+                    "id integer primary key autoincrement, channel text, message text, created_at real);",
+                    "CREATE TABLE IF NOT EXISTS shared_queue ("
+                    "id integer primary key autoincrement, queue text, message text);",
+                ):
+                    await self._connection.execute(statement)
+
+            cursor = await self._connection.execute(sql, parameters)
+            result = await cursor.fetchall() if fetch else None
+            await self._connection.commit()
+            return result
+
+    async def publish(self, channel: str, message: str):
+        await self._execute("INSERT INTO shared_messages (channel, message, created_at) VALUES (?,?,?);",
+                            (channel, message, time.time()))
+
+    async def subscribe(self, channel: str, callback: MessageCallback):
+        self._callbacks[channel].append(callback)
+
+        if self._listener is None:
+            # Only messages published after the first subscription are delivered.
+            rows = await self._execute("SELECT COALESCE(MAX(id), 0) FROM shared_messages;", fetch=True)
+            self._last_message_id = rows[0][0]
+            self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            try:
+                rows = await self._execute("SELECT id, channel, message FROM shared_messages WHERE id > ? ORDER BY id;",
+                                           (self._last_message_id,), fetch=True)
+                for message_id, channel, message in rows:
+                    self._last_message_id = message_id
+                    for callback in self._callbacks[channel]:
+                        callback(message)
+
+                await self._execute("DELETE FROM shared_messages WHERE created_at < ?;",
+                                    (time.time() - self._MESSAGES_TTL,))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                _logger.error(f"[!] Polling shared messages failed: {e!r}")
+
+            await asyncio.sleep(self._poll_interval)
+
+    async def push(self, queue: str, message: str):
+        await self._execute("INSERT INTO shared_queue (queue, message) VALUES (?,?);", (queue, message))
+
+    async def pop(self, queue: str, timeout: float) -> Union[str, None]:
+        deadline = time.monotonic() + timeout
+        while True:
+            # Deleting the row is what claims it, so an item is never taken by two processes.
+            if rows := await self._execute(
+                    "DELETE FROM shared_queue WHERE id = (SELECT MIN(id) FROM shared_queue WHERE queue=?) "
+                    "RETURNING message;", (queue,), fetch=True):
+                return rows[0][0]
+
+            if time.monotonic() >= deadline:
+                return None
+            await asyncio.sleep(min(self._poll_interval, max(deadline - time.monotonic(), 0)))
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+
+
+def create_backend(url: Union[str, None] = REDIS_URL) -> Union[RedisBackend, SQLiteBackend, FakeRedisBackend, None]:
+    if not url:
+        return None
+
+    if url == "memory://":
+        return FakeRedisBackend()
+
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):])
+
+    return RedisBackend(url)
@@ -0,0 +1,218 @@
+import json
+import time
+import random
+import asyncio
+import logging
+import itertools
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Collection, Hashable, Tuple, Union
+
+from aiohttp import ClientError
+
+from settings import (
+    RETRY_MAX_RETRIES,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_DELAY,
+    CIRCUIT_BREAKER_THRESHOLD,
+    CIRCUIT_BREAKER_COOLDOWN,
+)
+from core.metrics import CIRCUIT_BREAKER_OPENS, RETRIES
+
+_logger = logging.getLogger(__name__)
+
+# Drive answers 403 with these reasons instead of 429 when a user or the project exceeds its quota.
+_RATE_LIMIT_REASONS = {'userRateLimitExceeded', 'rateLimitExceeded'}
+
+
+class RetryableError(Exception):
+    """Failure of a call which is worth repeating, `retry_after` is the delay requested by the server."""
+
+    def __init__(self, message: str, reason: str = 'server_error', retry_after: float = 0.0):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def retry_reason(status: int, body: Union[dict, str, bytes, None] = None) -> Union[str, None]:
+    """Returns why a response with `status` is worth retrying, or None if it isn't."""
+    if status == 429:
+        return 'rate_limit'
+
+    if status >= 500:
+        return 'server_error'
+
+    if status == 403 and _error_reasons(body) & _RATE_LIMIT_REASONS:
+        return 'rate_limit'
+
+    return None
+
+
+def _error_reasons(body: Union[dict, str, bytes, None]) -> set:
+    if isinstance(body, (str, bytes)):
+        try:
+            body = json.loads(body)
+        except ValueError:
+            return set()
+
+    if not isinstance(body, dict) or not isinstance(error := body.get('error'), dict):
+        return set()
+
+    return {item.get('reason') for item in error.get('errors', []) if isinstance(item, dict)}
+
+
+def parse_retry_after(headers) -> float:
+    """Seconds to wait according to `Retry-After` header, which holds either seconds or an HTTP date."""
+    if not headers or (value := headers.get('Retry-After', headers.get('retry-after'))) is None:
+        return 0.0
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def classify(error: BaseException) -> Union[Tuple[str, float], None]:
+    """Returns (reason, delay requested by the server) for a transient error, None for a permanent one."""
+    # Both are imported on the first failure, so modules using retries don't load Pyrogram and Aiogoogle on import.
+    from pyrogram.errors import FloodWait
+    from aiogoogle.excs import HTTPError
+
+    if isinstance(error, FloodWait):
+        return 'flood_wait', float(error.value)
+
+    if isinstance(error, RetryableError):
+        return error.reason, error.retry_after
+
+    if isinstance(error, HTTPError):
+        if (response := error.res) is None or (reason := retry_reason(response.status_code, response.json)) is None:
+            return None
+        return reason, parse_retry_after(response.headers)
+
+    if isinstance(error, (ClientError, ConnectionError, asyncio.TimeoutError)):
+        return 'network', 0.0
+
+    return None
+
+
+class CircuitBreaker:
+    """Pauses all calls of a key (a user) after `threshold` transient failures in a row.
+
+    A delay requested by the server pauses the key right away. When the pause is over calls go through again,
+    every new failure pauses them once more and the first success resets the breaker.
+    """
+
+    def __init__(self, name: str, threshold: int = CIRCUIT_BREAKER_THRESHOLD,
+                 cooldown: float = CIRCUIT_BREAKER_COOLDOWN):
+        self._name = name
+        self._threshold = threshold
+        self._cooldown = cooldown
+        self._failures = {}
+        self._paused_until = {}
+
+    def paused_for(self, key: Hashable) -> float:
+        if (paused_until := self._paused_until.get(key)) is None:
+            return 0.0
+
+        if (delay := paused_until - time.monotonic()) <= 0:
+            del self._paused_until[key]
+            return 0.0
+
+        return delay
+
+    async def wait(self, key: Hashable):
+        while (delay := self.paused_for(key)) > 0:
+            await asyncio.sleep(delay)
+
+    def record_failure(self, key: Hashable, retry_after: float = 0.0):
+        failures = self._failures[key] = self._failures.get(key, 0) + 1
+
+        pause = retry_after
+        if failures >= self._threshold:
+            pause = max(pause, self._cooldown)
+            if not self.paused_for(key):
+                CIRCUIT_BREAKER_OPENS.inc(policy=self._name)
+                _logger.warning(f"[!] {failures} transient {self._name} errors in a row for {key}, "
+                                f"pausing its calls for {pause:.1f}s")
+
+        if pause > 0:
+            self._paused_until[key] = max(self._paused_until.get(key, 0.0), time.monotonic() + pause)
+
+    def record_success(self, key: Hashable):
+        # Keys which have reset are dropped, so the breaker doesn't grow with every key it has seen.
+        self._failures.pop(key, None)
+        self.paused_for(key)
+
+
+class RetryPolicy:
+    """Repeats calls failing with transient errors, waiting with exponential backoff and jitter in between.
+
+    A delay requested by the server (`Retry-After`, `FloodWait.value`) is never shortened.
+    """
+
+    def __init__(self, name: str, max_retries: int = RETRY_MAX_RETRIES, base_delay: float = RETRY_BASE_DELAY,
+                 max_delay: float = RETRY_MAX_DELAY, breaker: CircuitBreaker = None):
+        self._name = name
+        self._max_retries = max_retries
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._breaker = breaker
+
+    def delay(self, attempt: int, retry_after: float = 0.0) -> float:
+        # Half of the backoff is random, so calls failed together don't come back together.
+        backoff = min(self._max_delay, self._base_delay * 2 ** attempt)
+        return max(retry_after, backoff / 2 + random.uniform(0, backoff / 2))
+
+    async def backoff(self, attempt: int, reason: str, retry_after: float = 0.0, key: Hashable = None) -> bool:
+        """Waits after a transient failure of `attempt` (counted from 0), False means no attempts are left."""
+        if self._breaker is not None and key is not None:
+            self._breaker.record_failure(key, retry_after)
+
+        if attempt >= self._max_retries:
+            return False
+
+        delay = self.delay(attempt, retry_after)
+        RETRIES.inc(policy=self._name, reason=reason)
+        _logger.warning(f"[!] Transient {self._name} error ({reason}), "
+                        f"retry {attempt + 1} of {self._max_retries} in {delay:.1f}s")
+        await asyncio.sleep(delay)
+        return True
+
+    def record_success(self, key: Hashable):
+        """Resets the breaker of `key` after a call which has been retried by `backoff` succeeds."""
+        if self._breaker is not None and key is not None:
+            self._breaker.record_success(key)
+
+    async def call(self, action: Callable[[], Awaitable], key: Hashable = None,
+                   on_retry: Callable[[], Awaitable] = None, reasons: Collection[str] = None):
+        """Awaits `action()` until it succeeds, fails permanently or runs out of attempts.
+
+        `key` shares the circuit breaker between calls of one user, `on_retry` runs before every repeated call.
+        `reasons` limits the transient failures which are retried, all of them are by default.
+        """
+        for attempt in itertools.count():
+            if self._breaker is not None and key is not None:
+                await self._breaker.wait(key)
+
+            try:
+                result = await action()
+            except Exception as e:
+                if ((classified := classify(e)) is None or (reasons is not None and classified[0] not in reasons)
+                        or not await self.backoff(attempt, *classified, key=key)):
+                    raise
+
+                if on_retry is not None:
+                    await on_retry()
+            else:
+                self.record_success(key)
+                return result
+
+
+# Quotas of Drive are per user, so is the breaker. Telegram limits are mostly bot-wide and reported by FloodWait.
+DRIVE_RETRY = RetryPolicy('drive', breaker=CircuitBreaker('drive'))
+TELEGRAM_RETRY = RetryPolicy('telegram')
@@ -1 +1,3 @@
 from .tg_bot import GoogleDriveManager
+from .worker import TransferWorker
+from .recovery import JobRecovery
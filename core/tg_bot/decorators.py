@@ -1,5 +1,4 @@
 from .types import HandlerType
-from core.google import GoogleSession
 
 _AUTHENTICATION_FAILURE_MESSAGE = "❌ Authentication failed.\nTry again later."
 
@@ -10,10 +9,11 @@ def with_google_session(handler_type: HandlerType):
     def inner(handler):
         async def with_auth(tg_app, message_or_callback):
             user_id = message_or_callback.from_user.id
-            if not (google_session := await GoogleSession(tg_app.google, tg_app.db_client, user_id)).is_authorized():
+            if not (google_session := await tg_app.google_sessions.get(user_id)).is_authorized():
                 auth_url = await google_session.get_authorization_url()
                 await tg_app.send_authorization_request(user_id, auth_url)
                 await google_session.wait_for_authorization()
+                tg_app.google_sessions.add(user_id, google_session)
 
             if google_session.is_authorized():
                 message_or_callback.from_user.google_session = google_session
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from collections import deque
+from io import BytesIO
+from typing import AsyncIterator, Union
+
+from pyrogram import raw
+from pyrogram.file_id import FileId
+from pyrogram.session import Session
+
+from settings import DOWNLOAD_PARALLEL_MIN_SIZE, DOWNLOAD_MAX_CONCURRENCY
+
+from .sessions import MediaSessions
+
+_logger = logging.getLogger(__name__)
+
+# Parts are as big as `upload.GetFile` allows, the same as `stream_media` yields.
+PART_SIZE = 1024 * 1024
+
+
+class _CdnRedirect(Exception):
+    pass
+
+
+class ParallelDownloader:
+    """Downloads big documents by requesting several parts at once over media sessions of their DC.
+
+    Telegram serves every `upload.GetFile` request at a limited speed, so a sequential download can't use
+    the whole link. Parts are still yielded in order and at most `concurrency` of them are held in memory.
+    Documents smaller than `min_size` are left to Pyrogram.
+    """
+
+    def __init__(self, client, sessions: MediaSessions, min_size: int = DOWNLOAD_PARALLEL_MIN_SIZE,
+                 max_concurrency: int = DOWNLOAD_MAX_CONCURRENCY):
+        self._client = client
+        self._sessions = sessions
+        self._min_size = min_size
+        self._max_concurrency = max_concurrency
+
+    def concurrency(self, file_size: int) -> int:
+        if file_size < self._min_size:
+            return 1
+        # One more part in flight for every `min_size` bytes, bigger files gain more from it.
+        return min(self._max_concurrency, 1 + file_size // self._min_size)
+
+    async def stream(self, message, offset: int = 0) -> AsyncIterator[bytes]:
+        """Yields parts of the message document starting from part `offset`, like `stream_media` does."""
+        document = message.document
+        part_count = -(-document.file_size // PART_SIZE)
+        if (concurrency := self.concurrency(document.file_size)) == 1 or offset >= part_count:
+            async for chunk in self._client.stream_media(message, offset=offset):
+                yield chunk
+            return
+
+        sessions, location = await self._open(document)
+        pending = deque()
+        next_part = offset
+        try:
+            while pending or next_part < part_count:
+                while next_part < part_count and len(pending) < concurrency:
+                    session = sessions[next_part % len(sessions)]
+                    pending.append((next_part, asyncio.ensure_future(self._fetch_part(session, location, next_part))))
+                    next_part += 1
+
+                part, task = pending.popleft()
+                try:
+                    yield await task
+                except _CdnRedirect:
+                    # Parts served by a CDN have to be decrypted and verified, Pyrogram does that sequentially.
+                    _logger.info(f"[*] '{document.file_name}' is served by a CDN, downloading it sequentially")
+                    async for chunk in self._client.stream_media(message, offset=part):
+                        yield chunk
+                    return
+        finally:
+            for _part, task in pending:
+                task.cancel()
+
+    async def download(self, message, file_name: str = None, in_memory: bool = False, progress=None,
+                       progress_args=()) -> Union[str, BytesIO, None]:
+        """Saves the message document to `file_name` or memory, like `download_media` does."""
+        document = message.document
+        if self.concurrency(document.file_size) == 1:
+            return await self._client.download_media(document, file_name=file_name, in_memory=in_memory,
+                                                      progress=progress, progress_args=progress_args)
+
+        file = BytesIO() if in_memory else open(file_name, 'wb')
+        try:
+            async for chunk in self.stream(message):
+                file.write(chunk)
+                if progress is not None:
+                    await progress(file.tell(), document.file_size, *progress_args)
+        finally:
+            if not in_memory:
+                file.close()
+
+        return file if in_memory else file_name
+
+    async def _open(self, document) -> tuple:
+        """Returns sessions to download the document with and its location."""
+        file_id = FileId.decode(document.file_id)
+        location = raw.types.InputDocumentFileLocation(
+            id=file_id.media_id,
+            access_hash=file_id.access_hash,
+            file_reference=file_id.file_reference,
+            thumb_size=file_id.thumbnail_size
+        )
+        return await self._sessions.get(file_id.dc_id), location
+
+    async def _fetch_part(self, session: Session, location, part: int) -> bytes:
+        result = await session.invoke(
+            raw.functions.upload.GetFile(location=location, offset=part * PART_SIZE, limit=PART_SIZE),
+            sleep_threshold=30
+        )
+        if not isinstance(result, raw.types.upload.File):
+            raise _CdnRedirect()
+        return result.bytes
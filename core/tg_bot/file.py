@@ -14,4 +14,4 @@ class InMemoryFile:
         return self._mime_type
 
     def read(self):
-        return bytes(self._mem_link)
+        return memoryview(self._mem_link)
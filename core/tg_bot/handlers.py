@@ -1,81 +1,458 @@
+import os
+import re
+import uuid
+import asyncio
 import logging
 import traceback
+from datetime import datetime
+from typing import Union
 
+from pyrogram.errors import BadRequest
 from pyrogram.types import CallbackQuery, Message, InlineKeyboardMarkup, InlineKeyboardButton
-from pyrogram.errors.exceptions.flood_420 import FloodWait
 
 from .decorators import with_google_session
 from .types import HandlerType
 from .file import InMemoryFile
-
-from settings import HELP_MESSAGE
+from .stream import TelegramFileStream
+from .spool import map_file
+from .scheduler import TransferJob
+from .progress import ProgressReporter
+from .upload_groups import UploadGroup
+from .upload import MAX_FILE_SIZE
+
+from core.google.folders import split_path
+from core.metrics import (
+    DRIVE_UPLOAD_SECONDS,
+    TELEGRAM_DOWNLOAD_SECONDS,
+    TRANSFERRED_BYTES,
+    QUOTA_REJECTED_BYTES,
+    QUOTA_REJECTED_FILES,
+)
+from core.retry import TELEGRAM_RETRY, RetryableError
+
+from settings import HELP_MESSAGE, SPOOL_MEMORY_THRESHOLD, TRANSFER_MODE
 
 
 _logger = logging.getLogger(__name__)
 
+_CANCEL_PREFIX = "cancel:"
+_PUBLIC_GROUP_PREFIX = "public_group:"
+_FILES_PREFIX = "files:"
+_FILES_PAGE_SIZE = 5
+_GET_PREFIX = "get:"
+_DOWNLOADING_STAGE = "Downloading from Telegram..."
+_UPLOADING_STAGE = "Uploading to Google Drive..."
+_SENDING_STAGE = "Sending from Google Drive..."
+# Status of jobs interrupted by a shutdown, stored jobs are resumed by the next process, the others aren't.
+_TRANSFER_PAUSED_TEXT = "⏸ Bot is restarting, transferring of **{file_name}** will continue after that."
+_SENDING_INTERRUPTED_TEXT = "⏸ Bot is restarting, send the command again in a minute to get **{file_name}**."
+_SENT_FILE_FIELDS = 'id,name,mimeType,size,md5Checksum,trashed'
+# Drive links have the file id after `/d/` or in `id` parameter.
+_DRIVE_FILE_ID = re.compile(r"(?:/d/|[?&]id=)([\w-]{10,})|^([\w-]{10,})$")
+
 
 @with_google_session(HandlerType.Message)
 async def upload_file_to_google_drive(app, message: Message):
-    file_name = message.document.file_name
-    _logger.info(f"[+] Start downloading '{file_name}'")
-    process_message = await message.reply("Start file downloading...")
-    tracker = _DownloadingTracker(process_message)
-    file = await app.download_media(message.document, in_memory=True, progress_args=(tracker,),
-                                    progress=_update_downloading_progress)
-    parent_folder_id = await app.db_client.get_saving_folder_id(message.from_user.id)
-
-    await process_message.edit_text("Uploading to Google Drive...")
-    upload_response = await message.from_user.google_session.drive.upload_file(
-        InMemoryFile(file_name, message.document.mime_type, file.getbuffer()),
-        parent_folder_id
+    if await app.db_client.has_transfer_job(message.chat.id, message.id):
+        # Telegram delivers the same update again after a restart, while the job is resumed from the database.
+        return
+
+    if (uploaded_file := await _find_uploaded_file(app, message)) is not None:
+        await message.reply(f"✅ File **{message.document.file_name}** is already uploaded.",
+                            reply_markup=_uploaded_file_markup(uploaded_file))
+        return
+
+    # Checked before anything is downloaded, there is no point in transferring a file Drive is going to reject.
+    if (quota_error := await _check_quota(app, message, 'intake')) is not None:
+        await message.reply(quota_error)
+        return
+
+    status_message = await TELEGRAM_RETRY.call(lambda: message.reply("⏳ File is queued for transferring..."))
+    # The destination is fixed when the file is sent, so a resumed job doesn't depend on later folder changes.
+    stored_job = await app.db_client.create_transfer_job(
+        message.from_user.id, message.chat.id, message.id, status_message.id, message.document.file_id,
+        message.document.file_unique_id, message.document.file_name,
+        await app.db_client.get_saving_folder_id(message.from_user.id),
+        owner=app.instance_id if app.remote_transfers is None else None
     )
+    if stored_job is None:
+        return
+
+    if app.remote_transfers is not None:
+        await app.remote_transfers.submit(stored_job['id'])
+    elif app.is_draining:
+        # The job is stored already, so it's left to the process started next.
+        await ProgressReporter(status_message).finish(
+            _TRANSFER_PAUSED_TEXT.format(file_name=message.document.file_name))
+    else:
+        start_transfer(app, message, status_message, stored_job)
+
+
+def start_transfer(app, message: Message, status_message: Message, stored_job: dict,
+                   resumed: bool = False) -> TransferJob:
+    reporter = ProgressReporter(status_message)
+    # Bulk actions are handled by the process receiving updates, so it doesn't know files uploaded by workers.
+    upload_group = app.upload_groups.group_for(message.from_user.id) if app.worker_id is None else None
+    job = app.transfers.submit(message.from_user.id,
+                               lambda job: _transfer_file(app, message, reporter, job, stored_job, upload_group,
+                                                          resumed),
+                               on_position=lambda job, position: _report_queue_position(reporter, job, position),
+                               job_id=stored_job['id'])
+    asyncio.create_task(_report_cancelled_in_queue(
+        app, reporter, job, _TRANSFER_PAUSED_TEXT.format(file_name=message.document.file_name)))
+    return job
+
+
+async def start_stored_transfer(app, stored_job: dict, resumed: bool = False) -> Union[TransferJob, None]:
+    """Starts a job read from the database, fetching its messages from Telegram."""
+    message, status_message = await TELEGRAM_RETRY.call(lambda: app.get_messages(
+        stored_job['chat_id'], [stored_job['message_id'], stored_job['status_message_id']]))
+    if message.empty or message.document is None or status_message.empty:
+        _logger.warning(f"[!] Messages of transfer job {stored_job['id']} don't exist anymore")
+        await app.db_client.finish_transfer_job(stored_job['id'], 'failed')
+        return None
+
+    return start_transfer(app, message, status_message, stored_job, resumed)
+
+
+async def _find_uploaded_file(app, message: Message) -> Union[dict, None]:
+    user_id = message.from_user.id
+    file_unique_id = message.document.file_unique_id
+    if (uploaded_file := await app.db_client.get_uploaded_file(user_id, file_unique_id)) is None:
+        return None
+
+    try:
+        drive_file = await message.from_user.google_session.drive.get_file(uploaded_file['id'],
+                                                                           fields='id,trashed,md5Checksum')
+    except Exception:
+        # Drive isn't reachable right now, the file is just transferred again.
+        _logger.error(traceback.format_exc())
+        return None
+
+    if (drive_file is None or drive_file.get('trashed')
+            or drive_file.get('md5Checksum') != uploaded_file['md5Checksum']):
+        _logger.info(f"[*] Uploaded file '{uploaded_file['id']}' is gone or changed, forgetting it")
+        await app.db_client.delete_uploaded_file(user_id, file_unique_id)
+        return None
+
+    return uploaded_file
+
+
+async def _check_quota(app, message: Message, stage: str) -> Union[str, None]:
+    """Returns why the document doesn't fit into the user's drive, None if it fits."""
+    file_size = message.document.file_size
+    free_space = await app.quotas.free_space(message.from_user.google_session.drive, message.from_user.id)
+    if free_space is None or file_size <= free_space:
+        return None
+
+    QUOTA_REJECTED_FILES.inc(stage=stage)
+    QUOTA_REJECTED_BYTES.inc(file_size, stage=stage)
+    _logger.info(f"[*] '{message.document.file_name}' doesn't fit into the drive of user {message.from_user.id}")
+    return (f"❌ File **{message.document.file_name}** ({_format_size(file_size)}) doesn't fit into your Google Drive, "
+            f"only {_format_size(free_space)} is free. Free up some space and send the file again.")
+
+
+def _format_size(size: int) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
 
-    reply_markup = InlineKeyboardMarkup([
-        [InlineKeyboardButton("View File", url=upload_response['webViewLink'])],
-        [InlineKeyboardButton("Download File", url=upload_response['webContentLink'])],
-        [InlineKeyboardButton("Make File public", callback_data=upload_response['id'])]
-    ])
+def _uploaded_file_markup(uploaded_file: dict, upload_group: UploadGroup = None) -> InlineKeyboardMarkup:
+    buttons = [
+        [InlineKeyboardButton("View File", url=uploaded_file['webViewLink'])],
+        [InlineKeyboardButton("Download File", url=uploaded_file['webContentLink'])],
+        [InlineKeyboardButton("Make File public", callback_data=uploaded_file['id'])],
+        [InlineKeyboardButton("Send File here", callback_data=f"{_GET_PREFIX}{uploaded_file['id']}")]
+    ]
+    if upload_group is not None and len(upload_group.file_ids) > 1:
+        buttons.append([InlineKeyboardButton(f"Make all {len(upload_group.file_ids)} files public",
+                                             callback_data=f"{_PUBLIC_GROUP_PREFIX}{upload_group.id}")])
+    return InlineKeyboardMarkup(buttons)
 
-    await process_message.edit_text(f"✅ File **{file_name}** uploaded successfully.",
-                                    reply_markup=reply_markup)
+
+async def _report_queue_position(reporter: ProgressReporter, job: TransferJob, position: int):
+    if not job.is_running:
+        reporter.reply_markup = _cancel_markup(job)
+        reporter.set_text(f"⏳ File is queued for transferring.\nPosition in queue: **{position}**")
+
+
+async def _report_cancelled_in_queue(app, reporter: ProgressReporter, job: TransferJob, draining_text: str):
+    try:
+        await job
+    except asyncio.CancelledError:
+        if not reporter.finished:
+            await reporter.finish(draining_text if app.is_draining else "🚫 Transferring is cancelled.")
+    except Exception:
+        pass
+
+
+def _cancel_markup(job: TransferJob) -> InlineKeyboardMarkup:
+    # Jobs have ids of the database, so the process running one is found by its owner.
+    return InlineKeyboardMarkup([[InlineKeyboardButton("Cancel", callback_data=f"{_CANCEL_PREFIX}{job.id}")]])
+
+
+async def _report_progress(current: int, total: int, reporter: ProgressReporter, stage: str):
+    reporter.progress(stage, current, total)
+
+
+async def _transfer_file(app, message: Message, reporter: ProgressReporter, job: TransferJob, stored_job: dict,
+                         upload_group: Union[UploadGroup, None], resumed: bool):
+    file_name = message.document.file_name
+    user_id = message.from_user.id
+
+    # The job could wait in the queue for a while, so the session attached by the decorator may be outdated.
+    if not (google_session := await app.google_sessions.get(user_id)).is_authorized():
+        await app.db_client.finish_transfer_job(job.id, 'failed')
+        await reporter.finish("❌ Authorization has expired. Send the file again to authorize.")
+        return
+    message.from_user.google_session = google_session
+
+    # The previous process could stop after the upload was completed, but before the job was finished.
+    if resumed and (uploaded_file := await _find_uploaded_file(app, message)) is not None:
+        await app.db_client.finish_transfer_job(job.id, 'done')
+        await reporter.finish(f"✅ File **{file_name}** uploaded successfully.",
+                              reply_markup=_uploaded_file_markup(uploaded_file))
+        return
+
+    # Other uploads could fill the drive while the job was waiting in the queue.
+    if (quota_error := await _check_quota(app, message, 'queue')) is not None:
+        await app.db_client.finish_transfer_job(job.id, 'failed')
+        await reporter.finish(quota_error)
+        return
+
+    _logger.info(f"[+] {'Resume' if resumed else 'Start'} downloading '{file_name}'")
+    await app.db_client.set_transfer_job_running(job.id)
+    reporter.reply_markup = _cancel_markup(job)
+    reporter.set_text("Resuming file transferring..." if resumed else "Start file downloading...")
+    parent_folder_id = stored_job['folder_id']
+
+    try:
+        if TRANSFER_MODE == "stream":
+            upload_response = await _stream_to_google_drive(app, message, reporter, parent_folder_id)
+        elif TRANSFER_MODE == "spool" and message.document.file_size > SPOOL_MEMORY_THRESHOLD:
+            upload_response = await _upload_from_spool(app, message, reporter, parent_folder_id)
+        else:
+            upload_response = await _upload_from_memory(app, message, reporter, parent_folder_id)
+
+    except asyncio.CancelledError:
+        # Cancellation by the user is recorded by `cancel_transfer`, a job of a stopped process is left to be resumed.
+        await reporter.finish(_TRANSFER_PAUSED_TEXT.format(file_name=file_name) if app.is_draining
+                              else f"🚫 Transferring of **{file_name}** is cancelled.")
+        raise
+
+    except Exception:
+        await app.db_client.finish_transfer_job(job.id, 'failed')
+        await reporter.finish(f"❌ Failed to upload **{file_name}**. Try again later.")
+        raise
+
+    await app.db_client.save_uploaded_file(user_id, message.document.file_unique_id, upload_response,
+                                           message.document.mime_type, message.document.file_size,
+                                           parent_folder_id, await _get_folder_path(app, message, parent_folder_id))
+    await app.db_client.finish_transfer_job(job.id, 'done')
+    # The document is the same as the uploaded file, so the file is sent back from Telegram without downloading it.
+    if upload_response.get('md5Checksum'):
+        await app.db_client.save_telegram_file_id(upload_response['id'], upload_response['md5Checksum'],
+                                                  message.document.file_id)
+    app.quotas.add_usage(user_id, message.document.file_size)
+    if upload_group is not None:
+        upload_group.file_ids.append(upload_response['id'])
+    await reporter.finish(f"✅ File **{file_name}** uploaded successfully.",
+                          reply_markup=_uploaded_file_markup(upload_response, upload_group))
+
+
+async def _get_folder_path(app, message: Message, folder_id: Union[str, None]) -> Union[str, None]:
+    """Path of the folder for the index of uploaded files, it's usually cached, as the folder has been resolved."""
+    if folder_id is None:
+        return ""
+
+    try:
+        # The file has just been uploaded there, so the folder surely exists.
+        return await app.folders.get_path(message.from_user.google_session.drive, message.from_user.id, folder_id,
+                                          verify=False)
+    except Exception:
+        # The file is uploaded already, it's just indexed by its name only.
+        _logger.error(traceback.format_exc())
+        return None
+
+
+async def cancel_transfer(app, callback: CallbackQuery):
+    # Buttons sent before jobs were stored in the database also have a worker id after the job id.
+    job_id = callback.data[len(_CANCEL_PREFIX):].partition(':')[0]
+    try:
+        stored_job = await app.db_client.get_transfer_job(int(job_id))
+    except ValueError:
+        stored_job = None
+
+    if stored_job is None or stored_job['state'] not in ('queued', 'running'):
+        await callback.answer("Transferring is already finished.")
+
+    elif stored_job['user_id'] != callback.from_user.id:
+        await callback.answer("❌ It's not your file.")
+
+    elif not await app.db_client.finish_transfer_job(stored_job['id'], 'cancelled'):
+        await callback.answer("Transferring is already finished.")
+
+    else:
+        if stored_job['owner'] == app.instance_id or app.remote_transfers is None:
+            app.transfers.cancel(stored_job['id'])
+        elif stored_job['owner'] is not None:
+            await app.remote_transfers.cancel(stored_job['owner'], stored_job['id'], callback.from_user.id)
+        else:
+            # Nobody has taken the job from the shared queue yet, so nobody else is going to report it.
+            await callback.message.edit_text("🚫 Transferring is cancelled.")
+        await callback.answer("🚫 Transferring is cancelled.")
+
+
+async def _stream_to_google_drive(app, message: Message, reporter: ProgressReporter, parent_folder_id) -> dict:
+    def open_file_stream(offset: int) -> TelegramFileStream:
+        return TelegramFileStream(app, message, offset, progress=_report_progress,
+                                  progress_args=(reporter, _DOWNLOADING_STAGE))
+
+    async def report_uploading(current: int, total: int):
+        await _report_progress(current, total, reporter, _UPLOADING_STAGE)
+
+    # Downloading runs in step with uploading here, so this is time of the whole transfer.
+    with DRIVE_UPLOAD_SECONDS.time(mode='stream'):
+        return await message.from_user.google_session.drive.upload_stream(
+            message.document.file_name,
+            message.document.mime_type,
+            message.document.file_size,
+            open_file_stream,
+            parent_folder_id,
+            upload_key=_upload_key(message, parent_folder_id),
+            user_id=message.from_user.id,
+            progress=report_uploading
+        )
+
+
+async def _upload_from_spool(app, message: Message, reporter: ProgressReporter, parent_folder_id) -> dict:
+    async def report_uploading(current: int, total: int):
+        await _report_progress(current, total, reporter, _UPLOADING_STAGE)
+
+    async with app.spool.file(message.document.file_size) as spool_path:
+        with TELEGRAM_DOWNLOAD_SECONDS.time(mode='spool'):
+            await _download_media(app, message, file_name=spool_path, progress=_report_progress,
+                                  progress_args=(reporter, _DOWNLOADING_STAGE))
+        TRANSFERRED_BYTES.inc(message.document.file_size, direction='download')
+
+        with map_file(spool_path) as file_view, DRIVE_UPLOAD_SECONDS.time(mode='spool'):
+            return await message.from_user.google_session.drive.upload_view(
+                message.document.file_name,
+                message.document.mime_type,
+                file_view,
+                parent_folder_id,
+                upload_key=_upload_key(message, parent_folder_id),
+                user_id=message.from_user.id,
+                progress=report_uploading
+            )
+
+
+async def _download_media(app, message: Message, **kwargs):
+    async def download():
+        # Pyrogram only logs errors of a sequential download, FloodWait longer than its threshold included,
+        # so a download which stopped early is detected by its size and repeated.
+        result = await app.downloader.download(message, **kwargs)
+        if result is None:
+            received = 0
+        elif kwargs.get('in_memory'):
+            received = result.getbuffer().nbytes
+        else:
+            received = os.path.getsize(result)
+
+        if received != message.document.file_size:
+            raise RetryableError(f"Download of '{message.document.file_name}' stopped at {received} of "
+                                 f"{message.document.file_size} bytes", reason='incomplete')
+        return result
+
+    return await TELEGRAM_RETRY.call(download)
+
+
+def _upload_key(message: Message, parent_folder_id) -> str:
+    # Every message is a transfer job of its own, so the same document sent twice never shares a live session,
+    # while a job resumed after a restart finds the session it has started.
+    return (f"{message.from_user.id}:{parent_folder_id}:{message.document.file_unique_id}:"
+            f"{message.chat.id}:{message.id}")
+
+
+async def _upload_from_memory(app, message: Message, reporter: ProgressReporter, parent_folder_id) -> dict:
+    with TELEGRAM_DOWNLOAD_SECONDS.time(mode='memory'):
+        file = await _download_media(app, message, in_memory=True, progress=_report_progress,
+                                     progress_args=(reporter, _DOWNLOADING_STAGE))
+    TRANSFERRED_BYTES.inc(message.document.file_size, direction='download')
+
+    reporter.set_text("Uploading to Google Drive...")
+    with DRIVE_UPLOAD_SECONDS.time(mode='memory'):
+        upload_response = await message.from_user.google_session.drive.upload_file(
+            InMemoryFile(message.document.file_name, message.document.mime_type, file.getbuffer()),
+            parent_folder_id
+        )
+    TRANSFERRED_BYTES.inc(message.document.file_size, direction='upload')
+    return upload_response
+
+
+async def get_transfers_status(app, message: Message):
+    if not (stored_jobs := await app.db_client.get_unfinished_transfer_jobs(message.from_user.id)):
+        await message.reply("You have no queued or running transfers.")
+        return
+
+    lines = []
+    for stored_job in stored_jobs:
+        if stored_job['state'] == 'running':
+            lines.append(f"🔄 **{stored_job['file_name']}** is transferring")
+        elif (job := app.transfers.get_job(stored_job['id'])) is not None and job.position:
+            lines.append(f"⏳ **{stored_job['file_name']}** is queued, position **{job.position}**")
+        else:
+            lines.append(f"⏳ **{stored_job['file_name']}** is queued")
+
+    await message.reply("Your transfers:\n" + "\n".join(lines))
 
 
 @with_google_session(HandlerType.Message)
 async def set_saving_folder(app, message: Message):
     try:
-        folder_name = message.text.split()[1]
+        folder_path = message.text.split(maxsplit=1)[1]
     except IndexError:
-        await message.reply("❌ You have to send this command with folder name.\n"
-                            "  Template: `/set_saving_folder {folder_name}`")
+        await message.reply("❌ You have to send this command with folder path.\n"
+                            "  Template: `/set_saving_folder {folder_path}`")
 
     else:
-        if folder_name == "/":
-            await app.db_client.set_saving_folder_id(message.from_user.id, None)
-            await message.reply(f"✅ Saving folder is changed to '/'")
-
-        elif (folder_id := await message.from_user.google_session.drive.get_folder_id(folder_name)) is not None:
-            await app.db_client.set_saving_folder_id(message.from_user.id, folder_id)
-            await message.reply(f"✅ Saving folder is changed to {folder_name}")
-        else:
-            await message.reply("❌ Folder doesn't exists.\n"
+        google_drive = message.from_user.google_session.drive
+        try:
+            folder_id = await app.folders.resolve(google_drive, message.from_user.id, folder_path)
+        except LookupError as e:
+            await message.reply(f"❌ {e}\n"
                                 "  Try to create new one with the next command: `/create_folder {folder_name}`")
+        else:
+            await app.db_client.set_saving_folder_id(message.from_user.id, folder_id)
+            await message.reply(f"✅ Saving folder is changed to '/{'/'.join(split_path(folder_path))}'")
 
 
 @with_google_session(HandlerType.Message)
 async def create_folder(app, message: Message):
     try:
-        folder_name = message.text.split()[1]
+        folder_name = message.text.split(maxsplit=1)[1]
     except IndexError:
         await message.reply("❌ You have to send this command with folder name.\n"
                             "  Template: `/create_folder {folder_name}`")
     else:
         parent_folder = await app.db_client.get_saving_folder_id(message.from_user.id)
-        # Maybe folder_id will be used later.
         google_drive = message.from_user.google_session.drive
-        if (_folder_id := await google_drive.create_folder(folder_name, parent_folder)) is not None:
+        try:
+            folder_id = await google_drive.create_folder(folder_name, parent_folder)
+        except Exception:
+            _logger.error(traceback.format_exc())
+            await message.reply(f"❌ Can't create folder `{folder_name}` right now.")
+            return
+
+        if folder_id is not None:
+            app.folders.add(message.from_user.id, parent_folder, folder_name, folder_id)
             await message.reply(f"✅ Folder `{folder_name}` successfully created.")
         else:
-            await message.reply(f"❌ Can't create folder `{folder_name}` right now.")
+            await message.reply("❌ Current saving folder doesn't exist anymore, "
+                                "choose another one with `/set_saving_folder` first.")
 
 
 @with_google_session(HandlerType.Message)
@@ -86,52 +463,240 @@ async def get_current_folder(app, message: Message):
             return
 
         else:
-            if (folder_name := await message.from_user.google_session.drive.get_folder_name(current_folder_id)) is None:
+            google_drive = message.from_user.google_session.drive
+            if (folder_path := await app.folders.get_path(google_drive, message.from_user.id,
+                                                          current_folder_id)) is None:
                 await message.reply(f'Current folder has been deleted. Please select another one.')
             else:
-                await message.reply(f'Current folder is "{folder_name}"')
+                await message.reply(f'Current folder is "{folder_path}"')
 
     except Exception as e:
         _logger.error(traceback.format_exc())
         await message.reply('Some error occurred.')
 
 
-@with_google_session(HandlerType.Callback)
-async def make_file_public(_app, callback: CallbackQuery):
+async def find_files(app, message: Message):
     try:
-        await callback.from_user.google_session.drive.make_file_public(callback.data)
+        query = message.text.split(maxsplit=1)[1]
+    except IndexError:
+        await message.reply("❌ You have to send this command with a part of file name.\n"
+                            "  Template: `/find {file_name}`")
+        return
 
-    except Exception:
-        _logger.error(traceback.format_exc())
-        await callback.message.reply("❌ Failed to make file public. Try again later.")
+    # Queries don't fit into callback data of the page buttons, so these refer to them by a short id.
+    search_id = uuid.uuid4().hex[:8]
+    app.searches.set(search_id, (message.from_user.id, query))
+    text, reply_markup = await _files_page(app, message.from_user.id, f"find:{search_id}", 0)
+    await message.reply(text, reply_markup=reply_markup, disable_web_page_preview=True)
+
+
+async def get_recent_files(app, message: Message):
+    text, reply_markup = await _files_page(app, message.from_user.id, "recent", 0)
+    await message.reply(text, reply_markup=reply_markup, disable_web_page_preview=True)
 
+
+async def turn_files_page(app, callback: CallbackQuery):
+    listing, _, offset = callback.data[len(_FILES_PREFIX):].rpartition(':')
+    try:
+        offset = int(offset)
+    except ValueError:
+        offset = 0
+
+    if (page := await _files_page(app, callback.from_user.id, listing, offset)) is None:
+        await callback.answer("The search is outdated, send /find again.")
+        return
+
+    text, reply_markup = page
+    await callback.message.edit_text(text, reply_markup=reply_markup, disable_web_page_preview=True)
+    await callback.answer()
+
+
+async def _files_page(app, user_id: int, listing: str, offset: int) -> Union[tuple, None]:
+    """Text and keyboard of a page of found (`find:<search id>`) or `recent` files, answered by the local index.
+
+    None means the search isn't kept anymore.
+    """
+    # One more file tells whether there is a next page.
+    if listing == "recent":
+        files = await app.db_client.get_recent_uploaded_files(user_id, _FILES_PAGE_SIZE + 1, offset)
+        title = "Recently uploaded files"
     else:
-        await callback.answer("🚀 File can be shared now.")
+        if (search := app.searches.get(listing[len("find:"):])) is None or search[0] != user_id:
+            return None
+        query = search[1]
+        files = await app.db_client.search_uploaded_files(user_id, query, _FILES_PAGE_SIZE + 1, offset)
+        title = f"Files matching '{query}'"
+
+    if not files and offset == 0:
+        return ("Nothing is found." if listing != "recent" else "You haven't uploaded any files yet."), None
+
+    has_next_page = len(files) > _FILES_PAGE_SIZE
+    files = files[:_FILES_PAGE_SIZE]
+    lines = [f"{title}, page **{offset // _FILES_PAGE_SIZE + 1}**:"]
+    lines.extend(f"{index}. {_describe_uploaded_file(uploaded_file)}"
+                 for index, uploaded_file in enumerate(files, offset + 1))
+
+    buttons = [[InlineKeyboardButton(f"{index}. {uploaded_file['name']}", url=uploaded_file['webViewLink'])]
+               for index, uploaded_file in enumerate(files, offset + 1) if uploaded_file['webViewLink']]
+    navigation = []
+    if offset > 0:
+        navigation.append(InlineKeyboardButton(
+            "◀ Previous", callback_data=f"{_FILES_PREFIX}{listing}:{max(offset - _FILES_PAGE_SIZE, 0)}"))
+    if has_next_page:
+        navigation.append(InlineKeyboardButton(
+            "Next ▶", callback_data=f"{_FILES_PREFIX}{listing}:{offset + _FILES_PAGE_SIZE}"))
+    if navigation:
+        buttons.append(navigation)
+
+    return "\n".join(lines), InlineKeyboardMarkup(buttons) if buttons else None
+
+
+def _describe_uploaded_file(uploaded_file: dict) -> str:
+    details = []
+    if uploaded_file['size'] is not None:
+        details.append(_format_size(uploaded_file['size']))
+    if uploaded_file['folderPath'] is not None:
+        details.append(f"/{uploaded_file['folderPath']}")
+    details.append(datetime.fromtimestamp(uploaded_file['uploadedAt']).strftime("%Y-%m-%d %H:%M"))
+    return f"**{uploaded_file['name']}** ({', '.join(details)})"
 
 
-async def help_message(_app, message: Message):
-    await message.reply(HELP_MESSAGE)
+@with_google_session(HandlerType.Message)
+async def get_drive_file(app, message: Message):
+    try:
+        file_link = message.text.split(maxsplit=1)[1]
+    except IndexError:
+        await message.reply("❌ You have to send this command with a link to a file of your google drive or its id.\n"
+                            "  Template: `/get {file_link}`")
+        return
+
+    if (match := _DRIVE_FILE_ID.search(file_link.strip())) is None:
+        await message.reply("❌ It isn't a link to a google drive file.")
+        return
+
+    await _send_drive_file(app, message.from_user.google_session.drive, message.from_user.id, message.chat.id,
+                           match.group(1) or match.group(2))
+
+
+@with_google_session(HandlerType.Callback)
+async def get_drive_file_by_button(app, callback: CallbackQuery):
+    await callback.answer()
+    await _send_drive_file(app, callback.from_user.google_session.drive, callback.from_user.id,
+                           callback.message.chat.id, callback.data[len(_GET_PREFIX):])
 
 
-async def _update_downloading_progress(current, total, tracker: "_DownloadingTracker"):
-    current_percent = int(current * 100 / total)
-    if current_percent != tracker.previous_value:
-        tracker.previous_value = current_percent
+async def _send_drive_file(app, drive, user_id: int, chat_id: int, file_id: str):
+    try:
+        drive_file = await drive.get_file(file_id, fields=_SENT_FILE_FIELDS)
+    except Exception:
+        _logger.error(traceback.format_exc())
+        await app.send_message(chat_id, "❌ Can't get the file from your Google Drive right now.")
+        return
+
+    if drive_file is None or drive_file.get('trashed'):
+        await app.send_message(chat_id, "❌ The file isn't found on your Google Drive.")
+        return
+
+    file_name = drive_file['name']
+    if 'size' not in drive_file or 'md5Checksum' not in drive_file:
+        # Google Docs, Sheets and the like have no content of their own, they can only be exported.
+        await app.send_message(chat_id, f"❌ **{file_name}** is a Google document, only stored files can be sent.")
+        return
+
+    if not 0 < (file_size := int(drive_file['size'])) <= MAX_FILE_SIZE:
+        await app.send_message(chat_id, f"❌ **{file_name}** ({_format_size(file_size)}) can't be sent, "
+                                        f"Telegram accepts files up to {_format_size(MAX_FILE_SIZE)}.")
+        return
+
+    # A file sent before is sent again by its Telegram id, as long as the file hasn't changed since then.
+    md5 = drive_file['md5Checksum']
+    if (telegram_file_id := await app.db_client.get_telegram_file_id(file_id, md5)) is not None:
         try:
-            await tracker.message.edit_text(f"Downloading from Telegram...\n**{current_percent}%**")
-        except FloodWait:
-            pass
+            await TELEGRAM_RETRY.call(lambda: app.send_document(chat_id, telegram_file_id))
+            return
+        except BadRequest as e:
+            _logger.info(f"[*] Telegram copy of '{file_id}' can't be sent anymore: {e}")
+            await app.db_client.delete_telegram_file_id(file_id, md5)
+
+    if app.is_draining:
+        await app.send_message(chat_id, _SENDING_INTERRUPTED_TEXT.format(file_name=file_name))
+        return
 
+    status_message = await TELEGRAM_RETRY.call(lambda: app.send_message(chat_id, "⏳ File is queued for sending..."))
+    reporter = ProgressReporter(status_message)
+    job = app.transfers.submit(user_id, lambda job: _retrieve_file(app, user_id, chat_id, drive_file, reporter))
+    asyncio.create_task(_report_cancelled_in_queue(
+        app, reporter, job, _SENDING_INTERRUPTED_TEXT.format(file_name=drive_file['name'])))
 
-class _DownloadingTracker:
-    def __init__(self, message: Message):
-        self.message = message
-        self._previous_value = 0
 
-    @property
-    def previous_value(self):
-        return self._previous_value
+async def _retrieve_file(app, user_id: int, chat_id: int, drive_file: dict, reporter: ProgressReporter):
+    file_name = drive_file['name']
+    if not (google_session := await app.google_sessions.get(user_id)).is_authorized():
+        await reporter.finish("❌ Authorization has expired. Send the command again to authorize.")
+        return
 
-    @previous_value.setter
-    def previous_value(self, new_value: int):
-        self._previous_value = new_value
+    _logger.info(f"[+] Start sending '{file_name}' from Google Drive")
+    reporter.set_text("Start file sending...")
+
+    try:
+        sent_message = await app.uploader.send_document(
+            chat_id, google_session.drive.download(drive_file['id'], drive_file['md5Checksum']), file_name,
+            int(drive_file['size']), drive_file.get('mimeType'), progress=_report_progress,
+            progress_args=(reporter, _SENDING_STAGE)
+        )
+
+    except asyncio.CancelledError:
+        await reporter.finish(_SENDING_INTERRUPTED_TEXT.format(file_name=file_name) if app.is_draining
+                              else f"🚫 Sending of **{file_name}** is cancelled.")
+        raise
+
+    except Exception:
+        await reporter.finish(f"❌ Failed to send **{file_name}**. Try again later.")
+        raise
+
+    if sent_message is not None and sent_message.document is not None:
+        await app.db_client.save_telegram_file_id(drive_file['id'], drive_file['md5Checksum'],
+                                                  sent_message.document.file_id)
+    await reporter.finish(f"✅ File **{file_name}** is sent.")
+
+
+@with_google_session(HandlerType.Callback)
+async def make_group_public(app, callback: CallbackQuery):
+    upload_group = app.upload_groups.get(callback.data[len(_PUBLIC_GROUP_PREFIX):])
+    if upload_group is None or upload_group.user_id != callback.from_user.id:
+        await callback.answer("❌ These files can't be found anymore.")
+        return
+
+    try:
+        results = await callback.from_user.google_session.drive.make_files_public(list(upload_group.file_ids))
+
+    except Exception:
+        _logger.error(traceback.format_exc())
+        await callback.message.reply("❌ Failed to make files public. Try again later.")
+
+    else:
+        if all(results.values()):
+            await callback.answer(f"🚀 {len(results)} files can be shared now.")
+        else:
+            failed_count = sum(not is_public for is_public in results.values())
+            await callback.message.reply(f"❌ Failed to make {failed_count} of {len(results)} files public.")
+
+
+@with_google_session(HandlerType.Callback)
+async def make_file_public(_app, callback: CallbackQuery):
+    try:
+        is_public = await callback.from_user.google_session.drive.make_file_public(callback.data)
+
+    except Exception:
+        _logger.error(traceback.format_exc())
+        await callback.message.reply("❌ Failed to make file public. Try again later.")
+
+    else:
+        if is_public:
+            await callback.answer("🚀 File can be shared now.")
+        else:
+            await callback.message.reply("❌ File isn't found in your Google Drive.")
+
+
+async def help_message(_app, message: Message):
+    await message.reply(HELP_MESSAGE)
@@ -0,0 +1,133 @@
+import time
+import asyncio
+import logging
+from typing import Union
+
+from pyrogram.types import Message, InlineKeyboardMarkup
+from pyrogram.errors import FloodWait, MessageNotModified, RPCError
+
+from settings import PROGRESS_UPDATE_INTERVAL, PROGRESS_EDITS_PER_SECOND
+from core.metrics import FLOOD_WAITS
+
+_logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate)
+                self._updated_at = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+
+# Status message edits of all transfers share the bot-wide flood budget.
+_edits_bucket = TokenBucket(PROGRESS_EDITS_PER_SECOND, PROGRESS_EDITS_PER_SECOND)
+
+
+class ProgressReporter:
+    """Keeps a status message up to date without editing it more often than `min_interval`.
+
+    Intermediate states are coalesced, so only the latest one is sent, while the final state is always delivered.
+    """
+
+    def __init__(self, message: Message, reply_markup: InlineKeyboardMarkup = None,
+                 min_interval: float = PROGRESS_UPDATE_INTERVAL, bucket: TokenBucket = _edits_bucket):
+        self._message = message
+        self._reply_markup = reply_markup
+        self._min_interval = min_interval
+        self._bucket = bucket
+
+        self._stages = {}
+        self._pending_text = None
+        self._sent_text = None
+        self._edited_at = 0.0
+        self._flush_task = None
+        self._finished = False
+
+    @property
+    def finished(self) -> bool:
+        return self._finished
+
+    @property
+    def reply_markup(self) -> Union[InlineKeyboardMarkup, None]:
+        return self._reply_markup
+
+    @reply_markup.setter
+    def reply_markup(self, reply_markup: InlineKeyboardMarkup):
+        self._reply_markup = reply_markup
+
+    def set_text(self, text: str):
+        if self._finished or text == self._sent_text:
+            return
+
+        self._pending_text = text
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush())
+
+    def progress(self, stage: str, current: int, total: int):
+        percent = int(current * 100 / total) if total else 100
+        if self._stages.get(stage) != percent:
+            self._stages[stage] = percent
+            self.set_text("\n".join(f"{title}\n**{value}%**" for title, value in self._stages.items()))
+
+    async def finish(self, text: str, reply_markup: InlineKeyboardMarkup = None):
+        self._finished = True
+        self._pending_text = None
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+
+        await self._edit(text, reply_markup)
+
+    async def _flush(self):
+        while (text := self._pending_text) is not None:
+            if (delay := self._edited_at + self._min_interval - time.monotonic()) > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            self._pending_text = None
+            await self._edit(text, self._reply_markup)
+
+    async def _edit(self, text: str, reply_markup: Union[InlineKeyboardMarkup, None]):
+        while True:
+            await self._bucket.acquire()
+            try:
+                await self._message.edit_text(text, reply_markup=reply_markup)
+            except FloodWait as e:
+                FLOOD_WAITS.inc(operation='edit_message')
+                _logger.warning(f"[!] Flood wait for {e.value}s on status message editing")
+                self._bucket.pause(e.value)
+                continue
+            except MessageNotModified:
+                pass
+            except RPCError as e:
+                # The message is deleted or can't be edited anymore, so the later states are dropped as well.
+                _logger.warning(f"[!] Can't edit status message: {e}")
+                self._finished = True
+                self._pending_text = None
+                return
+
+            self._sent_text = text
+            self._edited_at = time.monotonic()
+            return
@@ -0,0 +1,79 @@
+import time
+import asyncio
+import logging
+import traceback
+
+from settings import JOB_HEARTBEAT_INTERVAL, JOB_LEASE_TIMEOUT
+
+from .handlers import start_stored_transfer
+
+_logger = logging.getLogger(__name__)
+
+# Finished jobs are kept for a while to ignore updates Telegram delivers again and to answer the cancel buttons.
+_FINISHED_JOBS_TTL = 7 * 24 * 60 * 60
+
+
+class JobRecovery:
+    """Keeps transfer jobs of the process leased and resumes jobs of processes which stopped renewing theirs.
+
+    A job is orphaned when its owner hasn't renewed it for `lease_timeout` seconds, that's a crashed
+    or restarted process. A job left unclaimed in the shared queue for as long is taken as well, in case
+    its queue entry is lost. Orphaned jobs are taken only while the scheduler has free room for them.
+    """
+
+    def __init__(self, app, heartbeat_interval: float = JOB_HEARTBEAT_INTERVAL,
+                 lease_timeout: float = JOB_LEASE_TIMEOUT):
+        self._app = app
+        self._heartbeat_interval = heartbeat_interval
+        self._lease_timeout = lease_timeout
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        finished_jobs_deleted = False
+        while True:
+            # A failed step is repeated on the next heartbeat, the leases mustn't stop being renewed because of it.
+            try:
+                await self._app.db_client.renew_transfer_jobs(self._app.instance_id)
+                if not finished_jobs_deleted:
+                    await self._app.db_client.delete_finished_transfer_jobs(time.time() - _FINISHED_JOBS_TTL)
+                    finished_jobs_deleted = True
+                await self._resume_orphaned()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                _logger.error(traceback.format_exc())
+
+            await asyncio.sleep(self._heartbeat_interval)
+
+    async def _resume_orphaned(self):
+        if self._app.is_draining:
+            # Leases are still renewed while the process finishes its jobs, but it doesn't take new ones.
+            return
+
+        transfers = self._app.transfers
+        if (capacity := transfers.global_limit - transfers.active_count - transfers.queued_count) <= 0:
+            return
+
+        stored_jobs = await self._app.db_client.claim_orphaned_transfer_jobs(self._app.instance_id,
+                                                                             self._lease_timeout, capacity)
+        for stored_job in stored_jobs:
+            _logger.info(f"[*] Resuming transfer of '{stored_job['file_name']}' (job {stored_job['id']})")
+            try:
+                await start_stored_transfer(self._app, stored_job, resumed=True)
+            except Exception:
+                _logger.error(traceback.format_exc())
+                await self._app.db_client.finish_transfer_job(stored_job['id'], 'failed')
@@ -0,0 +1,22 @@
+import json
+
+TRANSFER_QUEUE = "transfer_jobs"
+CANCEL_CHANNEL = "transfer_cancel"
+
+
+class RemoteTransfers:
+    """Hands document transfers over to worker processes through the shared backend."""
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    async def submit(self, job_id: int):
+        # Workers read the job from the database and fetch its messages, Telegram objects can't be shared.
+        await self._backend.push(TRANSFER_QUEUE, json.dumps({'job_id': job_id}))
+
+    async def cancel(self, worker_id: str, job_id: int, user_id: int):
+        await self._backend.publish(CANCEL_CHANNEL, json.dumps({
+            'worker_id': worker_id,
+            'job_id': job_id,
+            'user_id': user_id,
+        }))
@@ -0,0 +1,221 @@
+import time
+import asyncio
+import logging
+import itertools
+import traceback
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Union
+
+from settings import TRANSFER_GLOBAL_LIMIT, TRANSFER_PER_USER_LIMIT, QUEUE_POSITION_UPDATE_INTERVAL
+from core.metrics import TRANSFERS_IN_FLIGHT, TRANSFERS_QUEUED
+
+_logger = logging.getLogger(__name__)
+
+
+class TransferJob:
+    def __init__(self, job_id: int, user_id: int, run: Callable[["TransferJob"], Awaitable],
+                 on_position: Union[Callable[["TransferJob", int], Awaitable], None]):
+        self.id = job_id
+        self.user_id = user_id
+        self.position = None
+
+        self._run = run
+        self._on_position = on_position
+        self._notified_position = None
+        self._position_notified_at = 0.0
+        self._position_timer = None
+        self._task = None
+        self._done = asyncio.get_running_loop().create_future()
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def __await__(self):
+        return asyncio.shield(self._done).__await__()
+
+
+class TransferScheduler:
+    """Runs transfer jobs with a global and a per-user concurrency cap, taking users in round-robin order."""
+
+    def __init__(self, global_limit: int = TRANSFER_GLOBAL_LIMIT, per_user_limit: int = TRANSFER_PER_USER_LIMIT):
+        self._global_limit = global_limit
+        self._per_user_limit = per_user_limit
+
+        # Jobs not stored in the database count down, so their ids never clash with the stored ones.
+        self._ids = itertools.count(-1, -1)
+        self._jobs = {}
+        # user_id -> queued jobs, in the order users are served.
+        self._queues = OrderedDict()
+        self._active_per_user = {}
+        self._active = 0
+        self._closed = False
+
+    @property
+    def global_limit(self) -> int:
+        return self._global_limit
+
+    @property
+    def active_count(self) -> int:
+        return self._active
+
+    @property
+    def queued_count(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def get_job(self, job_id: int) -> Union[TransferJob, None]:
+        return self._jobs.get(job_id)
+
+    def user_jobs(self, user_id: int) -> list:
+        return [job for job in self._jobs.values() if job.user_id == user_id]
+
+    def submit(self, user_id: int, run: Callable[[TransferJob], Awaitable],
+               on_position: Callable[[TransferJob, int], Awaitable] = None, job_id: int = None) -> TransferJob:
+        job = TransferJob(job_id if job_id is not None else next(self._ids), user_id, run, on_position)
+        self._jobs[job.id] = job
+        self._queues.setdefault(user_id, deque()).append(job)
+
+        self._dispatch()
+        return job
+
+    def close(self):
+        """Stops starting queued jobs, the running ones go on."""
+        self._closed = True
+
+    async def wait_running(self, timeout: float) -> bool:
+        """Waits for the running jobs to finish, False means some of them are still running after `timeout`."""
+        if not (running := [job._done for job in self._jobs.values() if job.is_running]):
+            return True
+
+        _done, pending = await asyncio.wait(running, timeout=timeout)
+        return not pending
+
+    def cancel_all(self):
+        for job_id in list(self._jobs):
+            self.cancel(job_id)
+
+    def cancel(self, job_id: int) -> bool:
+        if (job := self._jobs.get(job_id)) is None:
+            return False
+
+        if job.is_running:
+            job._task.cancel()
+        else:
+            queue = self._queues[job.user_id]
+            queue.remove(job)
+            if not queue:
+                del self._queues[job.user_id]
+
+            self._finish(job, cancelled=True)
+            TRANSFERS_QUEUED.set(self.queued_count)
+            self._notify_positions()
+
+        return True
+
+    def _can_start(self, user_id: int) -> bool:
+        return self._active_per_user.get(user_id, 0) < self._per_user_limit
+
+    def _dispatch(self):
+        while not self._closed and self._active < self._global_limit:
+            if (user_id := next((uid for uid in self._queues if self._can_start(uid)), None)) is None:
+                break
+
+            queue = self._queues.pop(user_id)
+            self._start(queue.popleft())
+            # The user goes to the end of the line, so others are served before their next job.
+            if queue:
+                self._queues[user_id] = queue
+
+        TRANSFERS_QUEUED.set(self.queued_count)
+        self._notify_positions()
+
+    def _start(self, job: TransferJob):
+        TRANSFERS_IN_FLIGHT.inc()
+        self._active += 1
+        self._active_per_user[job.user_id] = self._active_per_user.get(job.user_id, 0) + 1
+        job.position = 0
+        self._cancel_position_timer(job)
+        job._task = asyncio.create_task(self._execute(job))
+
+    async def _execute(self, job: TransferJob):
+        try:
+            await job._run(job)
+        except asyncio.CancelledError:
+            self._finish(job, cancelled=True)
+        except Exception as e:
+            _logger.error(traceback.format_exc())
+            self._finish(job, error=e)
+        else:
+            self._finish(job)
+        finally:
+            TRANSFERS_IN_FLIGHT.dec()
+            self._active -= 1
+            if (active := self._active_per_user[job.user_id] - 1) > 0:
+                self._active_per_user[job.user_id] = active
+            else:
+                del self._active_per_user[job.user_id]
+
+            self._dispatch()
+
+    def _finish(self, job: TransferJob, cancelled: bool = False, error: Exception = None):
+        self._jobs.pop(job.id, None)
+        self._cancel_position_timer(job)
+        if job._done.done():
+            return
+
+        if cancelled:
+            job._done.cancel()
+        elif error is not None:
+            job._done.set_exception(error)
+            # Nobody is obliged to await the job, errors are logged above.
+            job._done.exception()
+        else:
+            job._done.set_result(None)
+
+    def _queued_in_order(self):
+        # Round-robin order of queued jobs, i.e. the order they are going to be started in.
+        queues = [iter(queue) for queue in self._queues.values()]
+        while queues:
+            for queue in list(queues):
+                if (job := next(queue, None)) is None:
+                    queues.remove(queue)
+                else:
+                    yield job
+
+    def _notify_positions(self):
+        now = time.monotonic()
+        for position, job in enumerate(self._queued_in_order(), 1):
+            job.position = position
+            if job._on_position is None or job._notified_position == position or job._position_timer is not None:
+                continue
+
+            # Positions change on every dispatch, so editing status messages each time would flood Telegram.
+            # A throttled position is sent once the interval has passed, so the last one isn't lost.
+            delay = job._position_notified_at + QUEUE_POSITION_UPDATE_INTERVAL - now
+            if job._notified_position is not None and delay > 0:
+                job._position_timer = asyncio.get_running_loop().call_later(delay, self._send_position, job)
+            else:
+                self._send_position(job)
+
+    def _send_position(self, job: TransferJob):
+        job._position_timer = None
+        # The job could have been started meanwhile, or moved back to the position which is already sent.
+        if not job.position or job.position == job._notified_position:
+            return
+
+        job._notified_position = job.position
+        job._position_notified_at = time.monotonic()
+        asyncio.create_task(self._call_on_position(job, job.position))
+
+    @staticmethod
+    def _cancel_position_timer(job: TransferJob):
+        if job._position_timer is not None:
+            job._position_timer.cancel()
+            job._position_timer = None
+
+    @staticmethod
+    async def _call_on_position(job: TransferJob, position: int):
+        try:
+            await job._on_position(job, position)
+        except Exception:
+            _logger.error(traceback.format_exc())
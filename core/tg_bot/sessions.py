@@ -0,0 +1,73 @@
+import asyncio
+import logging
+from typing import List
+
+from pyrogram import raw
+from pyrogram.errors import AuthBytesInvalid
+from pyrogram.session import Auth, Session
+
+from settings import DOWNLOAD_SESSIONS_PER_DC
+
+_logger = logging.getLogger(__name__)
+
+
+class MediaSessions:
+    """Media sessions of the bot to Telegram DCs, opened on the first use and shared by downloads and uploads.
+
+    Every `upload.*` request is served at a limited speed, so parts are spread over `per_dc` sessions.
+    """
+
+    def __init__(self, client, per_dc: int = DOWNLOAD_SESSIONS_PER_DC):
+        self._client = client
+        self._per_dc = per_dc
+        self._sessions = {}
+        self._lock = asyncio.Lock()
+
+    @property
+    def per_dc(self) -> int:
+        return self._per_dc
+
+    async def get(self, dc_id: int) -> List[Session]:
+        async with self._lock:
+            if (sessions := self._sessions.get(dc_id)) is None:
+                sessions = self._sessions[dc_id] = list(await asyncio.gather(
+                    *(self._create_session(dc_id) for _ in range(self._per_dc))
+                ))
+                _logger.info(f"[+] Opened {len(sessions)} media sessions to DC {dc_id}")
+            return sessions
+
+    async def get_home(self) -> List[Session]:
+        """Sessions of the bot's own DC, where files are uploaded to."""
+        return await self.get(await self._client.storage.dc_id())
+
+    async def close(self):
+        async with self._lock:
+            for sessions in self._sessions.values():
+                for session in sessions:
+                    await session.stop()
+            self._sessions.clear()
+
+    async def _create_session(self, dc_id: int) -> Session:
+        client = self._client
+        test_mode = await client.storage.test_mode()
+
+        if dc_id == await client.storage.dc_id():
+            session = Session(client, dc_id, await client.storage.auth_key(), test_mode, is_media=True)
+            await session.start()
+            return session
+
+        session = Session(client, dc_id, await Auth(client, dc_id, test_mode).create(), test_mode, is_media=True)
+        await session.start()
+
+        # Every session of a foreign DC needs its own exported authorization.
+        for _ in range(3):
+            exported_auth = await client.invoke(raw.functions.auth.ExportAuthorization(dc_id=dc_id))
+            try:
+                await session.invoke(raw.functions.auth.ImportAuthorization(id=exported_auth.id,
+                                                                             bytes=exported_auth.bytes))
+            except AuthBytesInvalid:
+                continue
+            return session
+
+        await session.stop()
+        raise AuthBytesInvalid
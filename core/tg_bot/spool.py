@@ -0,0 +1,104 @@
+import os
+import mmap
+import uuid
+import shutil
+import asyncio
+import logging
+from contextlib import asynccontextmanager, contextmanager, suppress
+
+from settings import SPOOL_DIR, SPOOL_MAX_SIZE, SPOOL_MIN_FREE_SPACE
+
+_logger = logging.getLogger(__name__)
+
+
+class SpoolError(Exception):
+    pass
+
+
+class Spool:
+    """Bounded directory of temporary files for transfers which are too big to be kept in memory.
+
+    Space is reserved before a download starts, so concurrent transfers wait for each other instead of
+    outgrowing the spool size or the free disk space. A file is removed as soon as its transfer ends.
+    """
+
+    def __init__(self, directory: str = SPOOL_DIR, max_size: int = SPOOL_MAX_SIZE,
+                 min_free_space: int = SPOOL_MIN_FREE_SPACE):
+        self._directory = directory
+        self._max_size = max_size
+        self._min_free_space = min_free_space
+        self._reserved = 0
+        self._space_released = asyncio.Condition()
+
+    @property
+    def reserved(self) -> int:
+        return self._reserved
+
+    def clear(self):
+        """Removes files left by a previous run."""
+        os.makedirs(self._directory, exist_ok=True)
+        for entry in os.scandir(self._directory):
+            if entry.is_file():
+                try:
+                    os.remove(entry.path)
+                except OSError as e:
+                    _logger.warning(f"[!] Can't remove spool file '{entry.path}': {e!r}")
+
+    @asynccontextmanager
+    async def file(self, size: int):
+        """Reserves `size` bytes and yields path of a new spool file, which is removed on exit."""
+        if size > self._max_size:
+            raise SpoolError(f"File of {size} bytes doesn't fit into the spool of {self._max_size} bytes.")
+
+        async with self._space_released:
+            while not self._fits(size):
+                if self._reserved == 0:
+                    raise SpoolError(f"Not enough free disk space to spool a file of {size} bytes.")
+                await self._space_released.wait()
+            self._reserved += size
+
+        path = os.path.join(self._directory, uuid.uuid4().hex)
+        try:
+            yield path
+        finally:
+            # Pyrogram downloads into `<path>.temp` first and leaves it behind if it's cancelled.
+            for leftover in (path, f"{path}.temp"):
+                with suppress(FileNotFoundError):
+                    os.remove(leftover)
+
+            async with self._space_released:
+                self._reserved -= size
+                self._space_released.notify_all()
+
+    def _fits(self, size: int) -> bool:
+        if self._reserved + size > self._max_size:
+            return False
+
+        # Reserved files may be partially written yet, so the whole reservation is taken from the free space.
+        os.makedirs(self._directory, exist_ok=True)
+        free_space = shutil.disk_usage(self._directory).free
+        return free_space - self._reserved - size >= self._min_free_space
+
+
+@contextmanager
+def map_file(path: str):
+    """Yields read-only memoryview of the whole file, its slices are sent without copying."""
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            yield memoryview(b'')
+            return
+
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        try:
+            yield view
+        except BaseException:
+            view.release()
+            # Slices may still be referenced by the traceback, the map is closed once they are collected then.
+            # The error is raised as it is, instead of being hidden by the `BufferError` of closing.
+            with suppress(BufferError):
+                mapped.close()
+            raise
+
+        view.release()
+        mapped.close()
@@ -0,0 +1,84 @@
+import time
+import asyncio
+
+from settings import STREAM_QUEUE_SIZE
+from core.metrics import TELEGRAM_DOWNLOAD_SECONDS, TRANSFERRED_BYTES
+from core.retry import TELEGRAM_RETRY, RetryableError, classify
+
+_END_OF_STREAM = object()
+# `stream_media` yields parts of this size and accepts its offset in parts, not bytes.
+_TELEGRAM_CHUNK_SIZE = 1024 * 1024
+
+
+class TelegramFileStream:
+    def __init__(self, app, message, offset: int = 0, queue_size: int = STREAM_QUEUE_SIZE,
+                 progress=None, progress_args=()):
+        self._app = app
+        self._message = message
+        self._offset = offset
+        self._queue_size = queue_size
+        self._progress = progress
+        self._progress_args = progress_args
+        self._received = offset
+
+    @property
+    def received(self) -> int:
+        return self._received
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _produce(self, queue: asyncio.Queue):
+        total = self._message.document.file_size
+        started_at = time.perf_counter()
+        try:
+            attempt = 0
+            while self._received < total:
+                received_before = self._received
+                chunks_offset, skip = divmod(self._received, _TELEGRAM_CHUNK_SIZE)
+                reason, retry_after = 'incomplete', 0.0
+                try:
+                    async for chunk in self._app.downloader.stream(self._message, offset=chunks_offset):
+                        if skip:
+                            chunk, skip = chunk[skip:], 0
+                        await queue.put(chunk)
+                        self._received += len(chunk)
+                        TRANSFERRED_BYTES.inc(len(chunk), direction='download')
+                        if self._progress is not None:
+                            await self._progress(self._received, total, *self._progress_args)
+                except Exception as e:
+                    if (classified := classify(e)) is None:
+                        raise
+                    reason, retry_after = classified
+
+                if self._received >= total:
+                    break
+
+                # Pyrogram only logs errors of a sequential download, FloodWait longer than its threshold included,
+                # so a stream which stopped early or failed on a transient error is resumed from where it stopped.
+                if self._received > received_before:
+                    attempt = 0
+                if not await TELEGRAM_RETRY.backoff(attempt, reason, retry_after):
+                    raise RetryableError(f"Telegram stream stopped at {self._received} of {total} bytes",
+                                         reason='incomplete')
+                attempt += 1
+        except Exception as e:
+            await queue.put(e)
+        else:
+            # Includes time the producer waited for the uploader, since they run in step.
+            TELEGRAM_DOWNLOAD_SECONDS.observe(time.perf_counter() - started_at, mode='stream')
+            await queue.put(_END_OF_STREAM)
+
+    async def _iterate(self):
+        # Bounded queue keeps at most `queue_size` chunks in memory while the consumer is busy.
+        queue = asyncio.Queue(maxsize=self._queue_size)
+        producer = asyncio.create_task(self._produce(queue))
+
+        try:
+            while (item := await queue.get()) is not _END_OF_STREAM:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            if not producer.done():
+                producer.cancel()
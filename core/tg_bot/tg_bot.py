@@ -1,3 +1,4 @@
+import uuid
 import logging
 
 from pyrogram import Client, filters
@@ -7,30 +8,68 @@ from pyrogram.types import (
     InlineKeyboardButton,
 )
 
-from aiogoogle import Aiogoogle
-
-from settings import APP_API_HASH, APP_CLIENT_ID, BOT_TOKEN
+from settings import APP_API_HASH, APP_CLIENT_ID, BOT_TOKEN, SHUTDOWN_DRAIN_TIMEOUT, TRANSFER_MODE, USER_CACHE_SIZE
+from core.cache import LRUCache
 from core.db import DBClient
+from core.google import AuthNotifier, FolderIndex, GoogleSessionCache, QuotaCache, TokenManager
+from core.google.client import GoogleClient
 
+from .scheduler import TransferScheduler
+from .spool import Spool
+from .sessions import MediaSessions
+from .download import ParallelDownloader
+from .upload import ParallelUploader
+from .remote import RemoteTransfers
+from .upload_groups import UploadGroups
 from .handlers import (
     upload_file_to_google_drive,
+    cancel_transfer,
+    make_group_public,
     make_file_public,
     create_folder,
     set_saving_folder,
     help_message,
-    get_current_folder
+    get_current_folder,
+    get_transfers_status,
+    find_files,
+    get_recent_files,
+    turn_files_page,
+    get_drive_file,
+    get_drive_file_by_button,
 )
 
 _logger = logging.getLogger(__name__)
 
+# Searches are kept for the page buttons of their results.
+_SEARCH_TTL = 60 * 60
+# Interrupted jobs are given this long to report it to their users.
+_INTERRUPT_TIMEOUT = 5.0
+
 
 class GoogleDriveManager(Client):
     _AUTHORIZATION_MESSAGE = "Please authorize in our app with your google account.\nYou have 2 minutes."
 
-    def __init__(self, db_client: DBClient, google_client: Aiogoogle):
-        super().__init__("gdrive_tg_bot", APP_CLIENT_ID, APP_API_HASH, bot_token=BOT_TOKEN)
+    def __init__(self, db_client: DBClient, google_client: GoogleClient, token_manager: TokenManager,
+                 auth_notifier: AuthNotifier, remote_transfers: RemoteTransfers = None, name: str = "gdrive_tg_bot",
+                 **client_options):
+        super().__init__(name, APP_CLIENT_ID, APP_API_HASH, bot_token=BOT_TOKEN, **client_options)
         self._db_client = db_client
         self._google_client = google_client
+        self._google_sessions = GoogleSessionCache(google_client, db_client, token_manager, auth_notifier)
+        self._transfers = TransferScheduler()
+        self._folders = FolderIndex()
+        self._quotas = QuotaCache()
+        self._upload_groups = UploadGroups()
+        self._searches = LRUCache(USER_CACHE_SIZE, _SEARCH_TTL)
+        self._spool = Spool()
+        self._media_sessions = MediaSessions(self)
+        self._downloader = ParallelDownloader(self, self._media_sessions)
+        self._uploader = ParallelUploader(self, self._media_sessions)
+        # Transfer jobs kept by this process are recorded with this id, see `JobRecovery`.
+        self._instance_id = uuid.uuid4().hex[:8]
+        # Documents are handed over to worker processes when it's set, otherwise they are transferred here.
+        self._remote_transfers = remote_transfers
+        self._draining = False
         self.__register_handlers()
 
     @property
@@ -41,12 +80,99 @@ class GoogleDriveManager(Client):
     def google(self):
         return self._google_client
 
+    @property
+    def google_sessions(self):
+        return self._google_sessions
+
+    @property
+    def transfers(self):
+        return self._transfers
+
+    @property
+    def folders(self):
+        return self._folders
+
+    @property
+    def quotas(self):
+        return self._quotas
+
+    @property
+    def upload_groups(self):
+        return self._upload_groups
+
+    @property
+    def searches(self):
+        return self._searches
+
+    @property
+    def spool(self):
+        return self._spool
+
+    @property
+    def downloader(self):
+        return self._downloader
+
+    @property
+    def uploader(self):
+        return self._uploader
+
+    @property
+    def remote_transfers(self):
+        return self._remote_transfers
+
+    @property
+    def worker_id(self):
+        return None
+
+    @property
+    def instance_id(self):
+        return self._instance_id
+
+    @property
+    def is_draining(self) -> bool:
+        return self._draining
+
+    async def start(self):
+        if TRANSFER_MODE == "spool":
+            self._spool.clear()
+        return await super().start()
+
+    async def drain(self, timeout: float = SHUTDOWN_DRAIN_TIMEOUT):
+        """Stops taking new transfers and gives the running ones `timeout` seconds to finish, interrupting the rest.
+
+        Jobs left unfinished stay in the database, so the process started next resumes them, uploads go on
+        from the last chunk Drive has confirmed. Users are told about interrupted jobs in their status messages.
+        """
+        self._draining = True
+        self._transfers.close()
+
+        if running := self._transfers.active_count:
+            _logger.info(f"[*] Waiting up to {timeout:.0f}s for {running} running transfers to finish")
+            if not await self._transfers.wait_running(timeout):
+                _logger.warning(f"[!] {self._transfers.active_count} transfers haven't finished in time, "
+                                f"interrupting them")
+
+        self._transfers.cancel_all()
+        await self._transfers.wait_running(_INTERRUPT_TIMEOUT)
+
+    async def stop(self, *args, **kwargs):
+        await self._media_sessions.close()
+        return await super().stop(*args, **kwargs)
+
     def __register_handlers(self):
         self.add_handler(MessageHandler(upload_file_to_google_drive, filters.document))
         self.add_handler(MessageHandler(set_saving_folder, filters.command("set_saving_folder")))
         self.add_handler(MessageHandler(create_folder, filters.command("create_folder")))
         self.add_handler(MessageHandler(get_current_folder, filters.command("current_folder")))
+        self.add_handler(MessageHandler(get_transfers_status, filters.command("status")))
+        self.add_handler(MessageHandler(find_files, filters.command("find")))
+        self.add_handler(MessageHandler(get_recent_files, filters.command("recent")))
+        self.add_handler(MessageHandler(get_drive_file, filters.command("get")))
         self.add_handler(MessageHandler(help_message, filters.command("help")))
+        self.add_handler(CallbackQueryHandler(cancel_transfer, filters.regex(r"^cancel:")))
+        self.add_handler(CallbackQueryHandler(make_group_public, filters.regex(r"^public_group:")))
+        self.add_handler(CallbackQueryHandler(turn_files_page, filters.regex(r"^files:")))
+        self.add_handler(CallbackQueryHandler(get_drive_file_by_button, filters.regex(r"^get:")))
         self.add_handler(CallbackQueryHandler(make_file_public))
 
     async def send_authorization_request(self, user_id, authorization_url):
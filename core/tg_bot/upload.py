@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+import logging
+from typing import AsyncIterable, Union
+
+from pyrogram import raw, types
+from pyrogram.session import Session
+
+from settings import TELEGRAM_UPLOAD_CONCURRENCY
+from core.retry import TELEGRAM_RETRY
+
+from .sessions import MediaSessions
+
+_logger = logging.getLogger(__name__)
+
+# The biggest part `upload.SaveFilePart` accepts.
+PART_SIZE = 512 * 1024
+MAX_FILE_SIZE = 2000 * 1024 * 1024
+# Bigger files have to be saved by `upload.SaveBigFilePart`, which needs the number of parts beforehand.
+_BIG_FILE_SIZE = 10 * 1024 * 1024
+
+
+class ParallelUploader:
+    """Sends documents read from async streams, saving several parts at once over media sessions of the bot's DC.
+
+    Pyrogram needs a seekable file to upload it and saves its parts one by one. Here parts are cut from
+    the stream as it comes, so at most `concurrency` of them are held in memory and nothing is stored on disk.
+    """
+
+    def __init__(self, client, sessions: MediaSessions, concurrency: int = TELEGRAM_UPLOAD_CONCURRENCY):
+        self._client = client
+        self._sessions = sessions
+        self._concurrency = concurrency
+
+    async def send_document(self, chat_id: Union[int, str], chunks: AsyncIterable[bytes], file_name: str,
+                            file_size: int, mime_type: str = None, progress=None, progress_args=()) -> types.Message:
+        """Sends `file_size` bytes of `chunks` as a document, like `send_document` does with a file."""
+        input_file = await self.save(chunks, file_name, file_size, progress, progress_args)
+        client = self._client
+        request = raw.functions.messages.SendMedia(
+            peer=await client.resolve_peer(chat_id),
+            media=raw.types.InputMediaUploadedDocument(
+                mime_type=mime_type or 'application/octet-stream',
+                file=input_file,
+                attributes=[raw.types.DocumentAttributeFilename(file_name=file_name)]
+            ),
+            random_id=client.rnd_id(),
+            message=""
+        )
+        result = await TELEGRAM_RETRY.call(lambda: client.invoke(request))
+
+        for update in result.updates:
+            if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+                return await types.Message._parse(client, update.message, {user.id: user for user in result.users},
+                                                  {chat.id: chat for chat in result.chats})
+
+    async def save(self, chunks: AsyncIterable[bytes], file_name: str, file_size: int, progress=None,
+                   progress_args=()) -> Union[raw.types.InputFile, raw.types.InputFileBig]:
+        """Saves parts of the file to Telegram, returns the reference to send it by."""
+        if not 0 < file_size <= MAX_FILE_SIZE:
+            raise ValueError(f"File size must be between 1 and {MAX_FILE_SIZE} bytes.")
+
+        is_big = file_size > _BIG_FILE_SIZE
+        part_count = -(-file_size // PART_SIZE)
+        file_id = self._client.rnd_id()
+        md5 = None if is_big else hashlib.md5()
+        sessions = await self._sessions.get_home()
+
+        pending = set()
+        part = 0
+        received = 0
+        buffer = bytearray()
+
+        async def submit(data: bytes):
+            nonlocal part, pending
+            while len(pending) >= self._concurrency:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+
+            if is_big:
+                request = raw.functions.upload.SaveBigFilePart(file_id=file_id, file_part=part,
+                                                               file_total_parts=part_count, bytes=data)
+            else:
+                request = raw.functions.upload.SaveFilePart(file_id=file_id, file_part=part, bytes=data)
+                md5.update(data)
+
+            pending.add(asyncio.ensure_future(self._save_part(sessions[part % len(sessions)], request)))
+            part += 1
+            if progress is not None:
+                await progress(min(part * PART_SIZE, file_size), file_size, *progress_args)
+
+        try:
+            async for chunk in chunks:
+                if (received := received + len(chunk)) > file_size:
+                    break
+                buffer += chunk
+                while len(buffer) >= PART_SIZE:
+                    await submit(bytes(buffer[:PART_SIZE]))
+                    del buffer[:PART_SIZE]
+
+            # Telegram would reject a file with another number of parts only after all of them are saved.
+            if received != file_size:
+                raise ValueError(f"Stream of '{file_name}' doesn't have {file_size} bytes.")
+
+            if buffer:
+                await submit(bytes(buffer))
+
+            if pending:
+                await asyncio.gather(*pending)
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if is_big:
+            return raw.types.InputFileBig(id=file_id, parts=part_count, name=file_name)
+        return raw.types.InputFile(id=file_id, parts=part_count, name=file_name, md5_checksum=md5.hexdigest())
+
+    @staticmethod
+    async def _save_part(session: Session, request) -> bool:
+        return await TELEGRAM_RETRY.call(lambda: session.invoke(request, sleep_threshold=30))
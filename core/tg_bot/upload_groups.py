@@ -0,0 +1,39 @@
+import time
+import uuid
+from typing import Union
+
+from settings import UPLOAD_GROUP_WINDOW, USER_CACHE_SIZE
+
+from core.cache import LRUCache
+
+_GROUP_TTL = 24 * 60 * 60
+
+
+class UploadGroup:
+    def __init__(self, user_id: int):
+        self.id = uuid.uuid4().hex[:16]
+        self.user_id = user_id
+        self.file_ids = []
+        self.last_added_at = time.monotonic()
+
+
+class UploadGroups:
+    """Groups documents sent by a user in one burst (albums, forwards of many files) for bulk actions."""
+
+    def __init__(self, window: float = UPLOAD_GROUP_WINDOW, max_size: int = USER_CACHE_SIZE):
+        self._window = window
+        self._groups = LRUCache(max_size, _GROUP_TTL)
+        self._current = LRUCache(max_size, window)
+
+    def group_for(self, user_id: int) -> UploadGroup:
+        if (group := self._current.get(user_id)) is None or time.monotonic() - group.last_added_at > self._window:
+            group = UploadGroup(user_id)
+            self._groups.set(group.id, group)
+
+        group.last_added_at = time.monotonic()
+        self._current.set(user_id, group)
+        return group
+
+    def get(self, group_id: str) -> Union[UploadGroup, None]:
+        return self._groups.get(group_id)
+
@@ -0,0 +1,105 @@
+import json
+import uuid
+import asyncio
+import logging
+import traceback
+
+from settings import TRANSFER_GLOBAL_LIMIT
+
+from .tg_bot import GoogleDriveManager
+from .handlers import start_stored_transfer
+from .remote import TRANSFER_QUEUE, CANCEL_CHANNEL
+
+_logger = logging.getLogger(__name__)
+
+_POP_TIMEOUT = 5.0
+
+
+class TransferWorker(GoogleDriveManager):
+    """Bot client which doesn't receive updates, but runs transfers queued by the process which does."""
+
+    def __init__(self, db_client, google_client, token_manager, auth_notifier, backend, index: int,
+                 max_jobs: int = TRANSFER_GLOBAL_LIMIT):
+        super().__init__(db_client, google_client, token_manager, auth_notifier,
+                         name=f"gdrive_tg_bot_worker_{index}", no_updates=True)
+        self._backend = backend
+        self._worker_id = self._instance_id = f"{index}.{uuid.uuid4().hex[:8]}"
+        # Jobs are taken from the shared queue only while there is room for them, the rest is left to other workers.
+        self._slots = asyncio.Semaphore(max_jobs)
+        self._consumer = None
+
+    @property
+    def worker_id(self):
+        return self._worker_id
+
+    async def start(self):
+        result = await super().start()
+        await self._backend.subscribe(CANCEL_CHANNEL, self._cancel)
+        self._consumer = asyncio.create_task(self._consume())
+        return result
+
+    async def drain(self, *args, **kwargs):
+        # Jobs left in the shared queue are taken by other workers or the ones started next.
+        await self._stop_consumer()
+        await super().drain(*args, **kwargs)
+
+    async def stop(self, *args, **kwargs):
+        await self._stop_consumer()
+        return await super().stop(*args, **kwargs)
+
+    async def _stop_consumer(self):
+        if self._consumer is not None:
+            self._consumer.cancel()
+            try:
+                await self._consumer
+            except asyncio.CancelledError:
+                pass
+            self._consumer = None
+
+    async def _consume(self):
+        while True:
+            await self._slots.acquire()
+            try:
+                while (payload := await self._backend.pop(TRANSFER_QUEUE, _POP_TIMEOUT)) is None:
+                    pass
+                job = await self._start_job(json.loads(payload))
+
+            except asyncio.CancelledError:
+                self._slots.release()
+                raise
+
+            except Exception:
+                _logger.error(traceback.format_exc())
+                self._slots.release()
+                await asyncio.sleep(1.0)
+
+            else:
+                if job is None:
+                    self._slots.release()
+                else:
+                    asyncio.create_task(self._release_slot(job))
+
+    async def _start_job(self, payload: dict):
+        if not await self.db_client.claim_transfer_job(payload['job_id'], self.instance_id):
+            # The job is cancelled or resumed by another process already.
+            return None
+
+        stored_job = await self.db_client.get_transfer_job(payload['job_id'])
+        _logger.info(f"[+] Worker {self._worker_id} took '{stored_job['file_name']}'")
+        return await start_stored_transfer(self, stored_job)
+
+    async def _release_slot(self, job):
+        try:
+            await job
+        except (asyncio.CancelledError, Exception):
+            # Failures are already reported to the user and logged by the scheduler.
+            pass
+        self._slots.release()
+
+    def _cancel(self, data: str):
+        request = json.loads(data)
+        if request['worker_id'] != self._worker_id:
+            return
+
+        if (job := self.transfers.get_job(request['job_id'])) is not None and job.user_id == request['user_id']:
+            self.transfers.cancel(job.id)
@@ -1,10 +1,14 @@
+import hmac
 import json
+import math
+import asyncio
 import logging
 
-from aiogoogle.excs import HTTPError
 from aiohttp import web
 
-from settings import G_APP_CREDS, BOT_URL
+from settings import ADMIN_TOKEN, BOT_URL, PROFILE_INTERVAL, PROFILE_MAX_DURATION, REDIRECT_URI, load_g_app_creds
+from core.metrics import REGISTRY
+from core.diagnostics import profile
 
 from .startup import startup_actions
 from .cleanup import cleanup_actions
@@ -12,8 +16,15 @@ from .cleanup import cleanup_actions
 
 _logger = logging.getLogger("GoogleAuthWebApp")
 
+_profile_lock = asyncio.Lock()
+# Shorter intervals would make the sampling itself the load, longer ones wouldn't give a useful profile.
+_PROFILE_INTERVAL_RANGE = (0.001, 1.0)
+
 
 async def handle_auth(request: web.Request):
+    # Aiogoogle is loaded by the startup, the module itself is imported by worker processes which don't use it.
+    from aiogoogle.excs import HTTPError
+
     db_client = request.app.get('db_client')
     google_client = request.app.get('google_client')
 
@@ -21,25 +32,68 @@ async def handle_auth(request: web.Request):
 
         if await db_client.is_secret_exists(secret):
             try:
-                user_creds = await google_client.oauth2.build_user_creds(grant=code, client_creds=G_APP_CREDS)
+                user_creds = await google_client.oauth2.build_user_creds(grant=code, client_creds=load_g_app_creds())
             except HTTPError as e:
                 _logger.error(str(e))
             else:
-                await db_client.save_user_creds(json.dumps(user_creds), secret=secret)
+                for user_id in await db_client.save_user_creds(json.dumps(user_creds), secret=secret):
+                    await request.app['auth_notifier'].notify(user_id)
                 raise web.HTTPFound(BOT_URL)
 
     return web.Response(text="Something went wrong.")
 
 
+async def handle_metrics(_request: web.Request):
+    return web.Response(body=REGISTRY.render().encode(),
+                        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+def _is_admin(request: web.Request) -> bool:
+    if not ADMIN_TOKEN:
+        return False
+    return hmac.compare_digest(request.headers.get('Authorization', '').encode(), f"Bearer {ADMIN_TOKEN}".encode())
+
+
+async def handle_profile(request: web.Request):
+    """Samples stacks of the process for `seconds` and returns them collapsed, `thread=loop` limits it to the loop."""
+    if not _is_admin(request):
+        # The route isn't revealed to anyone but admins.
+        raise web.HTTPNotFound()
+
+    try:
+        duration = min(float(request.query.get('seconds', 10)), PROFILE_MAX_DURATION)
+        interval = float(request.query.get('interval', PROFILE_INTERVAL))
+    except ValueError:
+        raise web.HTTPBadRequest(text="`seconds` and `interval` must be numbers.")
+
+    if not (math.isfinite(duration) and math.isfinite(interval)) or duration <= 0 or interval <= 0:
+        raise web.HTTPBadRequest(text="`seconds` and `interval` must be positive finite numbers.")
+
+    interval = min(max(interval, _PROFILE_INTERVAL_RANGE[0]), _PROFILE_INTERVAL_RANGE[1])
+
+    if _profile_lock.locked():
+        raise web.HTTPConflict(text="Another profile is being taken.")
+
+    async with _profile_lock:
+        _logger.info(f"[*] Profiling the process for {duration:.1f}s")
+        stacks = await profile(duration, interval, loop_only=request.query.get('thread') == 'loop')
+
+    return web.Response(text=stacks)
+
+
 auth_callback_path = '/'
 
 try:
-    auth_callback_path += G_APP_CREDS['redirect_uri'].split('/', 3)[3]
+    auth_callback_path += REDIRECT_URI.split('/', 3)[3]
 except IndexError:
     pass
 
 auth_app = web.Application()
-auth_app.add_routes([web.get(auth_callback_path, handle_auth)])
+auth_app.add_routes([
+    web.get(auth_callback_path, handle_auth),
+    web.get('/metrics', handle_metrics),
+    web.get('/debug/profile', handle_profile),
+])
 
 auth_app.on_startup.extend(startup_actions)
 auth_app.on_cleanup.extend(cleanup_actions)
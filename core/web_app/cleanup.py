@@ -1,15 +1,99 @@
+import asyncio
+import logging
+import functools
+import traceback
+
 from aiohttp.web import Application
 
+_logger = logging.getLogger(__name__)
+
+
+def _guarded(action):
+    """Cleanup action which only logs its failure, so the resources closed after it are closed anyway."""
+    @functools.wraps(action)
+    async def run_action(application: Application):
+        try:
+            await action(application)
+        except Exception:
+            _logger.error(traceback.format_exc())
+
+    return run_action
+
+
+async def _cancel_background_startup(application: Application):
+    if (task := application.get('background_startup')) is not None and not task.done():
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
 
-async def _db_disconnect(application: Application):
-    await application['db_client'].disconnect()
+
+# Resources are looked up with `get`, as the startup could have failed before some of them were created.
+async def _drain_transfers(application: Application):
+    # Telegram is still connected, so users are told about transfers which don't finish in time.
+    if (bot_manager := application.get('bot_manager')) is not None:
+        await bot_manager.drain()
+
+
+async def _stop_job_recovery(application: Application):
+    if (job_recovery := application.get('job_recovery')) is not None:
+        await job_recovery.stop()
 
 
 async def _stop_tg_bot(application: Application):
-    await application['bot_manager'].stop()
+    if (bot_manager := application.get('bot_manager')) is None:
+        return
 
+    if bot_manager.is_initialized:
+        await bot_manager.stop()
+    elif bot_manager.is_connected:
+        # The shutdown has interrupted its start.
+        await bot_manager.disconnect()
 
-cleanup_actions = (
-    _db_disconnect,
+
+async def _release_transfer_jobs(application: Application):
+    # Updates aren't received anymore, so no new jobs appear. The rest are resumed by the next process without
+    # waiting for their leases to expire.
+    if (bot_manager := application.get('bot_manager')) is not None and application.get('db_client') is not None:
+        await application['db_client'].release_transfer_jobs(bot_manager.instance_id)
+
+
+async def _stop_token_manager(application: Application):
+    if (token_manager := application.get('token_manager')) is not None:
+        await token_manager.stop()
+
+
+async def _close_shared_backend(application: Application):
+    if (backend := application.get('shared_backend')) is not None:
+        await backend.close()
+
+
+async def _close_google_client(application: Application):
+    if (google_client := application.get('google_client')) is not None:
+        await google_client.close()
+
+
+async def _db_disconnect(application: Application):
+    if (db_client := application.get('db_client')) is not None:
+        await db_client.disconnect()
+
+
+async def _stop_loop_monitor(application: Application):
+    if (loop_monitor := application.get('loop_monitor')) is not None:
+        await loop_monitor.stop()
+
+
+# Everything else uses the database, so it's closed last but the loop monitor.
+cleanup_actions = tuple(_guarded(action) for action in (
+    _cancel_background_startup,
+    _drain_transfers,
+    _stop_job_recovery,
     _stop_tg_bot,
-)
\ No newline at end of file
+    _release_transfer_jobs,
+    _stop_token_manager,
+    _close_shared_backend,
+    _close_google_client,
+    _db_disconnect,
+    _stop_loop_monitor,
+))
@@ -1,33 +1,196 @@
+import time
+import signal
+import asyncio
+import logging
+import traceback
+
 from aiohttp.web import Application
-from aiogoogle import Aiogoogle
 
-from settings import DB_FILE_NAME, G_APP_CREDS
+from settings import DB_FILE_NAME, load_g_app_creds
 
 from core.db import DBClient
-from core.tg_bot import GoogleDriveManager
+from core.redis import FakeRedisBackend, create_backend
+from core.metrics import STARTUP_SECONDS
+from core.diagnostics import LoopLagMonitor
+
+_logger = logging.getLogger(__name__)
+
+
+async def _start_loop_monitor(application: Application):
+    application['loop_monitor'] = loop_monitor = LoopLagMonitor()
+    loop_monitor.start()
 
 
 async def _db_connect(application: Application):
     application['db_client'] = await DBClient.connect(DB_FILE_NAME)
 
 
+# Aiogoogle and Pyrogram take most of the startup time, so they are imported only by the steps which need them.
 async def _init_google_client(application: Application):
-    google_client = Aiogoogle(client_creds=G_APP_CREDS)
+    from core.google.client import GoogleClient
+
+    g_app_creds = load_g_app_creds()
+    google_client = GoogleClient(g_app_creds)
 
-    if not google_client.oauth2.is_ready(G_APP_CREDS):
+    if not google_client.oauth2.is_ready(g_app_creds):
         raise ValueError("Bad google app credentials.")
 
+    await google_client.open()
     application['google_client'] = google_client
 
 
+async def _init_shared_backend(application: Application):
+    application['shared_backend'] = backend = create_backend()
+    if backend is not None:
+        await application['db_client'].share_invalidations(backend)
+
+
+async def _start_auth_notifier(application: Application):
+    from core.google import AuthNotifier
+
+    auth_notifier = AuthNotifier(application['shared_backend'])
+    await auth_notifier.start()
+    application['auth_notifier'] = auth_notifier
+
+
+async def _start_token_manager(application: Application):
+    from core.google import TokenManager
+
+    token_manager = TokenManager(application['google_client'], application['db_client'])
+    token_manager.start()
+    application['token_manager'] = token_manager
+
+
+def _require_shared_backend(application: Application):
+    if application['shared_backend'] is None:
+        raise ValueError("REDIS_URL must be set to run transfer workers as separate processes.")
+    if isinstance(application['shared_backend'], FakeRedisBackend):
+        # Jobs and notifications published in memory never reach the other processes.
+        raise ValueError("REDIS_URL can't be `memory://` to run transfer workers as separate processes.")
+    return application['shared_backend']
+
+
+async def _create_tg_bot(application: Application):
+    from core.tg_bot import GoogleDriveManager
+    from core.tg_bot.remote import RemoteTransfers
+
+    remote_transfers = None
+    if application.get('separate_workers'):
+        remote_transfers = RemoteTransfers(_require_shared_backend(application))
+
+    application['bot_manager'] = GoogleDriveManager(application['db_client'], application['google_client'],
+                                                    application['token_manager'], application['auth_notifier'],
+                                                    remote_transfers)
+
+
+async def _create_transfer_worker(application: Application):
+    from core.tg_bot import TransferWorker
+
+    application['bot_manager'] = TransferWorker(application['db_client'], application['google_client'],
+                                                application['token_manager'], application['auth_notifier'],
+                                                _require_shared_backend(application), application['worker_index'])
+
+
+async def _create_job_recovery(application: Application):
+    if application.get('separate_workers'):
+        # Jobs are run and resumed by the workers, the process receiving updates only queues them.
+        application['job_recovery'] = None
+        return
+
+    from core.tg_bot import JobRecovery
+    application['job_recovery'] = JobRecovery(application['bot_manager'])
+
+
+# Objects are created before the web app is started, as its state can't be changed after that.
 async def _start_tg_bot(application: Application):
-    bot_manager = GoogleDriveManager(application['db_client'], application['google_client'])
-    await bot_manager.start()
-    application['bot_manager'] = bot_manager
+    await application['bot_manager'].start()
+
+
+async def _start_job_recovery(application: Application):
+    if (job_recovery := application['job_recovery']) is not None:
+        job_recovery.start()
+
+
+async def _timed(action, application: Application):
+    step = action.__name__.lstrip('_')
+    started_at = time.perf_counter()
+    try:
+        await action(application)
+    finally:
+        application['startup_timings'][step] = duration = time.perf_counter() - started_at
+        STARTUP_SECONDS.set(duration, step=step)
+
+
+def _step(*actions):
+    """Startup action running independent `actions` at once, every one of them is timed."""
+    async def run_actions(application: Application):
+        results = await asyncio.gather(*(_timed(action, application) for action in actions), return_exceptions=True)
+        # All of them are finished before a failure is raised, so none is left running unattended.
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    return run_actions
+
+
+def _in_background(*actions):
+    """Startup action letting the web app serve while `actions` run one by one, a failure stops the process."""
+    async def run_actions(application: Application):
+        for action in actions:
+            await _timed(action, application)
+        _report_startup(application, "Telegram bot is started")
+
+    def stop_on_failure(task: asyncio.Task):
+        if not task.cancelled() and (error := task.exception()) is not None:
+            _logger.error("".join(traceback.format_exception(type(error), error, error.__traceback__)))
+            # The web app stops gracefully on SIGTERM, running the cleanup.
+            signal.raise_signal(signal.SIGTERM)
+
+    async def start(application: Application):
+        application['background_startup'] = task = asyncio.create_task(run_actions(application))
+        task.add_done_callback(stop_on_failure)
 
+    return start
 
+
+def _report_startup(application: Application, what: str):
+    breakdown = ", ".join(f"{step} {duration:.2f}s" for step, duration in application['startup_timings'].items())
+    _logger.info(f"[+] {what} in {time.perf_counter() - application['startup_started_at']:.2f}s ({breakdown})")
+
+
+async def _begin_startup(application: Application):
+    application['startup_started_at'] = time.perf_counter()
+    application['startup_timings'] = {}
+
+
+async def _report_started(application: Application):
+    _report_startup(application, "Started")
+
+
+# Steps depend only on the ones before them.
+_shared_startup_actions = (
+    _begin_startup,
+    _step(_start_loop_monitor),
+    _step(_db_connect, _init_google_client),
+    _step(_init_shared_backend, _start_token_manager),
+    _step(_start_auth_notifier),
+)
+
+# OAuth callbacks need only the shared state, so the web app serves them while the bot is connecting to Telegram.
 startup_actions = (
-    _db_connect,
-    _init_google_client,
-    _start_tg_bot,
+    *_shared_startup_actions,
+    _step(_create_tg_bot),
+    _step(_create_job_recovery),
+    _report_started,
+    _in_background(_start_tg_bot, _start_job_recovery),
+)
+
+# Transfer worker processes don't serve the web app, but share the rest of its state.
+worker_startup_actions = (
+    *_shared_startup_actions,
+    _step(_create_transfer_worker),
+    _step(_create_job_recovery),
+    _step(_start_tg_bot),
+    _step(_start_job_recovery),
+    _report_started,
 )
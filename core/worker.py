@@ -0,0 +1,60 @@
+import signal
+import asyncio
+import logging
+import multiprocessing
+
+from core.web_app.startup import worker_startup_actions
+from core.web_app.cleanup import cleanup_actions
+
+_logger = logging.getLogger(__name__)
+
+
+def run_workers(count: int):
+    """Runs `count` transfer worker processes until they are stopped by a signal."""
+    # Every worker has its own event loop and Telegram client, nothing is inherited from this process.
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=run_worker, args=(index,), name=f"transfer_worker_{index}")
+                 for index in range(count)]
+
+    def terminate(*_args):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, terminate)
+
+    for process in processes:
+        process.start()
+
+    for process in processes:
+        try:
+            process.join()
+        except KeyboardInterrupt:
+            # Workers get SIGINT from the terminal as well and stop by themselves.
+            process.join()
+
+
+def run_worker(index: int):
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(_serve(index))
+
+
+async def _serve(index: int):
+    state = {'worker_index': index}
+    stopped = asyncio.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(signal_number, stopped.set)
+
+    try:
+        for action in worker_startup_actions:
+            await action(state)
+
+        _logger.info(f"[+] Transfer worker {index} is started")
+        await stopped.wait()
+
+    finally:
+        # Every action skips resources which weren't created and logs its own failure.
+        for action in cleanup_actions:
+            await action(state)
+
+        _logger.info(f"[*] Transfer worker {index} is stopped")
@@ -1,19 +1,39 @@
 import sys
 import logging
+import argparse
 
-from aiohttp import web
+from settings import APP_API_HASH, APP_CLIENT_ID, BOT_TOKEN, TRANSFER_WORKERS
 
-from settings import APP_API_HASH, APP_CLIENT_ID, BOT_TOKEN
 
-from core.web_app import auth_app
+logger = logging.getLogger(__name__)
 
 
-logger = logging.getLogger(__name__)
+def parse_args():
+    parser = argparse.ArgumentParser(description="Google Drive Manager telegram bot.")
+    parser.add_argument(
+        "role", nargs="?", choices=("all", "web", "worker"), default="all",
+        help="`all` runs everything in one process (default), `web` runs the auth web app with the bot receiving "
+             "updates and queues transfers for `worker` processes. Separate roles require REDIS_URL."
+    )
+    parser.add_argument("--workers", type=int, default=TRANSFER_WORKERS,
+                        help="Number of transfer worker processes started by the `worker` role.")
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
+    args = parse_args()
+
     if not APP_CLIENT_ID or not APP_API_HASH or not BOT_TOKEN:
         logger.error("No telegram bot api token was given.")
         sys.exit(1)
 
-    web.run_app(auth_app, host='127.0.0.1')
+    # Every role imports only what it runs, e.g. the process supervising workers never loads the bot.
+    if args.role == "worker":
+        from core.worker import run_workers
+        run_workers(args.workers)
+    else:
+        from aiohttp import web
+        from core.web_app import auth_app
+
+        auth_app['separate_workers'] = args.role == "web"
+        web.run_app(auth_app, host='127.0.0.1')
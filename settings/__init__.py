@@ -4,7 +4,57 @@ from .settings import (
     APP_API_HASH,
     BOT_URL,
     SCOPES,
-    G_APP_CREDS,
+    REDIRECT_URI,
+    load_g_app_creds,
     DB_FILE_NAME,
+    DB_READ_POOL_SIZE,
+    DB_WRITE_BATCH_WINDOW,
+    DB_WRITE_BATCH_SIZE,
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL,
+    REDIS_URL,
+    TRANSFER_WORKERS,
     HELP_MESSAGE,
+    GOOGLE_CONNECTION_LIMIT,
+    GOOGLE_KEEPALIVE_TIMEOUT,
+    DISCOVERY_CACHE_DIR,
+    DISCOVERY_CACHE_TTL,
+    FOLDER_CACHE_SIZE,
+    FOLDER_CACHE_TTL,
+    QUOTA_CACHE_TTL,
+    TOKEN_REFRESH_MARGIN,
+    TOKEN_REFRESH_INTERVAL,
+    LOOP_LAG_THRESHOLD,
+    LOOP_LAG_INTERVAL,
+    ADMIN_TOKEN,
+    PROFILE_MAX_DURATION,
+    PROFILE_INTERVAL,
+    TRANSFER_MODE,
+    TRANSFER_GLOBAL_LIMIT,
+    TRANSFER_PER_USER_LIMIT,
+    JOB_HEARTBEAT_INTERVAL,
+    JOB_LEASE_TIMEOUT,
+    SHUTDOWN_DRAIN_TIMEOUT,
+    QUEUE_POSITION_UPDATE_INTERVAL,
+    PROGRESS_UPDATE_INTERVAL,
+    PROGRESS_EDITS_PER_SECOND,
+    STREAM_QUEUE_SIZE,
+    DOWNLOAD_PARALLEL_MIN_SIZE,
+    DOWNLOAD_MAX_CONCURRENCY,
+    DOWNLOAD_SESSIONS_PER_DC,
+    UPLOAD_CHUNK_SIZE,
+    DRIVE_UPLOAD_URL,
+    DRIVE_BATCH_URL,
+    DRIVE_FILES_URL,
+    TELEGRAM_UPLOAD_CONCURRENCY,
+    UPLOAD_GROUP_WINDOW,
+    RETRY_MAX_RETRIES,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_DELAY,
+    CIRCUIT_BREAKER_THRESHOLD,
+    CIRCUIT_BREAKER_COOLDOWN,
+    SPOOL_DIR,
+    SPOOL_MEMORY_THRESHOLD,
+    SPOOL_MAX_SIZE,
+    SPOOL_MIN_FREE_SPACE,
 )
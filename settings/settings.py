@@ -1,6 +1,8 @@
 import os
 import json
+import functools
 import dotenv
+import tempfile
 from pathlib import Path
 
 
@@ -17,13 +19,94 @@ SCOPES = [
     'https://www.googleapis.com/auth/drive.file'
 ]
 
-# Google app credentials
-_CREDS_PATH = str(BASE_DIR / "settings" / "credentials.json")
-G_APP_CREDS = json.load(open(_CREDS_PATH, "rb"))["web"]
-G_APP_CREDS['scopes'] = SCOPES
-G_APP_CREDS['redirect_uri'] = os.getenv("REDIRECT_URI")
+# Google app credentials are read on first use, so processes which don't talk to Google don't need the file.
+_CREDS_PATH = os.getenv("G_APP_CREDS_PATH", str(BASE_DIR / "settings" / "credentials.json"))
+REDIRECT_URI = os.getenv("REDIRECT_URI")
+
+
+@functools.lru_cache(maxsize=None)
+def load_g_app_creds() -> dict:
+    with open(_CREDS_PATH, "rb") as creds_file:
+        g_app_creds = json.load(creds_file)["web"]
+    g_app_creds['scopes'] = SCOPES
+    g_app_creds['redirect_uri'] = REDIRECT_URI
+    return g_app_creds
+
 
 DB_FILE_NAME = 'creds.db'
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", 4))
+DB_WRITE_BATCH_WINDOW = float(os.getenv("DB_WRITE_BATCH_WINDOW", 0.005))
+DB_WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH_SIZE", 100))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 1024))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 10 * 60))
+
+# Shared state between processes: `redis://localhost:6379/0` for several nodes, `sqlite:///shared.db` for one node
+# or `memory://` for a single process. Disabled when empty, but required to run separate transfer workers.
+REDIS_URL = os.getenv("REDIS_URL")
+TRANSFER_WORKERS = int(os.getenv("TRANSFER_WORKERS", os.cpu_count() or 1))
+
+# Google API client
+GOOGLE_CONNECTION_LIMIT = int(os.getenv("GOOGLE_CONNECTION_LIMIT", 100))
+GOOGLE_KEEPALIVE_TIMEOUT = float(os.getenv("GOOGLE_KEEPALIVE_TIMEOUT", 30.0))
+DISCOVERY_CACHE_DIR = os.getenv("DISCOVERY_CACHE_DIR")
+DISCOVERY_CACHE_TTL = int(os.getenv("DISCOVERY_CACHE_TTL", 24 * 60 * 60))
+FOLDER_CACHE_SIZE = int(os.getenv("FOLDER_CACHE_SIZE", 4096))
+FOLDER_CACHE_TTL = float(os.getenv("FOLDER_CACHE_TTL", 5 * 60))
+# Storage quota of a user is read from Drive at most once per QUOTA_CACHE_TTL seconds to check documents against it.
+QUOTA_CACHE_TTL = float(os.getenv("QUOTA_CACHE_TTL", 60))
+TOKEN_REFRESH_MARGIN = float(os.getenv("TOKEN_REFRESH_MARGIN", 5 * 60))
+TOKEN_REFRESH_INTERVAL = float(os.getenv("TOKEN_REFRESH_INTERVAL", 60))
+
+# The event loop is reported as blocked when it wakes up LOOP_LAG_THRESHOLD seconds late, it's checked every
+# LOOP_LAG_INTERVAL seconds. ADMIN_TOKEN enables `/debug/profile` for requests with `Authorization: Bearer <token>`.
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", 0.25))
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", 0.1))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+PROFILE_MAX_DURATION = float(os.getenv("PROFILE_MAX_DURATION", 60.0))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.005))
+
+# Transfers, mode is one of `stream`, `spool` or `memory`
+TRANSFER_MODE = os.getenv("TRANSFER_MODE", "stream")
+TRANSFER_GLOBAL_LIMIT = int(os.getenv("TRANSFER_GLOBAL_LIMIT", 8))
+TRANSFER_PER_USER_LIMIT = int(os.getenv("TRANSFER_PER_USER_LIMIT", 2))
+# Processes renew leases of their transfer jobs every JOB_HEARTBEAT_INTERVAL seconds, jobs with leases older than
+# JOB_LEASE_TIMEOUT seconds are resumed by another process, e.g. after a restart.
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", 15.0))
+JOB_LEASE_TIMEOUT = float(os.getenv("JOB_LEASE_TIMEOUT", 60.0))
+# On shutdown running transfers get this many seconds to finish, the rest are interrupted and resumed by the next
+# process. It should be shorter than the time the process manager waits before killing the process.
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", 20.0))
+QUEUE_POSITION_UPDATE_INTERVAL = float(os.getenv("QUEUE_POSITION_UPDATE_INTERVAL", 5.0))
+PROGRESS_UPDATE_INTERVAL = float(os.getenv("PROGRESS_UPDATE_INTERVAL", 3.0))
+PROGRESS_EDITS_PER_SECOND = float(os.getenv("PROGRESS_EDITS_PER_SECOND", 20))
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", 4))
+# Documents of DOWNLOAD_PARALLEL_MIN_SIZE bytes and bigger are downloaded by several parts at once: one more part for
+# every DOWNLOAD_PARALLEL_MIN_SIZE bytes up to DOWNLOAD_MAX_CONCURRENCY, over DOWNLOAD_SESSIONS_PER_DC connections.
+DOWNLOAD_PARALLEL_MIN_SIZE = int(os.getenv("DOWNLOAD_PARALLEL_MIN_SIZE", 10 * 1024 * 1024))
+DOWNLOAD_MAX_CONCURRENCY = int(os.getenv("DOWNLOAD_MAX_CONCURRENCY", 8))
+DOWNLOAD_SESSIONS_PER_DC = int(os.getenv("DOWNLOAD_SESSIONS_PER_DC", 4))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+DRIVE_UPLOAD_URL = os.getenv("DRIVE_UPLOAD_URL", "https://www.googleapis.com/upload/drive/v3/files")
+DRIVE_BATCH_URL = os.getenv("DRIVE_BATCH_URL", "https://www.googleapis.com/batch/drive/v3")
+DRIVE_FILES_URL = os.getenv("DRIVE_FILES_URL", "https://www.googleapis.com/drive/v3/files")
+# Files sent from Drive to Telegram are uploaded by this many parts at once.
+TELEGRAM_UPLOAD_CONCURRENCY = int(os.getenv("TELEGRAM_UPLOAD_CONCURRENCY", 8))
+UPLOAD_GROUP_WINDOW = float(os.getenv("UPLOAD_GROUP_WINDOW", 60.0))
+
+# Retries of transient Drive and Telegram errors, the delay doubles from RETRY_BASE_DELAY up to RETRY_MAX_DELAY.
+# Former UPLOAD_MAX_RETRIES and UPLOAD_RETRY_DELAY variables are still read.
+RETRY_MAX_RETRIES = int(os.getenv("RETRY_MAX_RETRIES", os.getenv("UPLOAD_MAX_RETRIES", 5)))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", os.getenv("UPLOAD_RETRY_DELAY", 1.0)))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", 60.0))
+# Drive calls of a user are paused for CIRCUIT_BREAKER_COOLDOWN seconds after this many transient errors in a row.
+CIRCUIT_BREAKER_THRESHOLD = int(os.getenv("CIRCUIT_BREAKER_THRESHOLD", 5))
+CIRCUIT_BREAKER_COOLDOWN = float(os.getenv("CIRCUIT_BREAKER_COOLDOWN", 30.0))
+
+# Spool mode keeps files up to SPOOL_MEMORY_THRESHOLD bytes in memory and bigger ones on disk.
+SPOOL_DIR = os.getenv("SPOOL_DIR", os.path.join(tempfile.gettempdir(), "gdrive_tg_bot_spool"))
+SPOOL_MEMORY_THRESHOLD = int(os.getenv("SPOOL_MEMORY_THRESHOLD", 20 * 1024 * 1024))
+SPOOL_MAX_SIZE = int(os.getenv("SPOOL_MAX_SIZE", 16 * 1024 * 1024 * 1024))
+SPOOL_MIN_FREE_SPACE = int(os.getenv("SPOOL_MIN_FREE_SPACE", 1024 * 1024 * 1024))
 
 HELP_MESSAGE = """This bot created to interact with your google drive by telegram messages.
 Just send message with attached document and it will uploaded to your google drive.
@@ -31,5 +114,10 @@ Just send message with attached document and it will uploaded to your google dri
 There are some commands to improve interaction experience:
 /help - Show help text.
 /create_folder - Create new folder inside current one.
-/set_saving_folder - Change uploading destination folder (Default is google drive root).
+/set_saving_folder - Change uploading destination folder, nested paths like `books/scifi` are supported (Default is google drive root).
+/current_folder - Show current uploading destination folder.
+/status - Show your queued and running transfers.
+/find - Find uploaded files by a part of their name or folder, e.g. `/find report 2024`.
+/recent - Show recently uploaded files.
+/get - Send a file from your google drive here by its link or id.
 """
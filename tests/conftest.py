@@ -0,0 +1,2 @@
+# Configures the environment of the fakes before test modules import the bot.
+from . import fakes  # noqa: F401
@@ -0,0 +1,61 @@
+"""Local fakes of the benchmarks, set up for tests.
+
+Settings are read on import, so the environment is configured here, before any module of the bot is imported.
+"""
+import os
+import socket
+import tempfile
+from contextlib import asynccontextmanager
+
+from aiohttp import web
+
+from benchmarks import runner
+from benchmarks.fake_google import FakeGoogle
+
+
+def _free_port() -> int:
+    with socket.socket() as free_socket:
+        free_socket.bind(('127.0.0.1', 0))
+        return free_socket.getsockname()[1]
+
+
+PORT = _free_port()
+BASE_URL = f"http://127.0.0.1:{PORT}"
+WORK_DIR = tempfile.mkdtemp(prefix="gdrive_bot_tests_")
+
+os.environ.update({
+    "RETRY_MAX_RETRIES": "3",
+    "RETRY_BASE_DELAY": "0.01",
+    "RETRY_MAX_DELAY": "0.05",
+    # Failures of one test mustn't pause calls of the next ones.
+    "CIRCUIT_BREAKER_THRESHOLD": "1000",
+    "QUEUE_POSITION_UPDATE_INTERVAL": "0.2",
+})
+runner._configure({'mode': 'stream'}, BASE_URL, WORK_DIR)
+
+
+@asynccontextmanager
+async def fake_google(fake: FakeGoogle = None):
+    """Serves `fake` (a plain `FakeGoogle` by default) at `BASE_URL` while the context is entered."""
+    fake = fake if fake is not None else FakeGoogle()
+    app_runner = web.AppRunner(fake.application(), access_log=None)
+    await app_runner.setup()
+    await web.TCPSite(app_runner, '127.0.0.1', PORT).start()
+    try:
+        yield fake
+    finally:
+        await app_runner.cleanup()
+
+
+@asynccontextmanager
+async def environment(work_dir: str):
+    """The bot wired to a real database, Google client and token manager, as the benchmarks run it."""
+    from benchmarks.scenarios import Environment
+
+    async with fake_google() as fake:
+        env = await Environment.create({'chunk_delay': 0.0}, BASE_URL, str(work_dir))
+        env.fake = fake
+        try:
+            yield env
+        finally:
+            await env.close()
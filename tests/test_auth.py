@@ -0,0 +1,68 @@
+import asyncio
+import json
+
+from core.google import AuthNotifier
+from core.google.session import GoogleSession
+from core.redis import FakeRedisBackend
+
+from .fakes import environment
+
+
+def test_notification_wakes_every_waiter_of_user():
+    async def scenario():
+        notifier = AuthNotifier()
+        waiters = [asyncio.create_task(notifier.wait(user_id, timeout=0.5)) for user_id in (1, 1, 2)]
+        await asyncio.sleep(0)
+        await notifier.notify(1)
+        return await asyncio.gather(*waiters)
+
+    assert asyncio.run(scenario()) == [True, True, False]
+
+
+def test_notification_reaches_other_process_through_backend():
+    async def scenario():
+        backend = FakeRedisBackend()
+        bot_notifier, web_notifier = AuthNotifier(backend), AuthNotifier(backend)
+        await bot_notifier.start()
+        await web_notifier.start()
+
+        bot_notifier.expect(1)
+        await web_notifier.notify(1)
+        return await bot_notifier.wait(1, timeout=0.5)
+
+    assert asyncio.run(scenario())
+
+
+def _session(env, user_id: int) -> GoogleSession:
+    return GoogleSession(env.google_client, env.db_client, env.token_manager, AuthNotifier(), user_id)
+
+
+def test_missed_notification_keeps_saved_creds(tmp_path):
+    async def scenario():
+        async with environment(tmp_path) as env:
+            session = _session(env, 1)
+            await session.get_authorization_url()
+            # Another process has saved the creds, but its notification is lost and this process has them cached
+            # from before the authorization.
+            await env.db_client.get_user_creds(1)
+            await env.db_client._write("UPDATE user_settings SET creds=? WHERE user_id=1;",
+                                       (json.dumps({'access_token': "saved"}),))
+
+            await session.wait_for_authorization(timeout=0.05)
+            return session.is_authorized(), await env.db_client.get_user_creds(1)
+
+    is_authorized, creds = asyncio.run(scenario())
+    assert is_authorized
+    assert creds == {'access_token': "saved"}
+
+
+def test_unfinished_authorization_is_dropped(tmp_path):
+    async def scenario():
+        async with environment(tmp_path) as env:
+            session = _session(env, 1)
+            await session.get_authorization_url()
+            await session.wait_for_authorization(timeout=0.05)
+            rows = await env.db_client._fetch("SELECT 1 FROM user_settings WHERE user_id=1;", ())
+            return session.is_authorized(), rows
+
+    assert asyncio.run(scenario()) == (False, None)
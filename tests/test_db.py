@@ -0,0 +1,112 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import core.db
+from core.db import DBClient
+from core.redis import FakeRedisBackend
+
+
+def _schema(file_path) -> tuple:
+    connection = sqlite3.connect(file_path)
+    try:
+        version = connection.execute("PRAGMA user_version;").fetchone()[0]
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(uploaded_files);")]
+    finally:
+        connection.close()
+    return version, columns
+
+
+def test_failed_migration_leaves_no_part_of_its_version(tmp_path, monkeypatch):
+    file_path = str(tmp_path / "test.db")
+    migrations = core.db._MIGRATIONS
+    failing = migrations[:4] + (migrations[4] + ("INSERT INTO missing VALUES (1);",),)
+
+    monkeypatch.setattr(core.db, '_MIGRATIONS', failing)
+    with pytest.raises(sqlite3.OperationalError):
+        asyncio.run(DBClient.connect(file_path))
+    version, columns = _schema(file_path)
+    assert version == 4 and 'mime_type' not in columns
+
+    async def migrate():
+        await (await DBClient.connect(file_path)).disconnect()
+
+    monkeypatch.setattr(core.db, '_MIGRATIONS', migrations)
+    asyncio.run(migrate())
+    assert _schema(file_path)[0] == len(migrations)
+
+
+def test_settings_changed_in_one_process_are_invalidated_in_others(tmp_path):
+    async def scenario():
+        backend = FakeRedisBackend()
+        first, second = [await DBClient.connect(str(tmp_path / "test.db")) for _ in range(2)]
+        invalidated = {first: [], second: []}
+        for db_client in (first, second):
+            await db_client.share_invalidations(backend)
+            db_client.add_invalidation_callback(invalidated[db_client].append)
+
+        await first.init_auth(1, "secret")
+        assert await second.get_saving_folder_id(1) is None
+        await first.set_saving_folder_id(1, "folder")
+        result = invalidated[first], invalidated[second], await second.get_saving_folder_id(1)
+
+        for db_client in (first, second):
+            await db_client.disconnect()
+        return result
+
+    first_invalidated, second_invalidated, folder_id = asyncio.run(scenario())
+    # The own publication isn't handled again, it would drop what's cached after the change.
+    assert first_invalidated == [1, 1]
+    assert second_invalidated == [1, 1]
+    assert folder_id == "folder"
+
+
+def test_settings_read_across_change_are_not_cached(tmp_path):
+    async def scenario():
+        db_client = await DBClient.connect(str(tmp_path / "test.db"))
+        await db_client.init_auth(1, "secret")
+        await db_client.set_saving_folder_id(1, "old")
+
+        fetch = db_client._fetch
+        read_done = asyncio.Event()
+
+        async def slow_fetch(*args, **kwargs):
+            result = await fetch(*args, **kwargs)
+            await read_done.wait()
+            return result
+
+        db_client._fetch = slow_fetch
+        read = asyncio.create_task(db_client.get_saving_folder_id(1))
+        await asyncio.sleep(0.01)
+        db_client._fetch = fetch
+        await db_client.set_saving_folder_id(1, "new")
+        read_done.set()
+
+        result = await read, await db_client.get_saving_folder_id(1)
+        await db_client.disconnect()
+        return result
+
+    assert asyncio.run(scenario()) == ("old", "new")
+
+
+def test_unclaimed_jobs_are_taken_after_lease_timeout(tmp_path):
+    async def scenario():
+        db_client = await DBClient.connect(str(tmp_path / "test.db"))
+        unclaimed = await db_client.create_transfer_job(1, 1, 1, 2, "file", "unique", "a.bin", None, owner=None)
+        owned = await db_client.create_transfer_job(1, 1, 3, 4, "file", "unique", "b.bin", None, owner="alive")
+
+        fresh = await db_client.claim_orphaned_transfer_jobs("recovery", 60.0, 10)
+        await asyncio.sleep(0.05)
+        await db_client.renew_transfer_jobs("alive")
+        stale = await db_client.claim_orphaned_transfer_jobs("recovery", 0.05, 10)
+        # The lost queue entry may still be popped by a worker, which has to skip the job then.
+        claimed_again = await db_client.claim_transfer_job(unclaimed['id'], "worker")
+
+        await db_client.disconnect()
+        return fresh, [job['id'] for job in stale], owned['id'], unclaimed['id'], claimed_again
+
+    fresh, stale_ids, owned_id, unclaimed_id, claimed_again = asyncio.run(scenario())
+    assert fresh == []
+    assert stale_ids == [unclaimed_id] and owned_id not in stale_ids
+    assert not claimed_again
@@ -0,0 +1,120 @@
+import asyncio
+
+from core.tg_bot.scheduler import TransferScheduler
+
+
+class _Jobs:
+    """Transfers which run until they are released, recording the order they are started in."""
+
+    def __init__(self):
+        self.started = []
+        self.positions = []
+        self._releases = {}
+
+    def run(self, name: str):
+        async def run_job(_job):
+            self.started.append(name)
+            await self._releases.setdefault(name, asyncio.Event()).wait()
+        return run_job
+
+    async def on_position(self, job, position: int):
+        self.positions.append((job.id, position))
+
+    def release(self, name: str):
+        self._releases.setdefault(name, asyncio.Event()).set()
+
+
+async def _stop(scheduler: TransferScheduler):
+    scheduler.close()
+    scheduler.cancel_all()
+    await asyncio.sleep(0.01)
+
+
+def test_jobs_of_users_are_started_in_turn():
+    async def scenario():
+        scheduler = TransferScheduler(global_limit=1, per_user_limit=1)
+        jobs = _Jobs()
+        # Everything else is queued behind it, so the order doesn't depend on the order of arrival.
+        scheduler.submit(0, jobs.run("blocker"))
+        for name in ("a1", "a2", "a3", "b1", "b2", "c1"):
+            scheduler.submit(ord(name[0]), jobs.run(name))
+        await asyncio.sleep(0)
+
+        while len(jobs.started) < 7:
+            jobs.release(jobs.started[-1])
+            await asyncio.sleep(0.01)
+        await _stop(scheduler)
+        return list(jobs.started)
+
+    # A user goes to the end of the line after every started job.
+    assert asyncio.run(scenario()) == ["blocker", "a1", "b1", "c1", "a2", "b2", "a3"]
+
+
+def test_jobs_are_limited_per_user_and_globally():
+    async def scenario():
+        scheduler = TransferScheduler(global_limit=3, per_user_limit=2)
+        jobs = _Jobs()
+        for name in ("a1", "a2", "a3", "b1", "b2", "c1"):
+            scheduler.submit(ord(name[0]), jobs.run(name))
+        await asyncio.sleep(0)
+        started_first = list(jobs.started)
+
+        jobs.release("a1")
+        await asyncio.sleep(0.01)
+        result = started_first, list(jobs.started), scheduler.active_count, scheduler.queued_count
+        await _stop(scheduler)
+        return result
+
+    started_first, started, active_count, queued_count = asyncio.run(scenario())
+    assert started_first == ["a1", "a2", "b1"]
+    # The user has a free slot again and is the first in line, while the global cap holds the rest.
+    assert started == ["a1", "a2", "b1", "a3"]
+    assert (active_count, queued_count) == (3, 2)
+
+
+def test_cancelled_queued_job_is_never_started():
+    async def scenario():
+        scheduler = TransferScheduler(global_limit=1, per_user_limit=1)
+        jobs = _Jobs()
+        scheduler.submit(1, jobs.run("first"))
+        queued = scheduler.submit(2, jobs.run("cancelled"))
+        scheduler.submit(3, jobs.run("last"))
+        await asyncio.sleep(0)
+
+        assert scheduler.cancel(queued.id)
+        jobs.release("first")
+        await asyncio.sleep(0.01)
+        jobs.release("last")
+        await asyncio.sleep(0.01)
+        await _stop(scheduler)
+        return list(jobs.started), queued
+
+    started, queued = asyncio.run(scenario())
+    assert started == ["first", "last"]
+    assert queued._done.cancelled()
+
+
+def test_throttled_position_is_sent_after_interval():
+    async def scenario():
+        scheduler = TransferScheduler(global_limit=1, per_user_limit=1)
+        jobs = _Jobs()
+        submitted = [scheduler.submit(user_id, jobs.run(str(user_id)), jobs.on_position) for user_id in range(3)]
+        await asyncio.sleep(0.01)
+        initial = list(jobs.positions)
+
+        jobs.release("0")
+        await asyncio.sleep(0.01)
+        throttled = list(jobs.positions)
+        await asyncio.sleep(0.3)
+
+        for user_id in range(3):
+            jobs.release(str(user_id))
+        await _stop(scheduler)
+        return submitted, initial, throttled, list(jobs.positions)
+
+    submitted, initial, throttled, positions = asyncio.run(scenario())
+    second, third = submitted[1].id, submitted[2].id
+    assert initial == [(second, 1), (third, 2)]
+    # Positions changed right after the first notification are sent once the interval has passed.
+    assert throttled == initial
+    assert positions[2:] == [(third, 1)]
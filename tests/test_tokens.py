@@ -0,0 +1,51 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from .fakes import environment
+
+TOKEN_CALL = "POST /token"
+
+
+async def _expired_creds(env) -> dict:
+    (user_id,) = await env.add_users(1, expires_in=-60)
+    return await env.db_client.get_user_creds(user_id)
+
+
+def test_concurrent_refreshes_share_one_request(tmp_path):
+    async def scenario():
+        async with environment(tmp_path) as env:
+            creds = await _expired_creds(env)
+            results = await asyncio.gather(*(env.token_manager.get_fresh_creds(1, creds) for _ in range(5)))
+            return results, env.fake._calls[TOKEN_CALL], await env.db_client.get_user_creds(1)
+
+    results, token_calls, stored_creds = asyncio.run(scenario())
+    assert token_calls == 1
+    assert len({new_creds['access_token'] for new_creds in results}) == 1
+    assert stored_creds['access_token'] == results[0]['access_token'] != "token_1"
+
+
+def test_fresh_creds_are_used_without_refresh(tmp_path):
+    async def scenario():
+        async with environment(tmp_path) as env:
+            (user_id,) = await env.add_users(1)
+            creds = await env.db_client.get_user_creds(user_id)
+            return await env.token_manager.get_fresh_creds(user_id, creds), env.fake._calls[TOKEN_CALL]
+
+    creds, token_calls = asyncio.run(scenario())
+    assert (creds['access_token'], token_calls) == ("token_1", 0)
+
+
+def test_rejected_token_is_replaced_once(tmp_path):
+    async def scenario():
+        async with environment(tmp_path) as env:
+            (user_id,) = await env.add_users(1)
+            creds = await env.db_client.get_user_creds(user_id)
+            # Both requests were sent with the same token, the second one finds it replaced already.
+            first = await env.token_manager.replace_rejected(user_id, creds)
+            second = await env.token_manager.replace_rejected(user_id, creds)
+            return first, second, env.fake._calls[TOKEN_CALL]
+
+    first, second, token_calls = asyncio.run(scenario())
+    assert token_calls == 1
+    assert first['access_token'] == second['access_token'] != "token_1"
+    assert datetime.fromisoformat(first['expires_at']) > datetime.utcnow() + timedelta(minutes=30)
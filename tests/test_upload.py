@@ -0,0 +1,151 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+from aiohttp import ClientSession, web
+
+from benchmarks.fake_google import FakeGoogle
+from core.db import DBClient
+from core.google.upload import ResumableUpload, UploadError
+
+from .fakes import fake_google
+
+CHUNK_SIZE = 256 * 1024
+DATA = os.urandom(5 * CHUNK_SIZE + 1000)
+UPLOAD_CALL = "PUT /upload/session/{session_id}"
+SESSION_CALL = "POST /upload/drive/v3/files"
+
+
+async def _access_token(_rejected: bool) -> str:
+    return "token"
+
+
+async def _chunks(data: bytes, offset: int = 0, fail_after: int = None):
+    for index, start in enumerate(range(offset, len(data), CHUNK_SIZE)):
+        if index == fail_after:
+            raise ConnectionError("The source is broken.")
+        yield data[start:start + CHUNK_SIZE]
+
+
+class _PartialFakeGoogle(FakeGoogle):
+    """Persists only the first half of every chunk but the last one, as Drive is allowed to."""
+
+    async def _upload_chunk(self, request: web.Request):
+        session = self._sessions[request.match_info['session_id']]
+        data = await request.read()
+        if data and session['received'] + len(data) < session['total']:
+            data = data[:len(data) // 2]
+        session['md5'].update(data)
+        session['received'] += len(data)
+
+        if session['received'] == session['total']:
+            return web.json_response(self._new_file(session['metadata'], session['md5'].hexdigest()))
+        return web.Response(status=308, headers={'Range': f"bytes=0-{session['received'] - 1}"})
+
+
+class _StalledFakeGoogle(FakeGoogle):
+    """Answers every chunk with 308 without persisting anything."""
+
+    async def _upload_chunk(self, request: web.Request):
+        await request.read()
+        return web.Response(status=308)
+
+
+class _ExpiringTokenFakeGoogle(FakeGoogle):
+    """Rejects the first token once a chunk has been received with it."""
+
+    def __init__(self):
+        super().__init__()
+        self.tokens = []
+
+    async def _upload_chunk(self, request: web.Request):
+        self.tokens.append(token := request.headers['Authorization'])
+        if token == "Bearer old" and any(session['received'] for session in self._sessions.values()):
+            await request.read()
+            return web.Response(status=401)
+        return await super()._upload_chunk(request)
+
+
+async def _upload(http: ClientSession, data: bytes = DATA, **kwargs) -> dict:
+    upload = ResumableUpload(http, kwargs.pop('access_token', _access_token), chunk_size=CHUNK_SIZE, **kwargs)
+    await upload.open({'name': 'file.bin'}, len(data))
+    return await upload.upload(_chunks(data))
+
+
+def test_upload_sends_file_in_chunks(tmp_path):
+    async def scenario():
+        db_client = await DBClient.connect(str(tmp_path / "test.db"))
+        try:
+            async with fake_google() as fake, ClientSession() as http:
+                result = await _upload(http, db_client=db_client, upload_key="key")
+                assert fake._calls[UPLOAD_CALL] == 6
+                assert await db_client.get_upload_session("key") is None
+        finally:
+            await db_client.disconnect()
+        return result
+
+    assert asyncio.run(scenario())['md5Checksum'] == hashlib.md5(DATA).hexdigest()
+
+
+def test_upload_resends_part_drive_has_not_persisted():
+    async def scenario():
+        async with fake_google(_PartialFakeGoogle()), ClientSession() as http:
+            return await _upload(http)
+
+    assert asyncio.run(scenario())['md5Checksum'] == hashlib.md5(DATA).hexdigest()
+
+
+def test_upload_resumes_stored_session(tmp_path):
+    async def scenario():
+        db_client = await DBClient.connect(str(tmp_path / "test.db"))
+        try:
+            async with fake_google() as fake, ClientSession() as http:
+                broken = ResumableUpload(http, _access_token, db_client, "key", chunk_size=CHUNK_SIZE)
+                await broken.open({'name': 'file.bin'}, len(DATA))
+                with pytest.raises(ConnectionError):
+                    await broken.upload(_chunks(DATA, fail_after=2))
+
+                resumed = ResumableUpload(http, _access_token, db_client, "key", chunk_size=CHUNK_SIZE)
+                offset = await resumed.open({'name': 'file.bin'}, len(DATA))
+                result = await resumed.upload(_chunks(DATA, offset))
+
+                assert offset == 2 * CHUNK_SIZE
+                assert fake._calls[SESSION_CALL] == 1
+        finally:
+            await db_client.disconnect()
+        return result
+
+    assert asyncio.run(scenario())['md5Checksum'] == hashlib.md5(DATA).hexdigest()
+
+
+def test_upload_fails_when_session_stops_accepting_chunks():
+    async def scenario():
+        async with fake_google(_StalledFakeGoogle()), ClientSession() as http:
+            await _upload(http)
+
+    with pytest.raises(UploadError):
+        asyncio.run(scenario())
+
+
+def test_upload_repeats_rejected_request_with_new_token():
+    token = "old"
+    requested = []
+
+    async def access_token(rejected: bool) -> str:
+        nonlocal token
+        requested.append(rejected)
+        if rejected:
+            token = "new"
+        return token
+
+    async def scenario():
+        async with fake_google(_ExpiringTokenFakeGoogle()) as fake, ClientSession() as http:
+            result = await _upload(http, access_token=access_token)
+            return result, fake.tokens
+
+    result, sent_tokens = asyncio.run(scenario())
+    assert result['md5Checksum'] == hashlib.md5(DATA).hexdigest()
+    assert requested.count(True) == 1
+    assert sent_tokens[:3] == ["Bearer old", "Bearer old", "Bearer new"]
+    assert set(sent_tokens[3:]) == {"Bearer new"}